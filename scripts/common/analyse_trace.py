@@ -0,0 +1,172 @@
+# Run several analyses over a single read of the instruction trace
+# Every analysis script re-reads and re-tokenises the same trace. Here the
+#   trace is read (and its registers decoded) once, in batches of records, and
+#   each batch is pushed to every analysis pass chosen (see passes.py). The
+#   passes write the same artefacts as the corresponding scripts, under the same
+#   paths as the results directory built by the Makefile.
+
+# Input : Instruction trace through stdin or a trace cache (--cache)
+# Output : Results directory holding the artefacts of every pass e.g.
+#   <output>/insn_sequences/filtered/pairs.JSON, <output>/bw/load/load-bw-4.trc
+# --isa flag : Determines the instructions we expect to see in the program; same as
+#   the --isa flag in Spike
+
+# Example to guide use:
+# Run the command : python3 scripts/common/analyse_trace.py --isa=rv32ic \
+#       -a=insn_pairs,insn_patterns,reg_accesses -o=build/example/results \
+#       < scripts/example-printf.trc
+#   while in the base directory
+
+import sys
+import os
+import argparse
+
+import numpy as np
+
+# Adding the parent directory to the python file path to
+#   allow absolute file path inclusions
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.isa_management import check_isa
+from common.trace_reader import read_trace
+from common.trace_cache import COLUMNS, intern
+from common.reg_functions import REG_NAMES
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.passes import PASSES
+
+# Default number of records in each batch pushed to the passes
+BATCH_SIZE = 1 << 16
+
+# Batch of records read from the text trace. The columns are only built when a
+#   pass asks for them, interning the opcodes and registers into the shared
+#   tables in the same way as trace_cache.py.
+class TextBatch:
+    def __init__(self, records, tables, ids):
+        self.batch = records
+        self.tables = tables
+        self.ids = ids
+        self.columns = {}
+
+    def records(self):
+        return self.batch
+
+    def column(self, name):
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = np.array(self.values(name),
+                dtype=COLUMNS[name][0])
+        return column
+
+    def values(self, name):
+        if name == "hart":
+            return [record.hart for record in self.batch]
+        if name == "pc" or name == "encoding":
+            return [int(getattr(record, name), 16) for record in self.batch]
+        if name == "opcode":
+            table, ids = self.tables["opcodes"], self.ids["opcodes"]
+            return [intern(table, ids, record.insn) for record in self.batch]
+        if name == "text":
+            table, ids = self.tables["texts"], self.ids["texts"]
+            return [intern(table, ids, record.text) for record in self.batch]
+        # Register columns, -1 where the instruction doesn't use that register
+        table, ids = self.tables["regs"], self.ids["regs"]
+        return [intern(table, ids, reg) if reg else -1
+            for reg in (getattr(record, name) for record in self.batch)]
+
+# Batch of records of a trace cache, the columns being slices of the memory-mapped
+#   columns and the records only built when a pass asks for them
+class CacheBatch:
+    def __init__(self, cache, start, stop):
+        self.cache = cache
+        self.start = start
+        self.stop = stop
+
+    def records(self):
+        from common.trace_cache import cache_records
+        return cache_records(self.cache, self.start, self.stop)
+
+    def column(self, name):
+        return self.cache[name][self.start:self.stop]
+
+# Generator yielding batches of the text trace. Register operands are decoded
+#   through the decode cache when given.
+def text_batches(stream, tables, batch_size, decode_cache=None):
+    ids = {name : {string : i for i, string in enumerate(table)}
+        for name, table in tables.items()}
+    records = []
+    for record in read_trace(stream, decode_cache=decode_cache):
+        records.append(record)
+        if len(records) == batch_size:
+            yield TextBatch(records, tables, ids)
+            records = []
+    if records:
+        yield TextBatch(records, tables, ids)
+
+def cache_batches(cache, batch_size):
+    length = cache["meta"]["length"]
+    for start in range(0, length, batch_size):
+        yield CacheBatch(cache, start, min(start + batch_size, length))
+
+# Read the trace once, pushing every batch to each pass, then let the passes
+#   write their results
+def run_passes(names, isa, output_dir, cache=None, stream=None, per_hart=False,
+        batch_size=BATCH_SIZE, decode_cache_size=DECODE_CACHE_SIZE, decode_stats=False):
+    decode_cache = None
+    if cache:
+        from common.trace_cache import load_cache
+        cache = load_cache(cache)
+        tables = cache["tables"]
+        batches = cache_batches(cache, batch_size)
+    else:
+        tables = {"opcodes" : [], "regs" : list(REG_NAMES), "texts" : []}
+        if any(PASSES[name].needs_regs for name in names):
+            decode_cache = DecodeCache(check_isa(isa, ["Type", "Format"]),
+                decode_cache_size)
+        batches = text_batches(sys.stdin if stream is None else stream, tables,
+            batch_size, decode_cache)
+
+    passes = [PASSES[name](output_dir, tables, isa, per_hart) for name in names]
+    for batch in batches:
+        for analysis in passes:
+            analysis.push_batch(batch)
+    for analysis in passes:
+        analysis.finish()
+
+    if decode_stats and decode_cache is not None:
+        decode_cache.report()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-a", "--analyses", help="Comma separated analysis passes \
+        to run, defaults to all of them : "+", ".join(PASSES))
+    parser.add_argument("-o", "--output", help="Results directory the artefacts \
+        of every pass are written under")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Analyse \
+        each hart separately, producing a result per hart along with the merged \
+        result")
+    parser.add_argument("-b", "--batch_size", type=int, default=BATCH_SIZE,
+        help="Number of records pushed to the passes at a time")
+    parser.add_argument("--decode_cache_size", type=int, default=DECODE_CACHE_SIZE,
+        help="Maximum number of static instructions held in the decode cache")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the \
+        hit/miss statistics of the decode cache to stderr")
+    args = parser.parse_args()
+
+    names = args.analyses.split(",") if args.analyses else list(PASSES)
+    for name in names:
+        if name not in PASSES:
+            parser.error("Unknown analysis pass "+name+", choose from "
+                +", ".join(PASSES))
+
+    run_passes(names, args.isa, args.output, args.cache, per_hart=args.per_hart,
+        batch_size=args.batch_size, decode_cache_size=args.decode_cache_size,
+        decode_stats=args.decode_stats)
+
+if __name__ == "__main__":
+    main()
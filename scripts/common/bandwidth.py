@@ -0,0 +1,274 @@
+# Calculate the load, store (and instruction fetch) bandwidth of a program for every moving average
+#   window size in a single pass
+# The byte stream of each key (the number of bytes loaded or stored by each
+#   instruction) is formed once and turned into a cumulative sum. The sum over
+#   any window is then the difference of two entries of the cumulative sum, so
+#   every window size costs O(n) no matter how large the window is, instead of
+#   re-reading the stream and convolving it once per window size. The streams
+#   are formed and averaged one batch of instructions at a time, only carrying
+#   the last values of each window over to the next batch, so memory doesn't
+#   grow with the trace.
+# The averages follow the same 'same' mode edge handling as moving_average.py:
+#   one value per instruction, windows centred on the instruction and cut short
+#   at either end of the trace.
+
+# Input : Instruction trace through stdin, a trace cache (--cache) or a byte
+#   stream printed by key_stream.py (--stream)
+# Output : One moving average trace per key and window size, in the same format
+#   as moving_average.py, e.g. <output>/load/load-bw-4.trc
+# --isa flag : Determines the instructions we expect to see in the program; same as
+#   the --isa flag in Spike
+
+# Example to guide use:
+# Run the command : python3 scripts/common/bandwidth.py --isa=rv32ic \
+#       -o=build/example/bw < scripts/example-printf.trc
+#   while in the base directory
+
+import sys
+import os
+import argparse
+
+import numpy as np
+
+# Adding the parent directory to the python file path to
+#   allow absolute file path inclusions
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.isa_management import check_isa
+from common.trace_reader import open_trace
+from common.transitions import intern_batches, BATCH_SIZE
+
+# Name of the output subdirectory and files for each key
+KEY_NAMES = {"Ld" : "load", "St" : "store", "Fetch" : "fetch"}
+# Window sizes used by the Makefile
+DEFAULT_WINDOWS = [2, 4, 8, 16, 32, 64, 128]
+
+# Number of bytes fetched for each instruction, 2 for compressed encodings (the
+#   lowest two bits aren't 11) and 4 otherwise
+def fetch_bytes(encodings):
+    return np.where((np.asarray(encodings, dtype=np.int64) & 3) == 3, 4, 2)
+
+# Byte streams of several keys from a single pass over the trace, yielded one
+#   batch of instructions at a time so that they can be written out as the trace
+#   is read without holding the whole trace. The trace is reduced to an array of
+#   opcode ids, and each key is an array of values indexed by opcode id (0 for
+#   instructions that aren't in the ISA dictionary). The Fetch key isn't in the
+#   CSV values, it's derived from the encodings instead. Yields a dictionary of
+#   key -> integer array, one value per instruction of the batch.
+def byte_stream_batches(keys, isa, cache=None, stream=None, batch_size=BATCH_SIZE):
+    dicts = key_dicts(keys, isa)
+    if cache:
+        from common.trace_cache import load_cache
+        cache = load_cache(cache)
+        labels = cache["tables"]["opcodes"]
+        for start in range(0, cache["meta"]["length"], batch_size):
+            batch = slice(start, start + batch_size)
+            yield key_streams(keys, isa, cache["opcode"][batch], labels,
+                cache["encoding"][batch], dicts)
+        return
+
+    fetch = "Fetch" in keys
+    labels = []
+    encodings = []
+    def insns(records):
+        for record in records:
+            if fetch:
+                encodings.append(int(record.encoding, 16))
+            yield record.insn
+    # Each batch of ids is yielded once its last record has been read, so the
+    #   encodings gathered by then are the ones of that batch
+    for opcodes in intern_batches(insns(open_trace(stream=stream)), labels, batch_size):
+        yield key_streams(keys, isa, opcodes, labels, np.array(encodings, dtype=np.int64),
+            dicts)
+        encodings.clear()
+
+# Value of each instruction for every key taken from the CSV values, None for the
+#   Fetch key
+def key_dicts(keys, isa):
+    return {key : None if key == "Fetch" else check_isa(isa, key) for key in keys}
+
+# Byte streams of the keys given the array of opcode ids, the name of each opcode
+#   id and the encodings (only used by the Fetch key). dicts holds the values of
+#   every key when already looked up with key_dicts().
+def key_streams(keys, isa, opcodes, labels, encodings=None, dicts=None):
+    opcodes = np.asarray(opcodes, dtype=np.int64)
+    streams = {}
+    for key in keys:
+        if key == "Fetch":
+            streams[key] = fetch_bytes(encodings)
+            continue
+        key_dict = check_isa(isa, key) if dicts is None else dicts[key]
+        lookup = np.array([int(key_dict.get(insn, 0)) for insn in labels], dtype=np.int64)
+        streams[key] = lookup[opcodes] if len(opcodes) else np.zeros(0, dtype=np.int64)
+    return streams
+
+# Binary array of the byte streams, one column per key in the given order, as
+#   written by key_stream.py in the npy and raw formats
+def stream_array(keys, streams):
+    return np.column_stack([streams[key] for key in keys]).astype("<u2")
+
+# Byte stream printed by key_stream.py, skipping its header line
+def read_byte_stream(stream):
+    stream.readline()
+    return np.array([float(line) for line in stream if line.strip()])
+
+# Moving average of the values for a single window size, matching
+#   np.convolve(values, [1]*window, 'same') / window
+#   csum is the cumulative sum of the values starting with 0, so that the sum of
+#   values[lo:hi] is csum[hi] - csum[lo]
+def moving_average(values, window, csum=None):
+    n = len(values)
+    if n == 0:
+        return np.zeros(0)
+    if csum is None:
+        csum = np.concatenate(([0], np.cumsum(values)))
+    # 'same' keeps the centre max(n, window) values of the full convolution,
+    #   where full[k] is the sum of values[k-window+1 : k+1]
+    k = np.arange(max(n, window)) + (min(n, window) - 1) // 2
+    hi = np.minimum(k, n - 1) + 1
+    lo = np.maximum(k - window + 1, 0)
+    return (csum[hi] - csum[lo]) / window
+
+# Moving average of a stream of values pushed one batch at a time, giving the
+#   same values as moving_average() over the whole stream. Only the last window-1
+#   values are carried over to the next batch (in the same way as the ring
+#   buffer of moving_average_stream() in moving_average.py), each average being
+#   given out once the value at the end of its window has been pushed.
+class MovingAverage:
+    def __init__(self, window):
+        self.window = window
+        self.half = (window - 1) // 2
+        self.tail = np.zeros(0, dtype=np.int64)
+        self.length = 0 # Number of values pushed
+        self.done = 0 # Number of averages given out
+
+    # Averages from the next one up to stop (excluded), values holding the
+    #   stream from position start on
+    def averages(self, values, start, stop):
+        csum = np.concatenate(([0], np.cumsum(values)))
+        positions = np.arange(self.done, stop)
+        hi = np.minimum(positions + self.half, self.length - 1) + 1
+        lo = np.maximum(positions + self.half - self.window + 1, 0)
+        self.done = stop
+        return (csum[hi - start] - csum[lo - start]) / self.window
+
+    # Push the next batch of values, returning the averages completed by it
+    def push(self, values):
+        start = self.length - len(self.tail)
+        values = np.concatenate((self.tail, values))
+        self.length = start + len(values)
+        self.tail = values[max(len(values) - self.window + 1, 0):]
+        # The averages can only be given out once a full window has been pushed,
+        #   as shorter streams are centred differently
+        if self.length < self.window:
+            return np.zeros(0)
+        return self.averages(values, start, self.length - self.half)
+
+    # Remaining averages at the end of the stream, the trailing windows being cut
+    #   short
+    def finish(self):
+        if self.length < self.window:
+            return moving_average(self.tail, self.window)
+        return self.averages(self.tail, self.length - len(self.tail), self.length)
+
+# Writes the moving averages of every key and window size to
+#   <output>/<name>/<name>-bw-<window>.trc, in the format printed by
+#   moving_average.py, as the byte streams are pushed one batch at a time
+class BandwidthWriter:
+    def __init__(self, output_dir, keys, windows):
+        self.outputs = []
+        for key in keys:
+            name = KEY_NAMES.get(key, key.lower())
+            key_dir = os.path.join(output_dir, name)
+            os.makedirs(key_dir, exist_ok=True)
+            for window in windows:
+                output = open(os.path.join(key_dir, name+"-bw-"+str(window)+".trc"), 'w')
+                output.write("Byte stream trace, moving average window size = "
+                    +str(window)+"\n")
+                self.outputs.append((key, MovingAverage(window), output))
+
+    # Push the next batch of every key's byte stream
+    def push(self, streams):
+        for key, average, output in self.outputs:
+            write_averages(output, average.push(streams[key]))
+
+    def close(self):
+        for _, average, output in self.outputs:
+            write_averages(output, average.finish())
+            if average.length == 0:
+                output.write("\n")
+            output.close()
+
+def write_averages(output, averages):
+    if len(averages):
+        output.write("\n".join(map(str, averages.tolist()))+"\n")
+
+# Write every window size of a key to <output>/<name>/<name>-bw-<window>.trc
+def write_bandwidth(output_dir, key, values, windows):
+    writer = BandwidthWriter(output_dir, [key], windows)
+    writer.push({key : values})
+    writer.close()
+
+# Writes the byte streams of the keys to a .npy file one batch at a time, one
+#   column per key as in stream_array(). The header is written for an empty
+#   array first and rewritten in place with the final number of rows once the
+#   streams end, NumPy leaving room in the header for the shape to grow.
+class StreamArrayWriter:
+    def __init__(self, path, keys):
+        self.keys = keys
+        self.rows = 0
+        self.output = open(path, 'wb')
+        self.write_header()
+        self.header_size = self.output.tell()
+
+    def write_header(self):
+        np.lib.format.write_array_header_1_0(self.output, {"descr" : "<u2",
+            "fortran_order" : False, "shape" : (self.rows, len(self.keys))})
+
+    # Push the next batch of every key's byte stream
+    def push(self, streams):
+        values = stream_array(self.keys, streams)
+        self.output.write(values.tobytes())
+        self.rows += len(values)
+
+    def close(self):
+        self.output.seek(0)
+        self.write_header()
+        assert self.output.tell() == self.header_size, "The .npy header changed size"
+        self.output.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-k", "--keys", default="Ld,St", help="Comma separated keys \
+        from the CSV values to form the byte streams of, or Fetch for the \
+        instruction fetch bytes, defaults to Ld,St")
+    parser.add_argument("-n", "--windows", help="Comma separated moving average \
+        window sizes, defaults to 2,4,8,16,32,64,128")
+    parser.add_argument("-o", "--output", help="Output directory, each key is \
+        written to its own subdirectory e.g. load/load-bw-4.trc")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-s", "--stream", action="store_true", help="Read a byte \
+        stream printed by key_stream.py on stdin instead of the instruction trace, \
+        only a single key can be given")
+    args = parser.parse_args()
+
+    keys = args.keys.split(",")
+    windows = [int(n) for n in args.windows.split(",")] if args.windows else DEFAULT_WINDOWS
+
+    if args.stream:
+        assert len(keys) == 1, "A byte stream only holds the values of a single key"
+        write_bandwidth(args.output, keys[0], read_byte_stream(sys.stdin), windows)
+        return
+
+    writer = BandwidthWriter(args.output, keys, windows)
+    for streams in byte_stream_batches(keys, args.isa, args.cache):
+        writer.push(streams)
+    writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# Basic-block compression of the instruction trace for counting patterns
+# Loops execute the same straight-line runs of instructions over and over, and
+#   counting every pattern of every dynamic instruction recounts the same
+#   windows each time round. Here the PC stream is split into blocks wherever
+#   the next PC isn't the one right after the current instruction (a taken
+#   branch or a jump), and each block is identified by its start PC and length.
+#   As the code doesn't change, every execution of a block runs the same
+#   instructions, so the trace reduces to a compact sequence of block ids along
+#   with how often each block is executed.
+# Patterns are then counted from the blocks instead of the dynamic stream:
+#   - Windows lying within a block are counted once per static block and
+#   multiplied by the number of times the block is executed
+#   - Windows crossing into the following blocks only depend on the block they
+#   start in and the blocks after it (as many as are needed to fill the largest
+#   window), so each distinct run of blocks is expanded once and multiplied by
+#   the number of times it occurs
+# The counts are the same as pushing the whole stream through NgramCounter, with
+#   the patterns in the same (first seen) order, but the work depends on the
+#   number of distinct blocks rather than on the length of the trace.
+# A stream read from stdin is counted one chunk at a time (see
+#   ChunkedBlockNgrams) rather than being held in memory as a whole.
+
+from collections import namedtuple
+from itertools import islice
+
+import numpy as np
+
+from common.ngram import NgramCounter
+
+# Number of trace records compressed at a time when counting a stream in chunks
+CHUNK_SIZE = 1 << 16
+
+# Compressed trace
+#   - sequence : Static block id of every dynamic block, in trace order
+#   - starts : Index of the first instruction of every dynamic block, followed
+#   by the number of instructions in the trace
+#   - counts : Number of times each static block is executed
+#   - first : Index of the first dynamic block executing each static block
+BlockTrace = namedtuple("BlockTrace", ["sequence", "starts", "counts", "first"])
+
+# Size in bytes of every instruction, 2 for the compressed encodings (lowest
+#   two bits not set) and 4 otherwise
+def instruction_sizes(encodings):
+    encodings = np.asarray(encodings, dtype=np.uint32)
+    return np.where((encodings & 3) == 3, 4, 2).astype(np.uint64)
+
+# np.unique over the rows of a matrix of non-negative integers below radix.
+#   Each row is packed into a single integer key when the keys fit into 63 bits,
+#   as sorting the rows themselves is much slower. Returns the distinct rows along
+#   with the index of the first occurrence of each, the index of the distinct row
+#   of every row and how often each occurs.
+def unique_rows(rows, radix):
+    if radix ** rows.shape[1] >= 1 << 63:
+        distinct, first, inverse, counts = np.unique(rows, axis=0, return_index=True,
+            return_inverse=True, return_counts=True)
+        return distinct, first, inverse.reshape(-1), counts
+    keys = np.zeros(len(rows), dtype=np.int64)
+    for column in range(rows.shape[1]):
+        keys = keys * radix + rows[:, column]
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True,
+        return_counts=True)
+    return rows[first], first, inverse.reshape(-1), counts
+
+# Split the PC stream into blocks and number the distinct blocks in the order
+#   they're first executed
+def compress_blocks(pcs, sizes):
+    pcs = np.asarray(pcs, dtype=np.uint64)
+    if len(pcs) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return BlockTrace(empty, np.zeros(1, dtype=np.int64), empty, empty)
+    breaks = np.flatnonzero(pcs[1:] != pcs[:-1] + sizes[:-1]) + 1
+    starts = np.concatenate(([0], breaks, [len(pcs)])).astype(np.int64)
+
+    # Block key of start PC and length, renumbered in first execution order
+    keys = np.stack((pcs[starts[:-1]].astype(np.int64), np.diff(starts)), axis=1)
+    _, first, inverse, _ = unique_rows(keys, int(keys.max()) + 1)
+    order = np.argsort(first, kind='stable')
+    renumber = np.empty(len(order), dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+    sequence = renumber[inverse]
+    return BlockTrace(sequence, starts, np.bincount(sequence), first[order])
+
+# Add count to the counter of the pattern, keeping the position of its first
+#   occurrence
+def add_pattern(counts, first, code, count, position):
+    if code in counts:
+        counts[code] += count
+        if position < first[code]:
+            first[code] = position
+    else:
+        counts[code] = count
+        first[code] = position
+
+# Pack the ids of a window into a single integer key, in the same way as
+#   NgramCounter
+def pack(window, bits):
+    code = 0
+    for token_id in window:
+        code = (code << bits) | token_id
+    return code
+
+# Add the patterns of every size in sizes (ascending) over a stream of token ids
+#   to counts and firsts (size -> {packed key : counter} and {packed key :
+#   position of the first occurrence}). offsets gives the position in the token
+#   stream of every instruction's tokens (followed by the number of tokens), as
+#   an instruction may push any number of tokens e.g. its registers. Every
+#   instruction pushes one token when offsets is None. base is the position of
+#   the first token in the whole stream.
+def add_block_ngrams(counts, firsts, tokens, blocks, sizes, bits=16, offsets=None,
+        base=0):
+    tokens = np.asarray(tokens, dtype=np.int64)
+    if len(blocks.sequence) == 0:
+        return
+
+    # Token range of every dynamic block and of every static block
+    ends = blocks.starts if offsets is None else np.asarray(offsets)[blocks.starts]
+    token_starts, token_ends = ends[:-1], ends[1:]
+    static_starts = token_starts[blocks.first].tolist()
+    static_lengths = (token_ends - token_starts)[blocks.first].tolist()
+    static_tokens = [tokens[start:start + length].tolist()
+        for start, length in zip(static_starts, static_lengths)]
+
+    # Windows within each static block
+    for block, block_tokens in enumerate(static_tokens):
+        count = int(blocks.counts[block])
+        position = base + static_starts[block]
+        for n in sizes:
+            size_counts, size_first = counts[n], firsts[n]
+            for i in range(len(block_tokens) - n + 1):
+                add_pattern(size_counts, size_first, pack(block_tokens[i:i + n], bits),
+                    count, position + i)
+
+    # Runs of blocks covering the largest window started in the last token of
+    #   each dynamic block. Block ids are shifted by one, the runs being padded
+    #   with 0. The blocks without any token (e.g. no rd register) are left out,
+    #   no window starting or ending in them, so that a run never spans more
+    #   blocks than the largest window has tokens.
+    filled = np.flatnonzero(token_ends > token_starts)
+    if len(filled) == 0:
+        return
+    dynamic = blocks.sequence[filled]
+    token_starts, token_ends = token_starts[filled], token_ends[filled]
+    need = sizes[-1] - 1
+    length = len(dynamic)
+    last = np.minimum(np.searchsorted(token_ends, token_ends + need, side='left'),
+        length - 1)
+    last = np.maximum(last, np.arange(length))
+    width = int((last - np.arange(length)).max()) + 1
+    columns = np.arange(length)[:, None] + np.arange(width)[None, :]
+    runs = np.where(columns <= last[:, None],
+        dynamic[np.minimum(columns, length - 1)] + 1, 0)
+    runs, run_first, _, run_counts = unique_rows(runs, len(blocks.counts) + 1)
+
+    # Windows starting in the first block of each distinct run and crossing
+    #   into the next ones
+    for run, first, count in zip(runs.tolist(), run_first.tolist(), run_counts.tolist()):
+        sequence = []
+        for block in run:
+            if block > 0:
+                sequence += static_tokens[block - 1]
+        block_length = static_lengths[run[0] - 1]
+        position = base + int(token_starts[first])
+        for n in sizes:
+            size_counts, size_first = counts[n], firsts[n]
+            for i in range(max(0, block_length - n + 1), block_length):
+                if i + n <= len(sequence):
+                    add_pattern(size_counts, size_first, pack(sequence[i:i + n], bits),
+                        count, position + i)
+
+# Patterns of every size in the order they first appear in the stream
+def ordered_counts(counts, firsts):
+    return {n : {code : counts[n][code] for code in sorted(counts[n], key=firsts[n].get)}
+        for n in counts}
+
+# Count the patterns of every size in window_sizes over a stream of token ids,
+#   see add_block_ngrams(). Returns a dictionary of size -> {packed key :
+#   counter}, the keys in the order they first appear in the stream.
+def count_block_ngrams(tokens, blocks, window_sizes, bits=16, offsets=None):
+    sizes = sorted(window_sizes)
+    counts = {n : {} for n in sizes}
+    firsts = {n : {} for n in sizes}
+    add_block_ngrams(counts, firsts, tokens, blocks, sizes, bits, offsets)
+    return ordered_counts(counts, firsts)
+
+# Pattern counts of a stream counted on its basic blocks one chunk at a time, so
+#   that only a chunk of the trace is held in memory. Each chunk is compressed
+#   on its own, its first and last blocks being cut at the seams, and the
+#   windows crossing a seam are counted from the last n-1 tokens of the stream
+#   before it, n being the largest size. The first occurrences are kept as
+#   positions in the whole stream, so the patterns end up in the same order as
+#   with count_block_ngrams() over the whole stream.
+class ChunkedBlockNgrams:
+    def __init__(self, window_sizes, bits=16):
+        self.sizes = sorted(window_sizes)
+        self.bits = bits
+        self.counts = {n : {} for n in self.sizes}
+        self.firsts = {n : {} for n in self.sizes}
+        self.tail = [] # Last n-1 tokens of the stream so far
+        self.position = 0 # Number of tokens of the stream so far
+
+    # Count the patterns of the next chunk of token ids, blocks being the
+    #   compressed chunk and offsets the same as for add_block_ngrams()
+    def push(self, tokens, blocks, offsets=None):
+        tokens = np.asarray(tokens, dtype=np.int64)
+        add_block_ngrams(self.counts, self.firsts, tokens, blocks, self.sizes,
+            self.bits, offsets, self.position)
+
+        # Windows starting before the chunk and ending in it
+        need = self.sizes[-1] - 1
+        window = self.tail + tokens[:need].tolist()
+        start = self.position - len(self.tail)
+        for n in self.sizes:
+            for i in range(max(0, len(self.tail) - n + 1),
+                    min(len(self.tail), len(window) - n + 1)):
+                add_pattern(self.counts[n], self.firsts[n], pack(window[i:i + n],
+                    self.bits), 1, start + i)
+
+        window = self.tail + tokens[max(len(tokens) - need, 0):].tolist()
+        self.tail = window[max(len(window) - need, 0):]
+        self.position += len(tokens)
+
+    # Dictionary of size -> {packed key : counter}, see count_block_ngrams()
+    def result(self):
+        return ordered_counts(self.counts, self.firsts)
+
+# Generator reading the trace records chunk_size at a time, passing every record
+#   to push (e.g. to intern its tokens) and yielding the compressed blocks of
+#   each chunk. The tokens pushed by the time a chunk is yielded are the ones of
+#   that chunk. Only the PCs and encodings are kept rather than the records, as
+#   holding on to that many records slows down the garbage collector.
+def block_chunks(records, push, chunk_size=CHUNK_SIZE):
+    records = iter(records)
+    while True:
+        pcs, encodings = [], []
+        for record in islice(records, chunk_size):
+            push(record)
+            pcs.append(int(record.pc, 16))
+            encodings.append(int(record.encoding, 16))
+        if not pcs:
+            return
+        yield compress_blocks(pcs, instruction_sizes(encodings))
+
+# NgramCounter holding the pattern counts of the block-compressed stream, to
+#   be rendered in the same way as a counter the stream was pushed through.
+#   table gives the token of every id.
+def block_counter(tokens, table, pcs, encodings, window_sizes, bits=16, offsets=None):
+    blocks = compress_blocks(pcs, instruction_sizes(encodings))
+    counter = NgramCounter(window_sizes, bits)
+    counter.counts = count_block_ngrams(tokens, blocks, window_sizes, bits, offsets)
+    counter.use_table(table)
+    return counter
@@ -0,0 +1,147 @@
+# Helper functions to count pairs and patterns over a trace file in parallel
+# The trace file is split into byte ranges aligned to line boundaries and each
+#   range (chunk) is counted by a worker process. Patterns crossing the seam
+#   between two chunks are counted by giving each worker a lead-in: the n-1
+#   instructions (or registers) right before its chunk. The worker counts the
+#   lead-in and chunk together and then removes the counters of the lead-in on
+#   its own, leaving exactly the patterns that end inside its chunk. Every
+#   pattern is then counted by exactly one worker and the partial counters can
+#   be merged into the same result as counting the whole trace in one go.
+
+# Trackers run on a chunk take the record iterator as their only argument (use
+#   functools.partial for any others) and return either a counter dictionary or
+#   a tuple of results (e.g. one dictionary per pattern size), so that they can
+#   be subtracted and merged. Keys keep the order in which they're first seen in
+#   the trace.
+
+import os
+from multiprocessing import Pool
+
+from common.trace_reader import read_trace, parse_trace_line
+from common.reg_functions import build_decoders
+
+# Number of bytes read at a time when looking for the lead-in of a chunk
+LEAD_BLOCK = 1 << 12
+
+# Default token counter for the lead-in, a single token per instruction
+def instruction_tokens(record):
+    return (1,)
+
+# Token counter for trackers working on the stream of rs registers and the
+#   stream of rd registers
+def reg_tokens(record):
+    rs = (1 + (1 if record.rs2 else 0)) if record.rs1 else 0
+    return (rs, 1 if record.rd else 0)
+
+# Split the file into (start, end) byte ranges, each starting at the beginning
+#   of a line
+def chunk_ranges(path, chunks):
+    size = os.path.getsize(path)
+    boundaries = [0]
+    with open(path, 'rb') as trace:
+        for i in range(1, chunks):
+            trace.seek(i * size // chunks)
+            trace.readline() # Move to the start of the next line
+            position = trace.tell()
+            if boundaries[-1] < position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# Find the byte offset where the lead-in of the chunk starting at start begins.
+#   Lines are read backwards until every token stream counted by tokens(record)
+#   holds at least overlap tokens, or the start of the file is reached.
+def lead_in_start(path, start, overlap, tokens=instruction_tokens, all_instrs=None):
+    if overlap <= 0:
+        return start
+    decoders = build_decoders(all_instrs) if all_instrs is not None else None
+    totals = None
+    position = start
+    offset = start
+    remainder = b"" # Earliest line read so far, possibly missing its beginning
+    with open(path, 'rb') as trace:
+        while offset > 0:
+            size = min(LEAD_BLOCK, offset)
+            offset -= size
+            trace.seek(offset)
+            lines = (trace.read(size) + remainder).splitlines(keepends=True)
+            remainder = lines.pop(0) if offset > 0 else b""
+
+            for line in reversed(lines):
+                position -= len(line)
+                record = parse_trace_line(line.decode(), decoders=decoders)
+                if record is None:
+                    continue
+                counts = tokens(record)
+                totals = counts if totals is None else [a+b for a, b in zip(totals, counts)]
+                if min(totals) >= overlap:
+                    return position
+    return 0
+
+# Generator yielding the lines of the file between the start and end offsets
+def read_range(path, start, end):
+    with open(path, 'rb') as trace:
+        trace.seek(start)
+        position = start
+        for line in trace:
+            if position >= end:
+                break
+            position += len(line)
+            yield line.decode()
+
+# Remove the counters of lead from full, both results of the same tracker
+def subtract_counts(full, lead):
+    if isinstance(full, tuple):
+        return tuple(subtract_counts(f, l) for f, l in zip(full, lead))
+    result = {}
+    for key, count in full.items():
+        count -= lead.get(key, 0)
+        if count:
+            result[key] = count
+    return result
+
+# Merge the results of every chunk, in the order of the chunks in the file
+def merge_results(results):
+    if isinstance(results[0], tuple):
+        return tuple(merge_results([r[i] for r in results]) for i in range(len(results[0])))
+    merged = {}
+    for result in results:
+        for key, count in result.items():
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+# Join a tuple of counters, one per pattern size, into a single dictionary
+def join_sizes(size_dicts):
+    patterns_dict = {}
+    for size_dict in size_dicts:
+        patterns_dict.update(size_dict)
+    return patterns_dict
+
+# Worker process function, runs the tracker on a single chunk along with its
+#   lead-in and removes the counters of the lead-in
+def count_chunk(func, path, lead_start, start, end, all_instrs):
+    full = func(read_trace(read_range(path, lead_start, end), all_instrs))
+    if lead_start == start:
+        return full
+    lead = func(read_trace(read_range(path, lead_start, start), all_instrs))
+    return subtract_counts(full, lead)
+
+# Count the trace file in chunks over a pool of worker processes and merge the
+#   counters. overlap is the number of tokens the tracker needs to see before a
+#   chunk (the largest pattern size minus one), counted with tokens(record).
+def analyse_chunks(func, path, workers=None, overlap=0, tokens=instruction_tokens,
+        all_instrs=None):
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, workers)
+
+    ranges = chunk_ranges(path, workers)
+    jobs = [(func, path, lead_in_start(path, start, overlap, tokens, all_instrs),
+        start, end, all_instrs) for start, end in ranges]
+    if len(jobs) == 1:
+        results = [count_chunk(*jobs[0])]
+    else:
+        with Pool(min(workers, len(jobs))) as pool:
+            results = pool.starmap(count_chunk, jobs)
+
+    return merge_results(results)
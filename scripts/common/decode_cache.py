@@ -0,0 +1,68 @@
+# Memoised instruction decoding keyed on the program counter and raw encoding
+# Traces are dominated by loops executing the same few static instructions over
+#   and over, so each (pc, encoding) pair is only decoded the first time it's
+#   seen. The number of cached instructions is bounded and the least recently
+#   used entry is evicted once full, so memory stays bounded even for programs
+#   with a huge static footprint.
+
+import sys
+from collections import OrderedDict
+
+from common.isa_management import Format
+from common.reg_functions import build_decoders
+
+# Default maximum number of static instructions held in the cache
+DECODE_CACHE_SIZE = 1 << 16
+
+# Entry returned for instructions that aren't in the ISA dictionary e.g. ret
+UNKNOWN = (-1, Format.NONE, "", "", "")
+
+class DecodeCache:
+    # all_instrs : ISA dictionary with at least the "Type" and "Format" keys
+    # capacity : Maximum number of (pc, encoding) entries held
+    def __init__(self, all_instrs, capacity=DECODE_CACHE_SIZE):
+        self.capacity = capacity
+        self.decoders = build_decoders(all_instrs)
+        self.ids = {insn : i for i, insn in enumerate(all_instrs)}
+        self.formats = {insn : Format.__members__.get(all_instrs[insn].get("Format") or "NONE",
+            Format.NONE) for insn in all_instrs}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Decode an instruction given the pc and encoding strings from the trace and
+    #   its name. Returns (opcode id, format, rs1, rs2, rd), the opcode id being
+    #   the index of the instruction in the ISA dictionary.
+    def decode(self, pc, encoding, insn):
+        key = (pc, encoding)
+        entries = self.entries
+        entry = entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        decoder = self.decoders.get(insn)
+        if decoder is None:
+            entry = UNKNOWN
+        else:
+            entry = (self.ids[insn], self.formats[insn]) + decoder(int(encoding, 16))
+        entries[key] = entry
+        if len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    # Print the hit/miss statistics, to stderr by default so that they don't
+    #   end up in the results on stdout
+    def report(self, stream=sys.stderr):
+        print("Decode cache : "+str(self.hits)+" hits, "+str(self.misses)+" misses ("
+            +"{:.2%}".format(self.hit_rate())+" hit rate), "+str(self.evictions)
+            +" evictions, "+str(len(self.entries))+"/"+str(self.capacity)+" entries",
+            file=stream)
@@ -0,0 +1,99 @@
+# Helper functions to split a multi-core Spike trace (spike -p<N>) by hart and
+#   analyse each hart's instruction stream in its own process.
+# Spike interleaves the instructions of every core in the trace, each line being
+#   prefixed with "core   N:". Analysing the interleaved stream would form pairs
+#   and patterns out of instructions from different cores, so the trace is
+#   demultiplexed in a single pass and each hart is analysed separately. The
+#   per-hart results are then merged into an aggregate result.
+
+import os
+import tempfile
+from multiprocessing import Pool
+
+from common.trace_reader import read_trace
+
+# Single pass through the text trace, writing each line into a file per hart
+#   in out_dir. Returns a dictionary of hart id -> trace file path.
+def demux_trace(stream, out_dir):
+    hart_files = {}
+    for line in stream:
+        words = line.split(None, 2)
+        # Only instruction lines have the "core N:" prefix
+        if len(words) < 3 or words[0] != "core":
+            continue
+        hart = int(words[1][:-1])
+        if hart not in hart_files:
+            hart_files[hart] = open(os.path.join(out_dir, "hart-"+str(hart)+".trc"), 'w')
+        hart_files[hart].write(line)
+
+    for hart_file in hart_files.values():
+        hart_file.close()
+    return {hart : hart_files[hart].name for hart in sorted(hart_files)}
+
+# Find the instruction stream of every hart. With a trace cache the harts are
+#   read straight from the memory-mapped hart column, otherwise the text trace
+#   is demultiplexed into tmp_dir.
+# Returns a dictionary of hart id -> source, to be passed to hart_records()
+def hart_sources(stream, tmp_dir, cache=None):
+    if cache:
+        import numpy as np
+        from common.trace_cache import load_cache
+        harts = np.unique(load_cache(cache)["hart"]).tolist()
+        return {hart : (cache, hart) for hart in harts}
+    return demux_trace(stream, tmp_dir)
+
+# Generator yielding the instruction stream of a single hart
+def hart_records(source, all_instrs=None):
+    if isinstance(source, tuple): # (cache directory, hart id)
+        from common.trace_cache import load_cache, cache_records
+        yield from cache_records(load_cache(source[0]), hart=source[1])
+    else:
+        with open(source, 'r') as trace:
+            yield from read_trace(trace, all_instrs)
+
+# Worker process function, runs the tracker on a single hart
+def analyse_hart(func, source, all_instrs):
+    return func(hart_records(source, all_instrs))
+
+# Run the tracker function func on every hart in a pool of worker processes.
+#   func takes the record iterator as its only argument (use functools.partial
+#   for any others) and must be defined at module level so it can be sent to
+#   the worker processes.
+# Returns a dictionary of hart id -> result of func
+def analyse_harts(func, sources, all_instrs=None, processes=None):
+    if processes is None:
+        processes = os.cpu_count()
+    processes = max(1, min(processes, len(sources)))
+
+    harts = list(sources)
+    if processes == 1:
+        results = [analyse_hart(func, sources[hart], all_instrs) for hart in harts]
+    else:
+        with Pool(processes) as pool:
+            results = pool.starmap(analyse_hart,
+                [(func, sources[hart], all_instrs) for hart in harts])
+
+    return dict(zip(harts, results))
+
+# Demultiplex the trace and analyse every hart in parallel in one go. The
+#   temporary per-hart trace files are removed once all harts are analysed.
+def analyse_trace_per_hart(func, stream, cache=None, all_instrs=None, processes=None):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sources = hart_sources(stream, tmp_dir, cache)
+        return analyse_harts(func, sources, all_instrs, processes)
+
+# Merge the counters from each hart into a single dictionary. Each result can
+#   either be a dictionary or a list of (key, counter) tuples. Keys keep the
+#   order in which they're first seen, going through the harts in order.
+def merge_counts(results):
+    merged = {}
+    for result in results:
+        items = result.items() if isinstance(result, dict) else result
+        for key, count in items:
+            merged[key] = merged.get(key, 0) + count
+    return merged
+
+# File path used for the results of a single hart e.g. pairs.JSON -> pairs-hart0.JSON
+def hart_path(path, hart):
+    root, ext = os.path.splitext(path)
+    return root + "-hart" + str(hart) + ext
@@ -1,7 +1,54 @@
 # Helper functions to manage the conversion of data from .isa CSV files into
 #   data structures to be used in scripts
+# The .isa and .reg files needed for an ISA string are compiled into a single
+#   database (see compile_isa()) which is pickled into isa/__pycache__ so that every
+#   script launch doesn't re-parse the CSV files. The cached database is rebuilt
+#   whenever one of its source files changes.
 
+import os
 import csv
+import pickle
+from array import array
+from collections import namedtuple
+from enum import IntEnum
+
+# Paths are relative to the repository rather than the working directory
+current = os.path.dirname(os.path.realpath(__file__))
+ISA_DIR = os.path.join(os.path.dirname(os.path.dirname(current)), "isa")
+CACHE_DIR = os.path.join(ISA_DIR, "__pycache__")
+# Bumped whenever the layout of the compiled database changes
+DB_VERSION = 1
+
+# Instruction formats, NONE for instructions without one (e.g. c.nop)
+class Format(IntEnum):
+    NONE = 0
+    R = 1
+    I = 2
+    S = 3
+    SB = 4
+    U = 5
+    UJ = 6
+    CR = 7
+    CI = 8
+    CSS = 9
+    CIW = 10
+    CL = 11
+    CS = 12
+    CA = 13
+    CB = 14
+    CJ = 15
+
+# Compiled ISA database
+#   - insns : Instruction names, indexed by opcode id
+#   - ids : Instruction name -> opcode id
+#   - rows : Every column from the .isa files for each instruction, by opcode id
+#   - formats : Format enum value of each instruction (array, by opcode id)
+#   - types : Type id of each instruction (array, by opcode id), index into type_names
+#   - type_names : Names of the instruction types e.g. "load"
+#   - ld, st : Number of bytes loaded/stored by each instruction (arrays, by opcode id)
+#   - regs : Register names from the .reg files
+IsaDatabase = namedtuple("IsaDatabase",
+    ["insns", "ids", "rows", "formats", "types", "type_names", "ld", "st", "regs"])
 
 # Take in the input string detailing the ISA, parse it and grab the needed dictionaries.
 # Also take in an optional keys argument which:
@@ -12,15 +59,38 @@ import csv
 #   - if is a list of strings, returns a dictionary where each instruction key has a
 #   sub dictionary where we can access multiple keys from the CSV file from.
 def check_isa(isa, keys=None, reg=False):
+    db = load_isa(isa)
+
     all_instrs = {}
-    reg_dict = {}
+    for insn, row in zip(db.insns, db.rows):
+        if not keys: # No key/key list given, form dictionary with all information
+            all_instrs[insn] = dict(row)
+        elif isinstance(keys, str):
+            all_instrs[insn] = row[keys]
+        elif isinstance(keys, list):
+            all_instrs[insn] = {k : row[k] for k in keys}
+
+    if reg:
+        reg_dict = {}
+        for name in db.regs:
+            sub_dict = reg_dict[name] = {}
+            sub_dict["rs"] = sub_dict["rd"] = 0
+        return all_instrs, reg_dict
+    else:
+        return all_instrs
+
+# Parse the ISA string and find the .isa and .reg files to include, returning
+#   the two lists of file names (without their extensions)
+def isa_sources(isa):
+    isa_files = []
+    reg_files = []
 
     #           ----- Parsing the XLEN value -----
     XLEN = isa[2:4]
     assert XLEN in ["32", "64"], "XLEN can only be 32 or 64"
 
     # Include the instructions from the isa of that word length
-    all_instrs.update(convert_csv_to_dict("rv"+str(XLEN), keys))
+    isa_files.append("rv"+str(XLEN))
     
     #      ----- Parsing the remaining characters -----
     # Dictionary to track what's been included
@@ -44,26 +114,26 @@ def check_isa(isa, keys=None, reg=False):
 
     # Check for 'g' which indicates the multiple extensions need to be included
     if isa[4].lower() == 'i':
-        reg_dict.update(convert_reg("rv"+XLEN+"i"))
+        reg_files.append("rv"+XLEN+"i")
     elif isa[4].lower() == "e":
-        reg_dict.update(convert_reg("rv"+XLEN+"e"))
+        reg_files.append("rv"+XLEN+"e")
     elif isa[4].lower() == 'g':
         pass
         # Include the extensions included with 'g'. Currently commented out for
         #   functionality purposes as the .isa files for these extensions have not
         #   yet been made. Other code is commented for the same reason below this.
 
-        # all_instrs.update(convert_csv_to_dict('m', keys))
+        # isa_files.append('m')
         # history['m'] = True
 
-        # all_instrs.update(convert_csv_to_dict('a', keys))
+        # isa_files.append('a')
         # history['a'] = True
 
-        # all_instrs.update(convert_csv_to_dict('f', keys))
+        # isa_files.append('f')
         # history['f'] = True
-        # reg_dict.update(convert_reg("f"))
+        # reg_files.append("f")
 
-        # all_instrs.update(convert_csv_to_dict('d', keys))
+        # isa_files.append('d')
         # history['d'] = True
  
     # Iterate through the remaining characters
@@ -73,8 +143,8 @@ def check_isa(isa, keys=None, reg=False):
         if (history[extension]): # Extension already detected, ignore
             continue
         else: # New extension, check for combinations
-            # Add current extension to dictionary and update history
-            all_instrs.update(convert_csv_to_dict(extension, keys))
+            # Add current extension to the list and update history
+            isa_files.append(extension)
             history[extension] = True
 
             # -- History checking, dependent on the isa string having the
@@ -84,25 +154,87 @@ def check_isa(isa, keys=None, reg=False):
             if extension == 'd':
                 pass
                 # d implies the inclusion of f which may or may not be stated
-                # all_instrs.update(convert_csv_to_dict('f', keys))
+                # isa_files.append('f')
                 # history['f'] = True
             elif extension == 'c':
                 pass
                 # if history['f']:
-                #     all_instrs.update(convert_csv_to_dict('fc', keys))
+                #     isa_files.append('fc')
                 # if history['d']:
-                #     all_instrs.update(convert_csv_to_dict('dc', keys))
+                #     isa_files.append('dc')
             # Expand upon with more combinations as we make them
 
-    if reg:
-        return all_instrs, reg_dict
-    else:
-        return all_instrs
+    return isa_files, reg_files
+
+# Paths of every source file of the ISA database
+def source_paths(isa_files, reg_files):
+    return [os.path.join(ISA_DIR, name+".isa") for name in isa_files] + \
+        [os.path.join(ISA_DIR, "reg", name+".reg") for name in reg_files]
+
+# Parse the .isa and .reg files of the ISA string into the compiled database
+def compile_isa(isa):
+    isa_files, reg_files = isa_sources(isa)
+
+    all_rows = {}
+    for name in isa_files:
+        all_rows.update(convert_csv_to_dict(name))
+    regs = []
+    for name in reg_files:
+        regs += [r for r in convert_reg(name) if r not in regs]
+
+    insns = list(all_rows)
+    type_names = []
+    types = array('B')
+    formats = array('B')
+    ld = array('B')
+    st = array('B')
+    for row in all_rows.values():
+        insn_type = row.get("Type") or ""
+        if insn_type not in type_names:
+            type_names.append(insn_type)
+        types.append(type_names.index(insn_type))
+        formats.append(Format.__members__.get(row.get("Format") or "NONE", Format.NONE))
+        ld.append(int(row.get("Ld") or 0))
+        st.append(int(row.get("St") or 0))
+
+    return IsaDatabase(insns, {insn : i for i, insn in enumerate(insns)},
+        list(all_rows.values()), formats, types, type_names, ld, st, regs)
+
+# Load the compiled database of the ISA string from the on-disk cache, compiling
+#   (and caching) it if it's missing or any of its source files have changed
+def load_isa(isa):
+    cache_path = os.path.join(CACHE_DIR, isa+".pickle")
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+        if cached["version"] == DB_VERSION and cached["isa"] == isa and \
+                all(os.stat(path).st_mtime_ns == mtime
+                    for path, mtime in cached["sources"].items()):
+            return IsaDatabase(**cached["db"])
+    except (OSError, EOFError, KeyError, TypeError, pickle.UnpicklingError):
+        pass # Missing or stale cache, rebuild it below
+
+    db = compile_isa(isa)
+    # Stored as a plain dictionary so that the cache doesn't depend on the
+    #   module path the database class was imported from
+    cached = {"version" : DB_VERSION, "isa" : isa, "db" : db._asdict(),
+        "sources" : {path : os.stat(path).st_mtime_ns for path in source_paths(*isa_sources(isa))}}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temporary file first so that parallel scripts never read
+        #   a half written cache
+        tmp_path = cache_path+"."+str(os.getpid())
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(cached, cache_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass # Read only checkout, carry on without caching
+    return db
 
 # Function to take in a CSV file and convert it into the desired dictionary format
 def convert_csv_to_dict(isa, key=None):
     test_dict = {}
-    with open("isa/"+isa+".isa", 'r') as data_file:
+    with open(os.path.join(ISA_DIR, isa+".isa"), 'r') as data_file:
         # Read in the data from the CSV file while ignoring comments 
         #   (beginning with a #) and ignoring empty lines
         data = csv.DictReader(filter(lambda row: row[0]!='#', data_file), \
@@ -128,7 +260,7 @@ def convert_csv_to_dict(isa, key=None):
 # Function to take in the reg lists and form the desired dictionary format
 def convert_reg(isa_part):
     dict_base = {}
-    with open("isa/reg/"+isa_part+".reg", 'r') as reg_file:
+    with open(os.path.join(ISA_DIR, "reg", isa_part+".reg"), 'r') as reg_file:
         for line in reg_file:
             sub_dict = dict_base[line.strip()] = {}
             sub_dict["rs"] = sub_dict["rd"] = 0
@@ -1,53 +1,108 @@
 # Analyse the instruction trace input through stdin
-# Look at the key passed in by the programmer through the --key flag and print
-#   an output trace of each instruction's value associated with that key
+# Look at the keys passed in by the programmer through the --key flag and print
+#   an output trace of each instruction's values associated with those keys
 #   to stdout.
 # Used to output the bandwidth streams.
 
 # Input : Instruction trace
-# Output : Load byte stream (to then be passed through a moving average filter)
+# Output : Byte stream of each key (to then be passed through a moving average
+#   filter), one column per key in the order they're given
+#   - text : One line per instruction with the values separated by spaces
+#   - npy : NumPy array of shape (instructions, keys)
+#   - raw : Little-endian uint16 values, row by row (the columns of each
+#   instruction are next to each other)
 # --isa flag : Determines the instructions we expect to see in the program; same as
 #   the --isa flag in Spike
+# Besides the keys from the CSV values (e.g. Ld and St), the Fetch key gives the
+#   number of bytes fetched for each instruction, 2 or 4 depending on whether
+#   its encoding is compressed.
 
 # Example to guide use:
 # Run the command : python3 scripts/common/key_stream.py --isa=rv32ic --key=Ld \
 #                   < scripts/example.trc
+#   or : python3 scripts/common/key_stream.py --isa=rv32ic --key=Ld,St,Fetch \
+#                   -f=npy -o=byte-streams.npy < scripts/example.trc
 #   while in the base directory
 
 import sys
 import argparse
 import os
 
-# Adding the parent directory to the python file path to 
+import numpy as np
+
+# Adding the parent directory to the python file path to
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
-
-from common.isa_management import check_isa
-
-# Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("--isa", help="RISC-V ISA string")
-parser.add_argument("-k", "--key", help="Key from the CSV values that we want to \
-    access the values from and print in a stream")
-args = parser.parse_args() # ISA argument stored in args.isa
-
-#   Iterate through the instruction stream and output the byte stream
-def print_key_stream(all_instrs):
-    print("Stream of values associated with the key: "+args.key)
-    for line in sys.stdin:
-        words = line.split()
-        insn_name = words[4]
-
-        if insn_name in all_instrs:
-            print(all_instrs[insn_name])
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.bandwidth import byte_stream_batches, stream_array, StreamArrayWriter
+
+# Number of instructions read and written at a time
+BLOCK_SIZE = 1 << 16
+
+# Write the streams as text, one line per instruction, one batch of streams at a
+#   time
+def write_text(output, keys, batches):
+    if len(keys) == 1:
+        output.write("Stream of values associated with the key: "+keys[0]+"\n")
+    else:
+        output.write("Stream of values associated with the keys: "+", ".join(keys)+"\n")
+
+    for streams in batches:
+        columns = [streams[key].tolist() for key in keys]
+        output.write("".join(" ".join(map(str, row))+"\n" for row in zip(*columns)))
+
+#   Iterate through the instruction stream and output the byte streams in the
+#       given format to the output file (stdout when None). The streams are
+#       written one batch at a time as the trace is read, apart from npy output
+#       to stdout, which can't go back to fill in the length in the header.
+def print_key_stream(keys, isa, cache=None, output_format="text", output_path=None):
+    batches = byte_stream_batches(keys, isa, cache, batch_size=BLOCK_SIZE)
+
+    if output_format == "text":
+        if output_path:
+            with open(output_path, 'w') as output:
+                write_text(output, keys, batches)
         else:
-            print(0) # TODO : Make sure this doesn't mess with other instruction traces
-            #    other than bandwidth stuff
+            write_text(sys.stdout, keys, batches)
+        return
+
+    if output_format == "npy" and output_path:
+        writer = StreamArrayWriter(output_path, keys)
+        for streams in batches:
+            writer.push(streams)
+        writer.close()
+        return
+
+    output = open(output_path, 'wb') if output_path else sys.stdout.buffer
+    if output_format == "npy":
+        values = [stream_array(keys, streams) for streams in batches]
+        np.save(output, np.concatenate(values) if values
+            else np.zeros((0, len(keys)), dtype="<u2"))
+    else:
+        for streams in batches:
+            output.write(stream_array(keys, streams).tobytes())
+    output.flush()
+    if output_path:
+        output.close()
 
 def main():
-    print_key_stream(check_isa(args.isa, args.key))
+    # Input argument parsing (to detect the ISA)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-k", "--key", help="Comma separated keys from the CSV values \
+        that we want to access the values from and print in a stream, or Fetch for \
+        the instruction fetch bytes")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-f", "--format", choices=["text", "npy", "raw"], default="text",
+        help="Output format, defaults to text")
+    parser.add_argument("-o", "--output", help="Output file, defaults to stdout")
+    args = parser.parse_args()
+
+    print_key_stream(args.key.split(","), args.isa, args.cache, args.format, args.output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
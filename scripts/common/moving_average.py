@@ -13,29 +13,97 @@
 #       < scripts/bandwidth/load_bw/example-load-bytes.txt \
 #       > scripts/bandwidth/load_bw/example-load-bytes-avg.txt
 #   while in the base directory
+# Add the --stream flag to write the averages out while the byte stream is still
+#   being read (e.g. behind a live Spike run in a pipeline), only holding one
+#   window of values in memory
 
 import sys
 import argparse
-import scipy
-
-# Script arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("-n", "--window", help="Moving Average window size")
-parser.add_argument("-f", "--ignore_first", \
-    help="Set to True to ignore the first line")
-args = parser.parse_args()
-
-# Moving average window function
-def moving_average_scipy(input_stream):
-    avg = scipy.convolve(input_stream, [1]*int(args.window), 'same') / int(args.window)
-    print( "Byte stream trace, moving average window size = "+args.window)
+
+# Number of averages written to stdout at a time in streaming mode
+BLOCK_SIZE = 1 << 12
+
+# Moving average window function. scipy.convolve was only ever an alias of
+#   np.convolve, which is used directly rather than importing all of SciPy.
+#   NumPy is only imported here so that the streaming mode starts up quickly.
+def moving_average_scipy(input_stream, window):
+    import numpy as np
+    avg = np.convolve(input_stream, [1]*window, 'same') / window
+    print( "Byte stream trace, moving average window size = "+str(window))
     print(*avg, sep='\n') # Print each value on a new line
     # return list(avg)
 
+# Streaming moving average using a ring buffer of the last window values and
+#   their running sum. Gives the same values as the 'same' convolution above
+#   (exactly for integer values such as byte counts): the average of value i
+#   covers values i+half-window+1 to i+half, where half = (window-1)//2, and
+#   values past either end of the stream count as 0. Each average is written
+#   once the value at the end of its window has been read.
+def moving_average_stream(input_stream, window, output=sys.stdout):
+    half = (window - 1) // 2
+    ring = [0.0] * window
+    total = 0.0
+    position = 0 # Number of values pushed into the ring buffer
+    block = []
+
+    def push(value):
+        nonlocal total, position
+        slot = position % window
+        total += value - ring[slot]
+        ring[slot] = value
+        position += 1
+        if slot == window - 1:
+            total = sum(ring) # Stop rounding errors building up over the stream
+        if position > half:
+            block.append(str(total / window))
+
+    def flush():
+        output.write("\n".join(block)+"\n")
+        output.flush()
+        block.clear()
+
+    output.write("Byte stream trace, moving average window size = "+str(window)+"\n")
+    for line in input_stream:
+        if not line.strip():
+            continue
+        push(float(line))
+        # The averages can only be written once a full window has been read,
+        #   as shorter streams are centred differently
+        if len(block) >= BLOCK_SIZE and position >= window:
+            flush()
+
+    if position < window:
+        # Stream shorter than the window, fall back to the full convolution
+        values = ring[:position]
+        block.clear()
+        if values:
+            import numpy as np
+            block.extend(map(str, np.convolve(values, [1]*window, 'same') / window))
+    else:
+        for _ in range(half): # Trailing windows cut short by the end of the stream
+            push(0.0)
+    if block:
+        flush()
+
 def main():
+    # Script arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--window", help="Moving Average window size")
+    parser.add_argument("-f", "--ignore_first", \
+        help="Set to True to ignore the first line")
+    parser.add_argument("-s", "--stream", action="store_true", help="Write the averages \
+        out as the input is read, holding only a window of values in memory")
+    args = parser.parse_args()
+
+    if args.stream:
+        if args.ignore_first:
+            sys.stdin.readline()
+        moving_average_stream(sys.stdin, int(args.window))
+        return
+
     input = sys.stdin.readlines()[1:] if args.ignore_first else sys.stdin.readlines()
     input_floats = [float(x) for x in input]
-    moving_average_scipy(input_floats)
+    moving_average_scipy(input_floats, int(args.window))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,108 @@
+# Counting engine for n-grams (patterns of n consecutive tokens) in a stream
+# Tokens (e.g. instruction names) are interned into integer ids as they arrive.
+#   For every pattern size n, the ids of the last n tokens are packed into a single
+#   integer by shifting in the newest id, so each step is a shift and mask per
+#   size rather than copying a window list and joining it into a string. Every
+#   size is counted in the same traversal of the stream and the packed keys are
+#   only rendered back into the usual "insn, insn, insn" strings at the end.
+# With a memory budget, each size is counted approximately by a Space-Saving
+#   sketch (see sketches.py) holding a bounded number of counters instead.
+
+from common.sketches import SpaceSaving
+
+class NgramCounter:
+    # window_sizes : Iterable of the pattern sizes to count
+    # bits : Number of bits used for each id in the packed keys, limits the
+    #   number of distinct tokens to 2**bits
+    # budget : Maximum number of counters held over all sizes, split evenly
+    #   between them. Counts every pattern exactly when None.
+    def __init__(self, window_sizes, bits=16, budget=None):
+        self.sizes = sorted(window_sizes)
+        self.bits = bits
+        self.tokens = [] # Intern table, id -> token
+        self.ids = {}    # token -> id
+        # Counters per pattern size, keyed on the packed ids of the pattern
+        if budget is None:
+            self.counts = {n : {} for n in self.sizes}
+        else:
+            capacity = max(1, budget // len(self.sizes))
+            self.counts = {n : SpaceSaving(capacity) for n in self.sizes}
+            self.push_id = self.push_id_approx
+        self.codes = [0] * len(self.sizes)
+        self.masks = [(1 << (bits*n)) - 1 for n in self.sizes]
+        self.pushed = 0
+
+    # Look up the id of a token, interning it if it hasn't been seen before
+    def token_id(self, token):
+        token_id = self.ids.get(token)
+        if token_id is None:
+            token_id = len(self.tokens)
+            if token_id >> self.bits:
+                raise ValueError("More than "+str(1 << self.bits)+" distinct tokens, \
+                    increase the number of bits per id")
+            self.ids[token] = token_id
+            self.tokens.append(token)
+        return token_id
+
+    # Push the id of the next token in the stream and count every pattern
+    #   that ends with it
+    def push_id(self, token_id):
+        self.pushed += 1
+        bits, codes, masks, pushed = self.bits, self.codes, self.masks, self.pushed
+        for i, n in enumerate(self.sizes):
+            code = ((codes[i] << bits) | token_id) & masks[i]
+            codes[i] = code
+            if pushed >= n: # Window of size n is full
+                size_counts = self.counts[n]
+                size_counts[code] = size_counts.get(code, 0) + 1
+
+    # Same as push_id() but updating the Space-Saving sketches
+    def push_id_approx(self, token_id):
+        self.pushed += 1
+        bits, codes, masks, pushed = self.bits, self.codes, self.masks, self.pushed
+        for i, n in enumerate(self.sizes):
+            code = ((codes[i] << bits) | token_id) & masks[i]
+            codes[i] = code
+            if pushed >= n:
+                self.counts[n].update(code)
+
+    def push(self, token):
+        self.push_id(self.token_id(token))
+
+    # Start over on a separate stream, so that no pattern is counted across the
+    #   point where the counter is reset. The counters are kept.
+    def reset(self):
+        self.codes = [0] * len(self.sizes)
+        self.pushed = 0
+
+    # Use an existing intern table (e.g. the opcodes of a trace cache) so that
+    #   already interned ids can be pushed straight in with push_id()
+    def use_table(self, tokens):
+        if len(tokens) > (1 << self.bits):
+            raise ValueError("More than "+str(1 << self.bits)+" distinct tokens, \
+                increase the number of bits per id")
+        self.tokens = list(tokens)
+        self.ids = {token : i for i, token in enumerate(self.tokens)}
+
+    # Unpack a key into the list of tokens making up the pattern
+    def unpack(self, code, n):
+        mask = (1 << self.bits) - 1
+        return [self.tokens[(code >> (self.bits*(n-1-i))) & mask] for i in range(n)]
+
+    # Render the counters of a single size as a dictionary of joined strings
+    def render_size(self, n, separator=', '):
+        return {separator.join(self.unpack(code, n)) : count
+            for code, count in self.counts[n].items()}
+
+    # Render every size as a tuple of dictionaries, sizes in ascending order
+    def render_sizes(self, separator=', '):
+        return tuple(self.render_size(n, separator) for n in self.sizes)
+
+    # Render every size into a single dictionary keyed on the joined strings,
+    #   with the sizes in ascending order. Same format as the dictionaries
+    #   built by joining the window list directly.
+    def render(self, separator=', '):
+        patterns_dict = {}
+        for size_dict in self.render_sizes(separator):
+            patterns_dict.update(size_dict)
+        return patterns_dict
@@ -0,0 +1,394 @@
+# Analysis passes run over a single read of the instruction trace by
+#   analyse_trace.py
+# Every pass is handed the trace one batch of records at a time through
+#   push_batch(), and writes its artefacts to the output directory in finish().
+#   Passes working on the instruction stream as a whole use the columns of the
+#   batch (NumPy arrays in the same format as the trace cache, see
+#   trace_cache.py), the rest go through the TraceRecords one at a time with
+#   push(). The trace is only read and decoded once no matter how many passes
+#   are run.
+# Passes register themselves in PASSES under their name with @register_pass. The
+#   artefacts are written to the same paths under the output directory as the
+#   results directory built by the Makefile, and are written by the same
+#   functions as the corresponding scripts. The formatted results each script
+#   prints to stdout are written to a .txt file alongside its .JSON file. The
+#   trackers themselves are imported from the scripts wherever they can be fed
+#   one record at a time.
+
+import os
+import json
+
+import numpy as np
+
+from common.isa_management import check_isa
+from common.ngram import NgramCounter
+from common.transitions import merge_matrices
+from common.bandwidth import key_dicts, key_streams, BandwidthWriter, \
+    StreamArrayWriter, DEFAULT_WINDOWS
+from common.harts import merge_counts, hart_path
+from insn_patterns.insn_pairs import add_pairs, pairs_result, write_pairs
+from insn_patterns.insn_patterns import MIN_PATTERN_SIZE, MAX_PATTERN_SIZE, write_patterns
+from reg_accesses.reg_accesses import fill_regs, merge_regs, add_counts
+from reg_sequences.reg_pairs import RsRdPairCounter, write_reg_pairs
+from reg_sequences.reg_patterns import REG_BITS, sort_size_dicts, rendered_sizes, \
+    write_reg_patterns
+from reg_sequences.insn_reg_pairs import InsnRegPairCounter, write_insn_reg_pairs
+from reg_sequences.insn_reg_patterns import INSN_BITS, write_insn_reg_patterns
+
+# Name -> class of every pass
+PASSES = {}
+
+def register_pass(name):
+    def register(cls):
+        cls.name = name
+        PASSES[name] = cls
+        return cls
+    return register
+
+# Interface every pass implements
+class AnalysisPass:
+    # Set by passes that need the register operands of each record decoded
+    needs_regs = False
+
+    # output_dir : Results directory the artefacts are written under
+    # tables : Intern tables of the trace ("opcodes" and "regs"), shared with
+    #   every batch so that the opcode and register ids can be turned back into
+    #   names. The opcode table grows as the trace is read.
+    # isa : RISC-V ISA string
+    # per_hart : Analyse each hart separately, writing a result per hart along
+    #   with the merged result
+    def __init__(self, output_dir, tables, isa=None, per_hart=False):
+        self.output_dir = output_dir
+        self.tables = tables
+        self.isa = isa
+        self.per_hart = per_hart
+
+    # Default batch handling, going through the records one at a time
+    def push_batch(self, batch):
+        for record in batch.records():
+            self.push(record)
+
+    def push(self, record):
+        pass
+
+    def finish(self):
+        pass
+
+    # Path of an artefact under the output directory, creating its directory
+    def path(self, *parts):
+        path = os.path.join(self.output_dir, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    # Key under which the state of the record's hart is kept
+    def hart_key(self, record):
+        return record.hart if self.per_hart else None
+
+    # Split a batch into (hart, mask) pairs, a single pair covering every
+    #   record when the harts aren't analysed separately
+    def hart_masks(self, batch):
+        if not self.per_hart:
+            return [(None, None)]
+        harts = batch.column("hart")
+        return [(hart, harts == hart) for hart in np.unique(harts).tolist()]
+
+def dump_json(path, result):
+    with open(path, 'w') as dump:
+        dump.write(json.dumps(result))
+
+# Sort the counters of a dictionary, most frequent first
+def sort_counts(counts):
+    return sorted(counts.items(), key=lambda x: x[1], reverse=True)
+
+# Results of every hart in ascending hart order
+def hart_results(states, result):
+    return {hart : result(states[hart]) for hart in sorted(states)}
+
+#                     ---------- Instruction sequences ----------
+
+# Opcode ids of a batch of a single hart, renumbered in the order they first
+#   appear in that hart, the same ids as interning its instructions. remap holds
+#   the local id of every opcode id seen so far and order the opcode ids in
+#   local id order.
+def renumber(opcodes, remap, order):
+    unique, first = np.unique(opcodes, return_index=True)
+    for opcode in unique[np.argsort(first, kind='stable')].tolist():
+        if opcode not in remap:
+            remap[opcode] = len(order)
+            order.append(opcode)
+    if not len(unique):
+        return opcodes
+    lookup = np.zeros(int(unique[-1]) + 1, dtype=np.int64)
+    lookup[unique] = [remap[opcode] for opcode in unique.tolist()]
+    return lookup[opcodes]
+
+# insn_pairs.py -p -j=filtered/pairs.JSON -r=raw/pairs -m=raw/pairs.npz
+#   The pairs of each hart are counted one batch at a time as in track_pairs(),
+#   carrying the last opcode of the hart over to its next batch.
+@register_pass("insn_pairs")
+class InsnPairsPass(AnalysisPass):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.states = {} # hart -> (remap, order, pair_counts)
+        self.last = {}
+
+    def push_batch(self, batch):
+        opcodes = batch.column("opcode").astype(np.int64)
+        for hart, mask in self.hart_masks(batch):
+            state = self.states.get(hart)
+            if state is None:
+                state = self.states[hart] = ({}, [], {})
+                self.last[hart] = np.zeros(0, dtype=np.int64)
+            remap, order, pair_counts = state
+            ids = renumber(opcodes if mask is None else opcodes[mask], remap, order)
+            self.last[hart] = add_pairs(pair_counts, ids, self.last[hart], len(order))
+
+    def finish(self):
+        names = self.tables["opcodes"]
+        self.write(hart_results(self.states, lambda state: pairs_result(state[2],
+            [names[opcode] for opcode in state[1]])))
+
+    # Write the artefacts given the pairs dictionary, matrix and labels of every
+    #   hart (or of the whole trace under None)
+    def write(self, results):
+        raw_result = merge_counts(r[0] for r in results.values())
+        matrix, labels = merge_matrices([r[1:] for r in results.values()])
+        with open(self.path("insn_sequences", "filtered", "pairs.txt"), 'w') as out:
+            write_pairs(raw_result, matrix, labels, out,
+                jsondump=self.path("insn_sequences", "filtered", "pairs.JSON"),
+                rawdump=self.path("insn_sequences", "raw", "pairs"),
+                matrix_path=self.path("insn_sequences", "raw", "pairs.npz"),
+                hart_results=results if self.per_hart else None)
+
+# insn_patterns.py -p -j=filtered/patterns.JSON -r=raw/patterns
+@register_pass("insn_patterns")
+class InsnPatternsPass(AnalysisPass):
+    window_sizes = range(MIN_PATTERN_SIZE, MAX_PATTERN_SIZE)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {}
+
+    def push_batch(self, batch):
+        opcodes = batch.column("opcode")
+        for hart, mask in self.hart_masks(batch):
+            counter = self.counters.get(hart)
+            if counter is None:
+                counter = self.counters[hart] = NgramCounter(self.window_sizes)
+            push_id = counter.push_id
+            for opcode in (opcodes if mask is None else opcodes[mask]).tolist():
+                push_id(opcode)
+
+    def finish(self):
+        def render(counter):
+            counter.use_table(self.tables["opcodes"])
+            return counter.render()
+        self.write(hart_results(self.counters, render))
+
+    # Write the artefacts given the patterns dictionary of every hart (or of the
+    #   whole trace under None)
+    def write(self, results):
+        with open(self.path("insn_sequences", "filtered", "patterns.txt"), 'w') as out:
+            write_patterns(merge_counts(results.values()), out,
+                jsondump=self.path("insn_sequences", "filtered", "patterns.JSON"),
+                rawdump=self.path("insn_sequences", "raw", "patterns"),
+                hart_results=results if self.per_hart else None)
+
+#                           ---------- Bandwidth ----------
+
+# Looks up the byte streams of each batch from its opcode ids (and encodings)
+#   and pushes them to the writer of the pass, so only the values still needed
+#   by the moving averages are held. Bandwidth isn't split by hart.
+class StreamPass(AnalysisPass):
+    encodings = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dicts = key_dicts(self.keys, self.isa)
+        self.writer = None
+
+    def push_batch(self, batch):
+        if self.writer is None:
+            self.writer = self.open()
+        encodings = batch.column("encoding") if self.encodings else None
+        self.writer.push(key_streams(self.keys, self.isa, batch.column("opcode"),
+            self.tables["opcodes"], encodings, self.dicts))
+
+    def finish(self):
+        if self.writer is None:
+            self.writer = self.open()
+        self.writer.close()
+
+    # Write the artefacts given the whole byte stream of every key
+    def write(self, streams):
+        writer = self.open()
+        writer.push(streams)
+        writer.close()
+
+# bandwidth.py -o=bw, the moving averages of the load and store bandwidth
+@register_pass("bandwidth")
+class BandwidthPass(StreamPass):
+    keys = ["Ld", "St"]
+
+    def open(self):
+        return BandwidthWriter(os.path.join(self.output_dir, "bw"), self.keys,
+            DEFAULT_WINDOWS)
+
+# key_stream.py -k=Ld,St,Fetch -f=npy -o=bw/byte-streams.npy
+@register_pass("byte_streams")
+class ByteStreamsPass(StreamPass):
+    encodings = True
+    keys = ["Ld", "St", "Fetch"]
+
+    def open(self):
+        return StreamArrayWriter(self.path("bw", "byte-streams.npy"), self.keys)
+
+#                        ---------- Register accesses ----------
+
+# reg_accesses.py -j=reg_accesses/regs.JSON, histograms of the register columns
+@register_pass("reg_accesses")
+class RegAccessesPass(AnalysisPass):
+    needs_regs = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counts = {}
+
+    def push_batch(self, batch):
+        # Bin 0 counts the unused registers, the register table can grow as the
+        #   text trace is read
+        size = len(self.tables["regs"]) + 1
+        columns = [batch.column(c).astype(np.int64) + 1 for c in ("rs1", "rs2", "rd")]
+        for hart, mask in self.hart_masks(batch):
+            rs1, rs2, rd = columns if mask is None else [column[mask] for column in columns]
+            rs_counts, rd_counts = self.counts.get(hart, (np.zeros(0, dtype=np.int64),) * 2)
+            rs_counts = add_counts(add_counts(rs_counts, rs1, size), rs2, size)
+            self.counts[hart] = (rs_counts, add_counts(rd_counts, rd, size))
+
+    def finish(self):
+        _, regs = check_isa(self.isa, ["Type", "Format"], reg=True)
+        self.write(hart_results(self.counts, lambda counts: fill_regs(regs,
+            self.tables["regs"], counts[0][1:], counts[1][1:])), regs)
+
+    # Write the artefacts given the register dictionary of every hart (or of the
+    #   whole trace under None), regs being the registers of the ISA
+    def write(self, results, regs):
+        if not self.per_hart:
+            dump_json(self.path("reg_accesses", "regs.JSON"), results.get(None, regs))
+            return
+
+        json_path = self.path("reg_accesses", "regs.JSON")
+        dump_json(json_path, merge_regs(results.values()))
+        for hart, hart_regs in results.items():
+            dump_json(hart_path(json_path, hart), hart_regs)
+
+#                        ---------- Register sequences ----------
+
+# reg_pairs.py -j=reg_sequences/reg-pairs.JSON
+@register_pass("reg_pairs")
+class RegPairsPass(AnalysisPass):
+    needs_regs = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {}
+
+    def push(self, record):
+        hart = self.hart_key(record)
+        counter = self.counters.get(hart)
+        if counter is None:
+            counter = self.counters[hart] = RsRdPairCounter()
+        counter.push(record)
+
+    def finish(self):
+        results = hart_results(self.counters,
+            lambda counter: (sort_counts(counter.rs_dict), sort_counts(counter.rd_dict)))
+        rs_list = sort_counts(merge_counts(r[0] for r in results.values()))
+        rd_list = sort_counts(merge_counts(r[1] for r in results.values()))
+        with open(self.path("reg_sequences", "reg-pairs.txt"), 'w') as out:
+            write_reg_pairs(rs_list, rd_list, out,
+                jsondump=self.path("reg_sequences", "reg-pairs.JSON"),
+                hart_results=results if self.per_hart else None)
+
+# reg_patterns.py -j=reg_sequences/reg-patterns.JSON -r=reg_sequences/raw/reg-patterns
+@register_pass("reg_patterns")
+class RegPatternsPass(AnalysisPass):
+    needs_regs = True
+    window_sizes = range(3, 8)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {}
+
+    def push(self, record):
+        hart = self.hart_key(record)
+        counters = self.counters.get(hart)
+        if counters is None:
+            counters = self.counters[hart] = (NgramCounter(self.window_sizes, REG_BITS),
+                NgramCounter(self.window_sizes, REG_BITS))
+        rs_counter, rd_counter = counters
+        if record.rs1:
+            rs_counter.push(record.rs1)
+            if record.rs2:
+                rs_counter.push(record.rs2)
+        if record.rd:
+            rd_counter.push(record.rd)
+
+    def finish(self):
+        results = hart_results(self.counters,
+            lambda counters: tuple(sort_size_dicts(rendered_sizes(c)) for c in counters))
+        with open(self.path("reg_sequences", "reg-patterns.txt"), 'w') as out:
+            write_reg_patterns(merge_counts(r[0] for r in results.values()),
+                merge_counts(r[1] for r in results.values()), out,
+                jsondump=self.path("reg_sequences", "reg-patterns.JSON"),
+                rawdump=self.path("reg_sequences", "raw", "reg-patterns"),
+                hart_results=results if self.per_hart else None)
+
+# insn_reg_pairs.py -j=reg_sequences/insn-reg-pairs.JSON
+@register_pass("insn_reg_pairs")
+class InsnRegPairsPass(AnalysisPass):
+    needs_regs = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {}
+
+    def push(self, record):
+        hart = self.hart_key(record)
+        counter = self.counters.get(hart)
+        if counter is None:
+            counter = self.counters[hart] = InsnRegPairCounter()
+        counter.push(record)
+
+    def finish(self):
+        results = hart_results(self.counters, lambda counter: sort_counts(counter.pairs_dict))
+        with open(self.path("reg_sequences", "insn-reg-pairs.txt"), 'w') as out:
+            write_insn_reg_pairs(sort_counts(merge_counts(results.values())), out,
+                jsondump=self.path("reg_sequences", "insn-reg-pairs.JSON"),
+                hart_results=results if self.per_hart else None)
+
+# insn_reg_patterns.py -j=reg_sequences/insn-reg-patterns.JSON
+#   -r=reg_sequences/raw/insn-reg-patterns
+@register_pass("insn_reg_patterns")
+class InsnRegPatternsPass(AnalysisPass):
+    needs_regs = True
+    window_sizes = range(3, 8)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.counters = {}
+
+    def push(self, record):
+        hart = self.hart_key(record)
+        counter = self.counters.get(hart)
+        if counter is None:
+            counter = self.counters[hart] = NgramCounter(self.window_sizes, INSN_BITS)
+        counter.push(record.text)
+
+    def finish(self):
+        results = hart_results(self.counters, lambda counter: counter.render())
+        with open(self.path("reg_sequences", "insn-reg-patterns.txt"), 'w') as out:
+            write_insn_reg_patterns(merge_counts(results.values()), out,
+                jsondump=self.path("reg_sequences", "insn-reg-patterns.JSON"),
+                rawdump=self.path("reg_sequences", "raw", "insn-reg-patterns"),
+                hart_results=results if self.per_hart else None)
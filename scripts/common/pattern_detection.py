@@ -1,24 +1,53 @@
-import numpy as np
-import matplotlib.pyplot as plt
-from numpy import diff
+# NumPy and matplotlib are only imported when plotting, so that the analysis
+#   scripts calling local_maxima() and print_pairs() start up quickly
 import sys
 
 # Function that takes in the dictionary of all patterns and locates the local maxima
-#   by filtering patterns that don't occur frequently, sorting the dictionary
-#   and then differentiating with respect to 1. Any differentiated values above 
-#   a threshold are then used to indicate which indices to select as the most frequent
-#   patterns from the overall dictionary.
+#   by filtering patterns that don't occur frequently and then differentiating the
+#   sorted counters with respect to 1. The most frequent pattern is always kept,
+#   along with every pattern following a drop larger than the threshold.
 # Returns a list of tuples containing the most frequent patterns and their counters
+# Equal counters never differ by more than the (non-negative) threshold, so only
+#   the first pattern with each counter value can be kept. The drops are found on
+#   the distinct counter values alone, which are far fewer than the patterns, and
+#   the first pattern holding each of the values kept is then looked up in a
+#   single pass. This gives the same list as sorting every pattern (ties keep the
+#   order of the dictionary) without the O(n log n) sort.
 def local_maxima(all_patterns_dict, min, diff_threshold, plot):
+    if plot or diff_threshold < 0:
+        return sorted_local_maxima(all_patterns_dict, min, diff_threshold, plot)
+
+    distinct = sorted({r for r in all_patterns_dict.values() if r > min}, reverse=True)
+    if not distinct: # Nothing above the minimum count
+        return []
+    kept = {distinct[0]}
+    kept.update(b for a, b in zip(distinct, distinct[1:]) if a - b > diff_threshold)
+
+    # First pattern with each of the counters kept, in the dictionary's order
+    first = {}
+    for k, r in all_patterns_dict.items():
+        if r in kept and r not in first:
+            first[r] = k
+            if len(first) == len(kept):
+                break
+
+    return [(first[r], all_patterns_dict[first[r]]) for r in sorted(kept, reverse=True)]
+
+# Same as local_maxima() but sorting every pattern, used when plotting the
+#   sorted counters
+def sorted_local_maxima(all_patterns_dict, min, diff_threshold, plot):
     # List comprehension to filter out patterns smaller than a certain counter value
     filtered_patterns = {k:r for k, r in all_patterns_dict.items() if r > min}
     
     # sorted() returns a list
     sorted_patterns_list = sorted(filtered_patterns.items(), key=lambda x: x[1], reverse=True)
     sorted_patterns = dict(sorted_patterns_list)
+    if not sorted_patterns_list: # Nothing above the minimum count
+        return []
 
     # Differentiate the sorted dictionary values
-    dy = np.append(abs(diff(list(sorted_patterns.values()))/1), 0)
+    values = list(sorted_patterns.values())
+    dy = [abs(b - a) for a, b in zip(values, values[1:])] + [0]
 
     # Initialise with the largest value in the patterns list
     maxima = [sorted_patterns_list[0]]
@@ -33,6 +62,9 @@ def local_maxima(all_patterns_dict, min, diff_threshold, plot):
     return maxima
 
 def visualise_indices(sorted_patterns, dy, diff_threshold):
+    import numpy as np
+    import matplotlib.pyplot as plt
+
     maximum_indices = np.array([True if x > diff_threshold else False for x in dy][:-1])
     maximum_indices = np.insert(maximum_indices, 0, True)
 
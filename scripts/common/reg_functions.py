@@ -1,103 +1,202 @@
+# Decoding of the registers used by each instruction
+# Every instruction format lays out its registers differently, both in the
+#   operand text printed by Spike and in the bits of the encoding. Instead of
+#   going through every format for each instruction, the layout of each opcode
+#   is looked up once in the LAYOUTS table and turned into a specialised
+#   extractor. The same table gives the bit fields used to decode the registers
+#   straight from the raw encodings, one at a time or vectorised over a whole
+#   NumPy array of encodings (e.g. the columns of a trace cache).
+# The registers are returned in the order they appear in the operand text, e.g.
+#   for stores (sw a0, -36(s0)) rs1 is the register being stored and rs2 the base.
+
+from collections import namedtuple
+
+# Register names as printed by Spike, indexed by register number
+REG_NAMES = ["zero", "ra", "sp", "gp", "tp", "t0", "t1", "t2",
+    "s0", "s1", "a0", "a1", "a2", "a3", "a4", "a5",
+    "a6", "a7", "s2", "s3", "s4", "s5", "s6", "s7",
+    "s8", "s9", "s10", "s11", "t3", "t4", "t5", "t6"]
+
+# Getters for each operand position in the split instruction line
+#   e.g. ["sw", "a0,", "-36(s0)"]
+def first_operand(words):   # rd, ...
+    return words[1][:-1]
+
+def only_operand(words):    # rs
+    return words[1]
+
+def second_operand(words):  # ..., rs, ...
+    return words[2][:-1]
+
+def last_second(words):     # ..., rs
+    return words[2]
+
+def third_operand(words):   # ..., ..., rs
+    return words[3]
+
+def second_base(words):     # ..., imm(rs)
+    operand = words[2]
+    return operand[operand.index("(")+1:-1]
+
+# Single register operand of an instruction
+#   - text : Getter returning the register from the split instruction line
+#   - shift, mask, offset : Register number is ((encoding >> shift) & mask) + offset
+#   - reg : Name of the register when it's implied by the instruction (e.g. sp
+#   for c.swsp), in which case text and the bit field aren't used
+Operand = namedtuple("Operand", ["text", "shift", "mask", "offset", "reg"])
+
+def implied(reg):
+    return Operand(None, 0, 0, 0, reg)
+
+# 32-bit encodings
+RD_FIRST    = Operand(first_operand, 7, 31, 0, None)
+RS1_SECOND  = Operand(second_operand, 15, 31, 0, None)
+RS1_FIRST   = Operand(first_operand, 15, 31, 0, None)
+RS1_BASE    = Operand(second_base, 15, 31, 0, None)
+RS2_SECOND  = Operand(second_operand, 20, 31, 0, None)
+RS2_FIRST   = Operand(first_operand, 20, 31, 0, None)
+RS2_THIRD   = Operand(third_operand, 20, 31, 0, None)
+# Compressed encodings, full register fields at bits 11:7 and 6:2 and the
+#   3-bit fields (x8-x15) at bits 9:7 and 4:2
+C_11_FIRST  = Operand(first_operand, 7, 31, 0, None)
+C_11_ONLY   = Operand(only_operand, 7, 31, 0, None)
+C_6_FIRST   = Operand(first_operand, 2, 31, 0, None)
+C_6_LAST    = Operand(last_second, 2, 31, 0, None)
+C_9_FIRST   = Operand(first_operand, 7, 7, 8, None)
+C_9_BASE    = Operand(second_base, 7, 7, 8, None)
+C_4_FIRST   = Operand(first_operand, 2, 7, 8, None)
+C_4_LAST    = Operand(last_second, 2, 7, 8, None)
+SP = implied("sp")
+RA = implied("ra")
+
+# Layout of each format as the (rs1, rs2, rd) operands, None where unused.
+#   Keys are either a format, a (format, type) pair or an instruction name for
+#   the instructions that differ from the rest of their format.
+LAYOUTS = {
+    "R"             : (RS1_SECOND, RS2_THIRD, RD_FIRST),   # rd, rs1, rs2
+    ("I", "load")   : (RS1_BASE, None, RD_FIRST),          # rd, imm(rs)
+    "I"             : (RS1_SECOND, None, RD_FIRST),        # rd, rs, imm
+    "S"             : (RS2_FIRST, RS1_BASE, None),         # rs1, imm(rs2)
+    "U"             : (None, None, RD_FIRST),              # rd, imm
+    "SB"            : (RS1_FIRST, RS2_SECOND, None),       # rs1, rs2, pc + imm
+    "UJ"            : (None, None, RA),                    # pc + imm
+    # Compressed formats
+    "CR"            : (C_6_LAST, None, C_11_FIRST),        # rd, rs
+    # The whole operand, the old decoder dropped its last character (ra -> r)
+    "c.jr"          : (C_11_ONLY, None, None),             # rs
+    # Cases where the destination register is also being read from
+    "c.add"         : (C_6_LAST, C_11_FIRST, C_11_FIRST),
+    # Listed as CR but encoded as CA, with 3-bit register fields. Decoded from
+    #   those fields, which changes their registers from the old decoder's.
+    "c.and"         : (C_4_LAST, None, C_9_FIRST),
+    "c.or"          : (C_4_LAST, None, C_9_FIRST),
+    "c.xor"         : (C_4_LAST, None, C_9_FIRST),
+    "c.subw"        : (C_4_LAST, None, C_9_FIRST),
+    "c.sub"         : (C_4_LAST, C_9_FIRST, C_9_FIRST),
+    "c.addw"        : (C_4_LAST, C_9_FIRST, C_9_FIRST),
+    ("CI", "load")  : (SP, None, C_11_FIRST),              # rd, imm(sp)
+    "CI"            : (None, None, C_11_FIRST),            # rd, imm
+    "c.addi"        : (C_11_FIRST, None, C_11_FIRST),
+    "c.addiw"       : (C_11_FIRST, None, C_11_FIRST),
+    "c.addi16sp"    : (C_11_FIRST, None, C_11_FIRST),
+    "c.slli"        : (C_11_FIRST, None, C_11_FIRST),
+    # Listed as CI but encoded as CB, with a 3-bit register field (also a
+    #   change from the old decoder)
+    "c.srli"        : (None, None, C_9_FIRST),
+    "c.srai"        : (None, None, C_9_FIRST),
+    "CSS"           : (C_6_FIRST, SP, None),               # rs, imm(sp)
+    "CIW"           : (SP, None, C_4_FIRST),               # rd, sp, imm
+    "CL"            : (C_9_BASE, None, C_4_FIRST),         # rd, imm(rs)
+    "CS"            : (C_4_FIRST, C_9_BASE, None),         # rs1, imm(rs2)
+    "CA"            : (None, None, None),
+    "CB"            : (C_9_FIRST, None, None),             # rs, pc + imm
+    "CJ"            : (None, None, None),                  # pc + imm
+    "c.jal"         : (None, None, RA),
+}
+NO_OPERANDS = (None, None, None)
+
+# Find the layout of an instruction from its row in the ISA dictionary
+#   (needs the "Format" and "Type" keys)
+def operand_layout(insn_name, insn_subdict):
+    if insn_name in LAYOUTS:
+        return LAYOUTS[insn_name]
+    insn_format = insn_subdict.get("Format")
+    layout = LAYOUTS.get((insn_format, insn_subdict.get("Type")))
+    if layout is None:
+        layout = LAYOUTS.get(insn_format, NO_OPERANDS)
+    return layout
+
+# Extractors for a single operand, from the operand text or the encoding
+def text_getter(operand):
+    if operand is None:
+        return lambda words: None
+    if operand.reg:
+        return lambda words, reg=operand.reg: reg
+    return operand.text
+
+def field_getter(operand):
+    if operand is None:
+        return lambda encoding: None
+    if operand.reg:
+        return lambda encoding, reg=operand.reg: reg
+    shift, mask, offset = operand.shift, operand.mask, operand.offset
+    return lambda encoding: REG_NAMES[((encoding >> shift) & mask) + offset]
+
+# Specialised extractor taking the split instruction line
+def make_text_decoder(layout):
+    rs1, rs2, rd = (text_getter(operand) for operand in layout)
+    return lambda words: (rs1(words), rs2(words), rd(words))
+
+# Specialised extractor taking the encoding as an integer
+def make_encoding_decoder(layout):
+    rs1, rs2, rd = (field_getter(operand) for operand in layout)
+    return lambda encoding: (rs1(encoding), rs2(encoding), rd(encoding))
+
+# Precompute the decoder of every instruction in the ISA dictionary. Decoders
+#   take the integer encoding, or the split instruction line when from_text is set.
+def build_decoders(all_instrs, from_text=False):
+    make_decoder = make_text_decoder if from_text else make_encoding_decoder
+    return {insn_name : make_decoder(operand_layout(insn_name, insn_subdict))
+        for insn_name, insn_subdict in all_instrs.items()}
+
+# Decode the registers of a single instruction line, e.g. ["sw", "a0,", "-36(s0)"]
+#   Returns rs1, rs2, rd (None where unused) or empty strings for instructions
+#   that aren't in the ISA dictionary (e.g. ret)
 def parse_instruction(instruction_line, all_instrs):
     # Index 0 = Instruction
     insn_name = instruction_line[0]
-    # print(instruction_line)
-    # print(insn_name)
     if insn_name in all_instrs:
-        insn_subdict = all_instrs[insn_name]
-        # print(insn_subdict)
-        
-        rs1 = rs2 = rd = None
-        # Determine type and return accordingly
-        if insn_subdict["Format"] == "R":
-            # rd, rs1, rs2
-            rd = instruction_line[1][:-1]
-            rs1 = instruction_line[2][:-1]
-            rs2 = instruction_line[3]
-        elif insn_subdict["Format"] == "I":
-            if (insn_subdict["Type"] == "load"):
-                # rd, imm(rs)
-                remaining_string = instruction_line[2].replace("(", " ", 1)[:-1].split()
-                rs1, rd = remaining_string[1], instruction_line[1][:-1]
-            else:
-                # rd, rs, imm
-                rd, rs1 = instruction_line[1][:-1], instruction_line[2][:-1]
-            # TODO : Case for Synch, System and Counters instructions
-
-        elif insn_subdict["Format"] == "S":
-            # rs1, imm(rs2)
-            rs1 = instruction_line[1][:-1]
-
-            remaining_string = instruction_line[2].replace("(", " ", 1)[:-1].split()
-            rs2 = remaining_string[1]
-        elif insn_subdict["Format"] == "U":
-            # rd, imm
-            rd = instruction_line[1][:-1]            
-        elif insn_subdict["Format"] == "SB":
-            # rs1, rs2, pc + imm
-            rs1 = instruction_line[1][:-1]
-            rs2 = instruction_line[2][:-1]
-        elif insn_subdict["Format"] == "UJ":
-            # pc + imm
-            rd = "ra"
-        elif insn_subdict["Format"] == "CR":     # Compressed formats
-            # rs/d, rs
-            if(insn_name=="c.jr" or insn_name=="c.jalr"):
-                # rs
-                rs1 = instruction_line[1][:-1]
-            else:
-                first_reg = instruction_line[1][:-1]
-                rd = first_reg
-                rs1 = instruction_line[2]
-
-                # Cases where the destination register is also being read from
-                if(insn_name=="c.add" or insn_name=="c.addw" or insn_name=="c.sub"):
-                    rs2 = first_reg
-
-        elif insn_subdict["Format"] == "CI":
-            # rs/d, imm,
-            first_reg = instruction_line[1][:-1]
-            rd = first_reg
-
-            if(insn_subdict["Type"] == "load"):
-                # rd, imm(rs)
-                remaining_string = instruction_line[2].replace("(", " ", 1)[:-1].split()
-                rs1 = remaining_string[1]
-            elif(insn_name == "c.addi" or insn_name == "c.addiw" or 
-                insn_name == "c.addi16sp" or insn_name == "c.slli"):
-                # Cases where the dest register is also read from
-                rs1 = first_reg
-        elif insn_subdict["Format"] == "CSS":
-            # rs, imm(sp)
-            rs1 = instruction_line[1][:-1]
-            rs2 = "sp"
-        elif insn_subdict["Format"] == "CIW":
-            # rd, sp, imm
-            rd = instruction_line[1][:-1]
-            rs1 = "sp"
-        elif insn_subdict["Format"] == "CL":
-            # rd, imm(rs) - can merge with  'I'
-            rd = instruction_line[1][:-1]
-            remaining_string = instruction_line[2].replace("(", " ", 1)[:-1].split()
-            rs1 = remaining_string[1]
-        elif insn_subdict["Format"] == "CS":
-            # rs1, imm(rs2) - can merge with 'S'
-            rs1 = instruction_line[1][:-1]
-            remaining_string = instruction_line[2].replace("(", " ", 1)[:-1].split()
-            rs2 = remaining_string[1]
-        elif insn_subdict["Format"] == "CA":
-            pass # TODO
-        elif insn_subdict["Format"] == "CB":
-            # rs, pc + imm
-            rs1 = instruction_line[1][:-1]
-        elif insn_subdict["Format"] == "CJ":
-            # pc + imm
-            # TODO : Add specific case for 'jumpl' instruction types where
-            #   the return address is added to the rd dictionary
-            if(insn_name=="c.jal"):
-                rd = "ra"
-        else:
-            pass # Do nothing if the column has nothing
-        return rs1, rs2, rd
+        layout = operand_layout(insn_name, all_instrs[insn_name])
+        return make_text_decoder(layout)(instruction_line)
     # If the instruction isn't detected in the insn_pairs dictionary e.g. ret
     return "","",""
+
+# Vectorised decoding of whole arrays of encodings and their opcode ids, where
+#   opcode_names gives the name of each opcode id. Returns the rs1, rs2 and rd
+#   arrays of register numbers (indices into REG_NAMES), -1 where unused or for
+#   instructions that aren't in the ISA dictionary.
+def decode_encodings(encodings, opcodes, opcode_names, all_instrs):
+    import numpy as np
+
+    encodings = np.asarray(encodings, dtype=np.int64)
+    opcodes = np.asarray(opcodes, dtype=np.int64)
+    size = len(opcode_names)
+    results = []
+    for index in range(3): # rs1, rs2, rd
+        # Per opcode parameters of the operand, -1 marks unused operands
+        shift = np.zeros(size, dtype=np.int64)
+        mask = np.zeros(size, dtype=np.int64)
+        offset = np.full(size, -1, dtype=np.int64)
+        for i, insn_name in enumerate(opcode_names):
+            if insn_name not in all_instrs:
+                continue
+            operand = operand_layout(insn_name, all_instrs[insn_name])[index]
+            if operand is None:
+                continue
+            if operand.reg: # Implied register, only use the offset
+                offset[i] = REG_NAMES.index(operand.reg)
+            else:
+                shift[i], mask[i], offset[i] = operand.shift, operand.mask, operand.offset
+
+        results.append(((encodings >> shift[opcodes]) & mask[opcodes]) + offset[opcodes])
+    return tuple(results)
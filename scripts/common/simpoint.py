@@ -0,0 +1,538 @@
+# Estimate the analysis results from a few representative intervals of the trace
+# Running every analysis over a whole trace costs time in proportion to its
+#   length, yet most programs spend it going through a handful of phases over
+#   and over. In the same way as SimPoint, the trace is split into fixed-size
+#   intervals and each interval is summed up by a vector. The instructions of
+#   every hart are split on their own, so that an interval never mixes harts
+#   and the results are those of each hart analysed separately and merged:
+#   - bb : Basic block vector, the number of instructions executed in each
+#   basic block (the same blocks as basic_blocks.py, split on every
+#   non-sequential PC)
+#   - opcode : Number of times each opcode is executed
+#   The vectors are normalised, randomly projected down to a few dimensions and
+#   clustered with k-means. The interval closest to the centre of each cluster
+#   stands in for the whole cluster, weighted by the number of instructions in
+#   it, the shorter last interval of a hart only being picked when its cluster
+#   has no full interval. The analyses then only run over the representative
+#   intervals and their results are scaled by the weights:
+#   - insn_pairs, insn_patterns, reg_accesses : Counters of each representative
+#   multiplied by its weight, summed and rounded
+#   - bandwidth, byte_streams : Every interval is replaced by the byte stream of
+#   its representative, giving a stream of the same length as the trace. The
+#   stream of each representative is only built once and tiled over the
+#   intervals of its cluster while the stream is written.
+# The estimates are written as the same artefacts as analyse_trace.py, under the
+#   same paths. With --check the analyses are also run over the whole trace and
+#   the error of each estimate is reported.
+
+# Input : Trace cache directory built by trace_cache.py
+# Output : Results directory holding the estimated artefacts of every analysis,
+#   along with simpoint/simpoints.JSON (the hart and cluster of each interval,
+#   the representative of each cluster and its weight) and simpoint/error.JSON with --check
+# --isa flag : Determines the instructions we expect to see in the program; same as
+#   the --isa flag in Spike
+
+# Example to guide use:
+# Run the command : python3 scripts/common/simpoint.py --isa=rv32gc \
+#       -c=build/rv32gc-ilp32-gcc/printf/nproc-1/main.cache \
+#       -o=build/rv32gc-ilp32-gcc/printf/nproc-1/simpoint-results --check
+#   while in the base directory
+
+import sys
+import os
+import json
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+# Adding the parent directory to the python file path to
+#   allow absolute file path inclusions
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.isa_management import check_isa
+from common.trace_cache import load_cache, BLOCK_SIZE
+from common.basic_blocks import instruction_sizes, unique_rows, compress_blocks, \
+    ChunkedBlockNgrams
+from common.transitions import transition_matrix
+from common.bandwidth import key_streams, key_dicts
+from common.ngram import NgramCounter
+from common.passes import PASSES, InsnPatternsPass
+from reg_accesses.reg_accesses import fill_regs
+
+# Default number of instructions in each interval
+INTERVAL_SIZE = 1 << 20
+# Default number of clusters
+CLUSTERS = 10
+# Number of dimensions the interval vectors are projected down to, as SimPoint
+DIMENSIONS = 15
+# Maximum number of k-means iterations
+ITERATIONS = 100
+# Passes whose results can be estimated from the representatives
+ESTIMATED_PASSES = ["insn_pairs", "insn_patterns", "reg_accesses", "bandwidth",
+    "byte_streams"]
+# Number of the most common full run entries the largest error is looked for in
+TOP_ENTRIES = 10
+
+#                           ---------- Intervals ----------
+
+# Intervals of the trace, numbered hart after hart
+#   - harts : Hart of every interval
+#   - lengths : Number of instructions in every interval
+#   - starts, stops : Range of the trace holding the instructions of every
+#   interval, among those of the other harts
+#   - first : Index of the first interval of every hart
+Intervals = namedtuple("Intervals", ["harts", "lengths", "starts", "stops", "first"])
+
+# Generator going through the trace in blocks of BLOCK_SIZE instructions,
+#   yielding the start of every block along with the hart and interval of each
+#   of its instructions and its position in the interval. first gives the index
+#   of the first interval of every hart.
+def interval_rows(cache, first, interval_size):
+    seen = dict.fromkeys(first, 0)
+    for start in range(0, cache["meta"]["length"], BLOCK_SIZE):
+        harts = np.asarray(cache["hart"][start:start + BLOCK_SIZE])
+        rows = np.empty(len(harts), dtype=np.int64)
+        positions = np.empty(len(harts), dtype=np.int64)
+        for hart in np.unique(harts).tolist():
+            mask = harts == hart
+            hart_positions = seen[hart] + np.arange(np.count_nonzero(mask))
+            seen[hart] += len(hart_positions)
+            rows[mask] = first[hart] + hart_positions // interval_size
+            positions[mask] = hart_positions % interval_size
+        yield start, harts, rows, positions
+
+# Split the instructions of every hart into intervals of interval_size, the last
+#   interval of each hart holding what's left
+def split_intervals(cache, interval_size):
+    hart_lengths = {}
+    for start in range(0, cache["meta"]["length"], BLOCK_SIZE):
+        harts, counts = np.unique(cache["hart"][start:start + BLOCK_SIZE],
+            return_counts=True)
+        for hart, count in zip(harts.tolist(), counts.tolist()):
+            hart_lengths[hart] = hart_lengths.get(hart, 0) + count
+
+    harts, lengths, first = [], [], {}
+    for hart in sorted(hart_lengths):
+        first[hart] = len(lengths)
+        full, rest = divmod(hart_lengths[hart], interval_size)
+        lengths += [interval_size] * full + ([rest] if rest else [])
+        harts += [hart] * (len(lengths) - first[hart])
+
+    starts = np.full(len(lengths), -1, dtype=np.int64)
+    stops = np.zeros(len(lengths), dtype=np.int64)
+    for start, _, rows, _ in interval_rows(cache, first, interval_size):
+        distinct, first_index = np.unique(rows, return_index=True)
+        _, last_index = np.unique(rows[::-1], return_index=True)
+        unset = starts[distinct] < 0
+        starts[distinct[unset]] = start + first_index[unset]
+        stops[distinct] = start + len(rows) - last_index
+    return Intervals(np.array(harts), np.array(lengths), starts, stops, first)
+
+# Values of a column for the instructions of an interval
+def interval_values(cache, column, intervals, interval):
+    start, stop = int(intervals.starts[interval]), int(intervals.stops[interval])
+    hart = intervals.harts[interval]
+    values = []
+    for block in range(start, stop, BLOCK_SIZE):
+        block = slice(block, min(block + BLOCK_SIZE, stop))
+        values.append(cache[column][block][cache["hart"][block] == hart])
+    return np.concatenate(values)
+
+#                       ---------- Interval vectors ----------
+
+# Basic block vectors of every interval, as a matrix of intervals x blocks. The
+#   trace is read in blocks of BLOCK_SIZE instructions, the basic block each
+#   hart is executing being carried over from one to the next so that blocks
+#   aren't split.
+def block_vectors(cache, intervals, interval_size):
+    rows, block_pcs, counts = [], [], []
+    carry = {} # Hart -> start PC of its current block and its next PC
+    for start, harts, block_rows, _ in interval_rows(cache, intervals.first,
+            interval_size):
+        stop = start + len(block_rows)
+        all_pcs = np.asarray(cache["pc"][start:stop], dtype=np.int64)
+        all_sizes = instruction_sizes(cache["encoding"][start:stop]).astype(np.int64)
+        leader_pcs = np.empty(len(block_rows), dtype=np.int64)
+        for hart in np.unique(harts).tolist():
+            mask = harts == hart
+            pcs, sizes = all_pcs[mask], all_sizes[mask]
+            carry_pc, carry_next = carry.get(hart, (0, None))
+            leaders = np.ones(len(pcs), dtype=bool)
+            leaders[1:] = pcs[1:] != pcs[:-1] + sizes[:-1]
+            leaders[0] = carry_next is None or pcs[0] != carry_next
+            # Start PC of the block each instruction is executed in
+            last = np.maximum.accumulate(np.where(leaders, np.arange(len(pcs)), -1))
+            hart_leaders = np.where(last >= 0, pcs[np.maximum(last, 0)], carry_pc)
+            leader_pcs[mask] = hart_leaders
+            carry[hart] = (int(hart_leaders[-1]), int(pcs[-1] + sizes[-1]))
+
+        keys = np.stack((block_rows, leader_pcs), axis=1)
+        distinct, _, _, key_counts = unique_rows(keys, int(keys.max()) + 1)
+        rows.append(distinct[:, 0])
+        block_pcs.append(distinct[:, 1])
+        counts.append(key_counts)
+
+    rows, block_pcs, counts = (np.concatenate(values) for values in (rows, block_pcs, counts))
+    blocks, columns = np.unique(block_pcs, return_inverse=True)
+    vectors = np.zeros((len(intervals.lengths), len(blocks)))
+    np.add.at(vectors, (rows, columns.reshape(-1)), counts)
+    return vectors
+
+# Opcode vectors of every interval, as a matrix of intervals x opcodes
+def opcode_vectors(cache, intervals, interval_size):
+    width = len(cache["tables"]["opcodes"])
+    size = len(intervals.lengths) * width
+    counts = np.zeros(size, dtype=np.int64)
+    for start, _, rows, _ in interval_rows(cache, intervals.first, interval_size):
+        opcodes = np.asarray(cache["opcode"][start:start + len(rows)], dtype=np.int64)
+        counts += np.bincount(rows * width + opcodes, minlength=size)
+    return counts.reshape(len(intervals.lengths), width).astype(float)
+
+VECTORS = {"bb" : block_vectors, "opcode" : opcode_vectors}
+
+# Normalise each vector by the length of its interval and project the vectors
+#   onto dimensions random directions, as SimPoint does, so that the distances
+#   between intervals cost the same no matter how many blocks the program has
+def project(vectors, dimensions, rng):
+    vectors = vectors / np.maximum(vectors.sum(axis=1, keepdims=True), 1)
+    if vectors.shape[1] <= dimensions:
+        return vectors
+    return vectors @ rng.uniform(-1, 1, (vectors.shape[1], dimensions))
+
+#                           ---------- Clustering ----------
+
+# Squared distance from every point to every centre
+def distances(points, centres):
+    return ((points[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+
+# k-means clustering of the points, seeded with k-means++. Fewer than k clusters
+#   are returned when there are fewer distinct points. Returns the cluster of
+#   every point, numbered in the order the clusters first appear, along with the
+#   centre of every cluster.
+def kmeans(points, k, rng, iterations=ITERATIONS):
+    centres = points[[rng.integers(len(points))]]
+    while len(centres) < k:
+        nearest = distances(points, centres).min(axis=1)
+        if nearest.sum() == 0:
+            break
+        centres = np.vstack((centres, points[rng.choice(len(points), p=nearest/nearest.sum())]))
+
+    labels = None
+    for _ in range(iterations):
+        new_labels = distances(points, centres).argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        sizes = np.bincount(labels, minlength=len(centres))
+        sums = np.zeros(centres.shape)
+        np.add.at(sums, labels, points)
+        # Empty clusters keep their centre
+        filled = sizes > 0
+        centres[filled] = sums[filled] / sizes[filled, None]
+
+    # Drop the empty clusters and renumber the rest in order of appearance
+    used, first = np.unique(labels, return_index=True)
+    order = used[np.argsort(first, kind='stable')]
+    renumber = np.zeros(len(centres), dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+    return renumber[labels], centres[order]
+
+# Representative interval of every cluster, the one closest to its centre among
+#   the longest intervals of the cluster, and the weight it's scaled by: the
+#   number of instructions in the cluster over the number of instructions in
+#   the representative. The last interval of each hart is cut short, so it's
+#   only picked when its cluster has no full interval rather than having its
+#   weight inflated.
+def representatives(points, labels, centres, lengths):
+    nearest = distances(points, centres)[np.arange(len(points)), labels]
+    chosen, weights = [], []
+    for cluster in range(len(centres)):
+        members = np.flatnonzero(labels == cluster)
+        longest = members[lengths[members] == lengths[members].max()]
+        chosen.append(int(longest[np.argmin(nearest[longest])]))
+        weights.append(lengths[members].sum() / lengths[chosen[-1]])
+    return chosen, weights
+
+#                           ---------- Estimates ----------
+
+# Sum of the counter dictionaries, each multiplied by its weight and rounded,
+#   keys in the order they first appear. Entries rounded down to 0 are dropped.
+def weighted_counts(results, weights):
+    total = {}
+    for counts, weight in zip(results, weights):
+        for key, count in counts.items():
+            total[key] = total.get(key, 0) + count * weight
+    return {key : int(round(count)) for key, count in total.items() if round(count)}
+
+# Transition matrix of every given interval, including the pair crossing into
+#   the next interval of the same hart so that the intervals add up to the whole
+#   trace. The pairs are in the order they first appear in the intervals.
+def estimate_pairs(cache, intervals, chosen, weights):
+    labels = cache["tables"]["opcodes"]
+    size = len(labels)
+    matrix = np.zeros((size, size))
+    codes = []
+    for interval, weight in zip(chosen, weights):
+        ids = interval_values(cache, "opcode", intervals, interval).astype(np.int64)
+        following = interval + 1
+        if following < len(intervals.harts) and \
+                intervals.harts[following] == intervals.harts[interval]:
+            ids = np.append(ids, cache["opcode"][intervals.starts[following]])
+        matrix += weight * transition_matrix(ids, size)
+        # Only the distinct pairs of the interval, in the order they first appear
+        interval_codes, first = np.unique(ids[:-1] * size + ids[1:], return_index=True)
+        codes.append(interval_codes[np.argsort(first, kind='stable')])
+    matrix = np.rint(matrix).astype(np.int64)
+
+    codes, first = np.unique(np.concatenate(codes), return_index=True)
+    leads, follows = np.divmod(codes[np.argsort(first, kind='stable')], size)
+    pairs = {labels[lead]+", "+labels[follow] : count for lead, follow, count
+        in zip(leads.tolist(), follows.tolist(), matrix[leads, follows].tolist()) if count}
+    return pairs, matrix, labels
+
+# Patterns of every run of consecutive intervals of the same hart, counted on
+#   their basic blocks one interval at a time. Patterns crossing from one run
+#   into the next are left out.
+def estimate_patterns(cache, intervals, runs, weights, window_sizes):
+    results = []
+    for run in runs:
+        block_counts = ChunkedBlockNgrams(window_sizes)
+        for interval in run:
+            blocks = compress_blocks(interval_values(cache, "pc", intervals, interval),
+                instruction_sizes(interval_values(cache, "encoding", intervals, interval)))
+            block_counts.push(interval_values(cache, "opcode", intervals, interval), blocks)
+        counts = block_counts.result()
+        results.append({(n, code) : count for n in counts for code, count in counts[n].items()})
+    estimate = weighted_counts(results, weights)
+
+    counter = NgramCounter(window_sizes)
+    counter.use_table(cache["tables"]["opcodes"])
+    for (n, code), count in estimate.items():
+        counter.counts[n][code] = count
+    return counter.render()
+
+# Register histograms of every given interval, shifted by one so that bin 0
+#   counts the unused registers
+def estimate_regs(cache, intervals, chosen, weights):
+    size = len(cache["tables"]["regs"]) + 1
+    rs_counts, rd_counts = np.zeros(size), np.zeros(size)
+    for interval, weight in zip(chosen, weights):
+        for column in ("rs1", "rs2"):
+            rs_counts += weight * np.bincount(interval_values(cache, column, intervals,
+                interval) + 1, minlength=size)
+        rd_counts += weight * np.bincount(interval_values(cache, "rd", intervals,
+            interval) + 1, minlength=size)
+    return np.rint(rs_counts).astype(np.int64), np.rint(rd_counts).astype(np.int64)
+
+# Add the number of bytes of every interval in the byte streams of a block of
+#   the trace to sums, rows being the interval of every instruction
+def add_interval_sums(sums, streams, rows):
+    for key, values in streams.items():
+        sums[key] += np.bincount(rows, weights=values, minlength=len(sums[key]))
+
+# Write the byte streams of the whole trace with every interval replaced by the
+#   stream of its representative, repeated (or cut short) to the length of the
+#   interval. The stream of each representative is only built once and the
+#   trace is written one block of BLOCK_SIZE instructions at a time. Returns the
+#   number of bytes of every interval for every key.
+def write_streams(cache, analysis, intervals, interval_size, labels, chosen):
+    rep_streams = [key_streams(analysis.keys, analysis.isa,
+        interval_values(cache, "opcode", intervals, interval), cache["tables"]["opcodes"],
+        interval_values(cache, "encoding", intervals, interval), analysis.dicts)
+        for interval in chosen]
+    rep_lengths = intervals.lengths[chosen]
+    rep_starts = np.concatenate(([0], np.cumsum(rep_lengths)[:-1]))
+    rep_values = {key : np.concatenate([streams[key] for streams in rep_streams])
+        for key in analysis.keys}
+
+    sums = {key : np.zeros(len(intervals.lengths)) for key in analysis.keys}
+    writer = analysis.open()
+    for _, _, rows, positions in interval_rows(cache, intervals.first, interval_size):
+        clusters = labels[rows]
+        index = rep_starts[clusters] + positions % rep_lengths[clusters]
+        streams = {key : values[index] for key, values in rep_values.items()}
+        writer.push(streams)
+        add_interval_sums(sums, streams, rows)
+    writer.close()
+    return sums
+
+#                          ---------- Error report ----------
+
+# Error of an estimated counter dictionary against the full run: the sum of the
+#   absolute differences over the total count, along with the largest relative
+#   error among the most common entries of the full run
+def count_error(estimate, full):
+    total = sum(full.values())
+    keys = set(estimate) | set(full)
+    error = sum(abs(estimate.get(key, 0) - full.get(key, 0)) for key in keys)
+    top = sorted(full.items(), key=lambda x: x[1], reverse=True)[:TOP_ENTRIES]
+    top_error = max((abs(estimate.get(key, 0) - count) / count for key, count in top
+        if count), default=0.0)
+    return {"error" : error / total if total else 0.0, "top_error" : top_error}
+
+# Error of an estimated byte stream against the full run, from the number of
+#   bytes of every interval of each: the relative error of the total number of
+#   bytes, along with the sum of the absolute differences of the intervals over
+#   the total
+def stream_error(estimate_sums, full_sums):
+    total = float(full_sums.sum())
+    if not total:
+        return {"error" : 0.0, "interval_error" : 0.0}
+    return {"error" : abs(float(estimate_sums.sum()) - total) / total,
+        "interval_error" : float(np.abs(estimate_sums - full_sums).sum()) / total}
+
+# Number of bytes of every interval of the byte streams of the whole trace, one
+#   block of BLOCK_SIZE instructions at a time
+def stream_sums(cache, keys, isa, intervals, interval_size):
+    dicts = key_dicts(keys, isa)
+    sums = {key : np.zeros(len(intervals.lengths)) for key in keys}
+    for start, _, rows, _ in interval_rows(cache, intervals.first, interval_size):
+        stop = start + len(rows)
+        add_interval_sums(sums, key_streams(keys, isa, cache["opcode"][start:stop],
+            cache["tables"]["opcodes"], cache["encoding"][start:stop], dicts), rows)
+    return sums
+
+# Flatten the register dictionary into counters of "reg rs" and "reg rd"
+def reg_counts(all_regs):
+    return {reg+" "+access : count for reg, counters in all_regs.items()
+        for access, count in counters.items()}
+
+# Run the analyses over the whole trace, one interval at a time with a weight of
+#   1, and compare them with the estimates
+def check_estimates(cache, estimates, isa, intervals, interval_size):
+    every = range(len(intervals.lengths))
+    ones = [1] * len(intervals.lengths)
+    errors = {}
+    if "insn_pairs" in estimates:
+        full = estimate_pairs(cache, intervals, every, ones)[0]
+        errors["insn_pairs"] = count_error(estimates["insn_pairs"], full)
+    if "insn_patterns" in estimates:
+        # Every hart is a single run, so that no pattern is left out
+        runs = [np.flatnonzero(intervals.harts == hart).tolist() for hart in intervals.first]
+        full = estimate_patterns(cache, intervals, runs, [1] * len(runs),
+            InsnPatternsPass.window_sizes)
+        errors["insn_patterns"] = count_error(estimates["insn_patterns"], full)
+    if "reg_accesses" in estimates:
+        _, regs = check_isa(isa, ["Type", "Format"], reg=True)
+        rs_counts, rd_counts = estimate_regs(cache, intervals, every, ones)
+        full = fill_regs(regs, cache["tables"]["regs"], rs_counts[1:], rd_counts[1:])
+        errors["reg_accesses"] = count_error(reg_counts(estimates["reg_accesses"]),
+            reg_counts(full))
+    if "streams" in estimates:
+        full = stream_sums(cache, list(estimates["streams"]), isa, intervals,
+            interval_size)
+        for key, sums in estimates["streams"].items():
+            errors[key] = stream_error(sums, full[key])
+    return errors
+
+def print_errors(errors, stream=sys.stderr):
+    for name, error in errors.items():
+        print("Estimated "+name+" : "+", ".join(measure+" "+format(value, ".2%")
+            for measure, value in error.items()), file=stream)
+
+#                               ---------- Driver ----------
+
+# Pick the representative intervals of the trace cache, write the estimated
+#   results of every pass and, when checking, the error of each estimate against
+#   the whole trace. Returns the chosen intervals and the errors.
+def run_simpoints(names, isa, output_dir, cache_dir, interval_size=INTERVAL_SIZE,
+        clusters=CLUSTERS, vector="bb", dimensions=DIMENSIONS, seed=0, check=False):
+    cache = load_cache(cache_dir)
+    length = cache["meta"]["length"]
+    if length == 0:
+        raise ValueError("The trace cache doesn't hold any instructions")
+    tables = cache["tables"]
+    rng = np.random.default_rng(seed)
+
+    intervals = split_intervals(cache, interval_size)
+    points = project(VECTORS[vector](cache, intervals, interval_size), dimensions, rng)
+    labels, centres = kmeans(points, clusters, rng)
+    chosen, weights = representatives(points, labels, centres, intervals.lengths)
+
+    simpoints = {"interval_size" : interval_size, "intervals" : len(intervals.lengths),
+        "harts" : intervals.harts.tolist(), "vector" : vector,
+        "clusters" : labels.tolist(), "representatives" : chosen, "weights" : weights}
+    os.makedirs(os.path.join(output_dir, "simpoint"), exist_ok=True)
+    with open(os.path.join(output_dir, "simpoint", "simpoints.JSON"), 'w') as dump:
+        dump.write(json.dumps(simpoints))
+
+    estimates = {}
+    streams = {}
+    for name in names:
+        analysis = PASSES[name](output_dir, tables, isa)
+        if name == "insn_pairs":
+            result = estimate_pairs(cache, intervals, chosen, weights)
+            estimates[name] = result[0]
+            analysis.write({None : result})
+        elif name == "insn_patterns":
+            estimates[name] = estimate_patterns(cache, intervals,
+                [[interval] for interval in chosen], weights, analysis.window_sizes)
+            analysis.write({None : estimates[name]})
+        elif name == "reg_accesses":
+            _, regs = check_isa(isa, ["Type", "Format"], reg=True)
+            rs_counts, rd_counts = estimate_regs(cache, intervals, chosen, weights)
+            estimates[name] = fill_regs(regs, tables["regs"], rs_counts[1:], rd_counts[1:])
+            analysis.write({None : estimates[name]}, regs)
+        else:
+            streams.update(write_streams(cache, analysis, intervals, interval_size,
+                labels, chosen))
+    if streams:
+        estimates["streams"] = streams
+
+    errors = None
+    if check:
+        errors = check_estimates(cache, estimates, isa, intervals, interval_size)
+        with open(os.path.join(output_dir, "simpoint", "error.JSON"), 'w') as dump:
+            dump.write(json.dumps(errors))
+    return simpoints, errors
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-c", "--cache", required=True, help="Trace cache directory \
+        built by trace_cache.py")
+    parser.add_argument("-o", "--output", required=True, help="Results directory \
+        the estimated artefacts of every pass are written under")
+    parser.add_argument("-a", "--analyses", help="Comma separated analysis passes \
+        to estimate, defaults to all of them : "+", ".join(ESTIMATED_PASSES))
+    parser.add_argument("-i", "--interval", type=int, default=INTERVAL_SIZE,
+        help="Number of instructions in each interval")
+    parser.add_argument("-k", "--clusters", type=int, default=CLUSTERS, help="Maximum \
+        number of clusters, i.e. of representative intervals")
+    parser.add_argument("-v", "--vector", choices=list(VECTORS), default="bb",
+        help="Vector each interval is summed up by, basic block (bb) or opcode \
+        counts")
+    parser.add_argument("--dimensions", type=int, default=DIMENSIONS, help="Number of \
+        dimensions the vectors are randomly projected down to")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="Seed of the \
+        random projection and of the k-means initialisation")
+    parser.add_argument("--check", action="store_true", help="Also run the analyses \
+        over the whole trace and report the error of every estimate to stderr \
+        and simpoint/error.JSON")
+    args = parser.parse_args()
+
+    names = args.analyses.split(",") if args.analyses else list(ESTIMATED_PASSES)
+    for name in names:
+        if name not in ESTIMATED_PASSES:
+            parser.error("Can't estimate analysis pass "+name+", choose from "
+                +", ".join(ESTIMATED_PASSES))
+    if args.interval < 1 or args.clusters < 1:
+        parser.error("The interval size and number of clusters must be positive")
+
+    try:
+        simpoints, errors = run_simpoints(names, args.isa, args.output, args.cache,
+            args.interval, args.clusters, args.vector, args.dimensions, args.seed,
+            args.check)
+    except ValueError as error:
+        parser.error(error.args[0])
+    print("Picked "+str(len(simpoints["representatives"]))+" of "
+        +str(simpoints["intervals"])+" intervals", file=sys.stderr)
+    if errors is not None:
+        print_errors(errors)
+
+if __name__ == "__main__":
+    main()
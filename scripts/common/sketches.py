@@ -0,0 +1,73 @@
+# Bounded memory counters for finding the most frequent patterns (heavy hitters)
+# Counting patterns exactly needs one dictionary entry per distinct pattern, which
+#   grows with the length of the trace. The Space-Saving algorithm instead holds at
+#   most a fixed number of counters: when a new pattern arrives and every counter
+#   is in use, the pattern with the smallest counter is evicted and the new pattern
+#   takes over its counter (plus one). The counts are then approximate:
+#       - A counter never underestimates, it overestimates the true count by at
+#       most the counter it took over, stored as its error
+#       - Every error is at most total/capacity, so any pattern occuring more
+#       often than that is guaranteed to be held by a counter
+
+import sys
+import heapq
+
+class SpaceSaving:
+    # capacity : Maximum number of counters held in memory
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("Space-Saving needs a capacity of at least 1 counter")
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # Min-heap of (counter, key) used to find the smallest counter. Each key
+        #   has a single entry which may be out of date since counters are
+        #   incremented in place, entries are only refreshed when popped.
+        self.heap = []
+
+    def update(self, key):
+        self.total += 1
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (1, key))
+        else:
+            minimum, evicted = self.pop_minimum()
+            del counts[evicted]
+            del self.errors[evicted]
+            counts[key] = minimum + 1
+            self.errors[key] = minimum
+            heapq.heappush(self.heap, (minimum + 1, key))
+
+    # Remove and return the smallest (counter, key), refreshing any stale entries
+    def pop_minimum(self):
+        heap = self.heap
+        while True:
+            count, key = heapq.heappop(heap)
+            if self.counts[key] == count:
+                return count, key
+            heapq.heappush(heap, (self.counts[key], key))
+
+    def items(self):
+        return self.counts.items()
+
+    # Largest possible overestimate of any counter
+    def max_error(self):
+        return max(self.errors.values(), default=0)
+
+    # Guaranteed bound on the overestimate of any counter, total/capacity
+    def error_bound(self):
+        return self.total // self.capacity
+
+# Print the error bounds of a set of sketches, one per pattern size, to stderr so
+#   that the formatted results on stdout keep the same format as exact counting
+def report_error_bounds(sketches, name="patterns", stream=sys.stderr):
+    for n, sketch in sketches.items():
+        print("Approximate counters for "+name+" of size "+str(n)+" : "
+            +str(len(sketch.counts))+" counters held out of "+str(sketch.total)
+            +" windows, counters overestimate by at most "+str(sketch.max_error())
+            +" (bound "+str(sketch.error_bound())+")", file=stream)
@@ -0,0 +1,198 @@
+# Run Spike and analyse its instruction trace as it's being simulated
+# Instead of writing the whole trace to testcase.trc, slicing main.trc out of it
+#   and only then reading it back in, Spike is launched as a subprocess
+#   and its trace is read straight from the pipe. The section of main is cut out
+#   in-process (with the same rules as trace_index.py, only matching the PC field
+#   of each line) and pushed to the analysis passes of analyse_trace.py, so no
+#   trace file is written unless asked for.
+# The pipe is drained by a reader thread into a bounded queue of blocks of lines.
+#   Once the queue is full the reader stops reading, the pipe fills up and Spike
+#   blocks until the analyses catch up, so memory stays bounded no matter how
+#   fast Spike is.
+
+# Input : RISC-V executable, along with its disassembly (testcase.dasm) or the
+#   start and end PCs of main
+# Output : Results directory holding the artefacts of every analysis pass, see
+#   analyse_trace.py. Optionally the trace of main as well (--save), the same as
+#   main.trc.
+# --isa flag : Determines the instructions we expect to see in the program; same as
+#   the --isa flag in Spike
+
+# Example to guide use:
+# Run the command : python3 scripts/common/spike_runner.py --isa=rv32gc -n=2 \
+#       -d=build/rv32gc-ilp32-gcc/printf/testcase.dasm -p \
+#       -o=build/rv32gc-ilp32-gcc/printf/nproc-2/results \
+#       build/rv32gc-ilp32-gcc/printf/testcase.elf
+#   while in the base directory
+
+import sys
+import os
+import argparse
+import subprocess
+import threading
+from queue import Queue
+
+# Adding the parent directory to the python file path to
+#   allow absolute file path inclusions
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.analyse_trace import run_passes, BATCH_SIZE
+from common.decode_cache import DECODE_CACHE_SIZE
+from common.passes import PASSES
+from common.trace_index import PC_PATTERN, symbol_range
+
+# Number of lines in each block passed from the reader thread
+BLOCK_LINES = 1 << 12
+# Default number of blocks held in the queue before Spike is held back
+QUEUE_DEPTH = 64
+
+# Whether the line executes the PC. The PC is looked for as plain text first and
+#   only then checked against the PC field of the line, so the addresses showing
+#   up elsewhere in it (e.g. in the operands of a branch) aren't matched.
+def executes_pc(line, pc, pc_hex):
+    if pc_hex not in line:
+        return False
+    match = PC_PATTERN.match(line.encode())
+    return match is not None and int(match.group(1), 16) == pc
+
+# Generator yielding every section of the lines from a line executing the start
+#   PC up to the next line executing the end PC (both included), the same
+#   sections as trace_index.py slices out of a trace file. The end PC is only
+#   looked for from the line after the start, and a new section starts at the
+#   next line executing the start PC.
+def pc_range(lines, start_pc, end_pc):
+    start_hex = format(start_pc, "x")
+    end_hex = format(end_pc, "x")
+    in_range = False
+    for line in lines:
+        if in_range:
+            yield line
+            if executes_pc(line, end_pc, end_hex):
+                in_range = False
+        elif executes_pc(line, start_pc, start_hex):
+            yield line
+            in_range = True
+
+# Reader thread function, reads the pipe in blocks of lines into the queue,
+#   followed by None at the end of the stream
+def read_blocks(pipe, blocks, block_lines):
+    block = []
+    for line in pipe:
+        block.append(line)
+        if len(block) == block_lines:
+            blocks.put(block) # Blocks while the queue is full
+            block = []
+    if block:
+        blocks.put(block)
+    blocks.put(None)
+
+# Generator yielding the lines of the pipe, read ahead by a reader thread holding
+#   at most depth blocks of lines
+def queued_lines(pipe, depth=QUEUE_DEPTH, block_lines=BLOCK_LINES):
+    blocks = Queue(maxsize=depth)
+    reader = threading.Thread(target=read_blocks, args=(pipe, blocks, block_lines),
+        daemon=True)
+    reader.start()
+    while True:
+        block = blocks.get()
+        if block is None:
+            break
+        yield from block
+    reader.join()
+
+# Generator passing the lines through while also writing them to a file
+def tee_lines(lines, path):
+    with open(path, 'w') as copy:
+        for line in lines:
+            copy.write(line)
+            yield line
+
+# Command line running the executable in Spike with the trace written to stderr
+def spike_command(elf, isa, nproc=1, spike="spike"):
+    return [spike, "-p"+str(nproc), "-l", "--isa="+isa, elf]
+
+# Run Spike and push the trace of main to the analysis passes. The whole trace
+#   (testcase.trc) and the trace of main (main.trc) are only written out when
+#   given a path to save them to. The program's own output goes to stdout.
+def run_spike(command, names, isa, output_dir, start_pc=None, end_pc=None,
+        per_hart=False, save_trace=None, save_main=None, depth=QUEUE_DEPTH,
+        batch_size=BATCH_SIZE, decode_cache_size=DECODE_CACHE_SIZE):
+    spike = subprocess.Popen(command, stderr=subprocess.PIPE, text=True)
+    try:
+        lines = queued_lines(spike.stderr, depth)
+        if save_trace:
+            lines = tee_lines(lines, save_trace)
+        if start_pc is not None:
+            lines = pc_range(lines, start_pc, end_pc)
+        if save_main:
+            lines = tee_lines(lines, save_main)
+        run_passes(names, isa, output_dir, stream=lines, per_hart=per_hart,
+            batch_size=batch_size, decode_cache_size=decode_cache_size)
+    except BaseException:
+        # Only kill Spike when the analyses fail or are interrupted, it can close
+        #   the pipe slightly before exiting at the end of a normal run
+        spike.kill()
+        spike.wait()
+        raise
+    return spike.wait()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("elf", help="RISC-V executable run in Spike")
+    parser.add_argument("--isa", help="RISC-V ISA string, passed on to Spike")
+    parser.add_argument("-n", "--nproc", type=int, default=1, help="Number of \
+        cores simulated by Spike")
+    parser.add_argument("--spike", default="spike", help="Spike command, defaults \
+        to spike")
+    parser.add_argument("-d", "--dasm", help="Disassembly of the executable \
+        (testcase.dasm), the section of the trace analysed is the one of --symbol")
+    parser.add_argument("--symbol", default="main", help="Symbol of the \
+        disassembly whose section of the trace is analysed, defaults to main")
+    parser.add_argument("--start", help="PC starting each section of the trace \
+        analysed, instead of taking it from --dasm")
+    parser.add_argument("--end", help="PC ending each section of the trace \
+        analysed, instead of taking it from --dasm")
+    parser.add_argument("-a", "--analyses", help="Comma separated analysis passes \
+        to run, defaults to all of them : "+", ".join(PASSES))
+    parser.add_argument("-o", "--output", help="Results directory the artefacts \
+        of every pass are written under")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Analyse \
+        each hart separately, producing a result per hart along with the merged \
+        result")
+    parser.add_argument("-s", "--save", help="Also write the trace of main to this \
+        file (main.trc)")
+    parser.add_argument("--save_full", help="Also write the whole trace to this \
+        file (testcase.trc)")
+    parser.add_argument("-q", "--queue", type=int, default=QUEUE_DEPTH, help="Number \
+        of blocks of "+str(BLOCK_LINES)+" lines read ahead of the analyses before \
+        Spike is held back")
+    args = parser.parse_args()
+
+    names = args.analyses.split(",") if args.analyses else list(PASSES)
+    for name in names:
+        if name not in PASSES:
+            parser.error("Unknown analysis pass "+name+", choose from "
+                +", ".join(PASSES))
+
+    start_pc = end_pc = None
+    if args.dasm:
+        try:
+            start_pc, end_pc = symbol_range(args.dasm, args.symbol)
+        except KeyError as error:
+            parser.error(error.args[0])
+    elif args.start and args.end:
+        start_pc, end_pc = int(args.start, 16), int(args.end, 16)
+    elif args.start or args.end:
+        parser.error("Both the start and end PCs are needed")
+
+    command = spike_command(args.elf, args.isa, args.nproc, args.spike)
+    returncode = run_spike(command, names, args.isa, args.output, start_pc, end_pc,
+        args.per_hart, args.save_full, args.save, args.queue)
+    if returncode:
+        sys.exit("Spike exited with code "+str(returncode))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Benchmark the start-up time of the scripts
+# Every script is run with --help, which returns as soon as its imports are done
+#   and its arguments parsed, a few times in a row and the fastest run is kept.
+#   The time taken by a bare interpreter is subtracted to give the cost of the
+#   script's own imports. Heavy imports (e.g. matplotlib or SciPy) in a script
+#   that doesn't need them then stand out straight away.
+
+# Input : None, the scripts are found relative to this file
+# Output : Start-up and import time of each script in milliseconds, along with
+#   the slowest top-level imports of each script (--modules), printed to stdout.
+#   Optionally saved as JSON (--jsondump) to be passed back in with --baseline
+#   later on, showing how the import cost of each script has changed.
+
+# Example to guide use:
+# Run the command : python3 scripts/common/startup_time.py -m=3 \
+#       -j=build/startup.JSON
+#   while in the base directory
+
+import sys
+import os
+import json
+import time
+import argparse
+import subprocess
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+
+# Scripts launched by the Makefile, followed by the other command line scripts
+SCRIPTS = [
+    "common/trace_cache.py",
+    "common/analyse_trace.py",
+    "common/spike_runner.py",
+    "common/trace_index.py",
+    "display/line_graph.py",
+    "display/heatmap.py",
+    "display/column.py",
+    "insn_patterns/insn_pairs.py",
+    "insn_patterns/insn_patterns.py",
+    "reg_accesses/reg_accesses.py",
+    "reg_accesses/reg_display.py",
+    "reg_sequences/reg_pairs.py",
+    "reg_sequences/reg_patterns.py",
+    "reg_sequences/insn_reg_pairs.py",
+    "reg_sequences/insn_reg_patterns.py",
+    "common/bandwidth.py",
+    "common/key_stream.py",
+    "common/moving_average.py",
+]
+
+# Fastest wall clock time of the command over the repeats, in milliseconds
+def run_time(command, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            check=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Slowest top-level imports of the script, taken from the -X importtime report.
+#   Returns a list of (module, cumulative milliseconds) tuples.
+def slowest_imports(path, top):
+    report = subprocess.run([sys.executable, "-X", "importtime", path, "--help"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    imports = []
+    for line in report.splitlines():
+        # e.g. "import time:       204 |     112364 | common.transitions", nested
+        #   imports being indented by two spaces per level
+        fields = line.split("|")
+        if not line.startswith("import time:") or len(fields) != 3:
+            continue
+        name = fields[2][1:]
+        if name.startswith(" ") or not fields[1].strip().isdigit():
+            continue
+        imports.append((name, int(fields[1]) / 1000))
+    return sorted(imports, key=lambda x: x[1], reverse=True)[:top]
+
+# Time every script, returning a dictionary of script -> {"startup", "imports"}
+#   along with the time of the bare interpreter
+def time_scripts(scripts, repeats):
+    interpreter = run_time([sys.executable, "-c", "pass"], repeats)
+    results = {}
+    for script in scripts:
+        startup = run_time([sys.executable, os.path.join(parent, script), "--help"], repeats)
+        results[script] = {"startup" : startup, "imports" : max(startup - interpreter, 0)}
+    return results, interpreter
+
+def print_results(results, interpreter, baseline=None, modules=0):
+    print("Interpreter start-up : {:.1f} ms".format(interpreter))
+    print(f'{"Script":<40} : {"start-up":>10} {"imports":>10}'
+        + (f' {"change":>10}' if baseline else ""))
+    for script, times in results.items():
+        line = f'{script:<40} : {times["startup"]:>7.1f} ms {times["imports"]:>7.1f} ms'
+        if baseline and script in baseline:
+            line += f' {times["imports"] - baseline[script]["imports"]:>+7.1f} ms'
+        print(line)
+        if modules:
+            for name, cumulative in slowest_imports(os.path.join(parent, script), modules):
+                print(f'    {name:<36} : {cumulative:>7.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-s", "--scripts", help="Comma separated scripts to time, \
+        relative to the scripts directory, defaults to every script")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Number of \
+        runs of each script, the fastest one being kept")
+    parser.add_argument("-m", "--modules", type=int, default=0, help="Number of \
+        the slowest top-level imports to show for each script")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for the output JSON \
+        file holding the times of every script")
+    parser.add_argument("-b", "--baseline", help="JSON file saved by an earlier run \
+        with --jsondump, the change in the import time of each script is shown")
+    args = parser.parse_args()
+
+    scripts = args.scripts.split(",") if args.scripts else SCRIPTS
+    results, interpreter = time_scripts(scripts, args.repeats)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)["scripts"]
+    print_results(results, interpreter, baseline, args.modules)
+
+    if args.jsondump:
+        with open(args.jsondump, 'w') as dump:
+            dump.write(json.dumps({"interpreter" : interpreter, "scripts" : results}))
+
+if __name__ == "__main__":
+    main()
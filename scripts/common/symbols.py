@@ -0,0 +1,116 @@
+# Read the symbols (functions and other labels) out of the objdump disassembly
+# The Makefile disassembles every executable with objdump -S -D into
+#   testcase.dasm, where each symbol starts with a header line followed by its
+#   instructions, interleaved with the source code:
+#   80001048 <main>:
+#   int main() {
+#   80001048:	1101                	addi	sp,sp,-32
+#   |           |                   |
+#   address     encoding            instruction
+# The symbols are turned into an interval index (a sorted array of their start
+#   addresses, searched with np.searchsorted) so that the function of every PC
+#   in the trace is found in one vectorised pass.
+
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# Single symbol of the disassembly
+#   - name   : Symbol name e.g. "main"
+#   - start  : Address of the symbol
+#   - last   : Address of its last instruction, start when it has none
+#   - ret    : Address of its first ret instruction, None when it has none
+Symbol = namedtuple("Symbol", ["name", "start", "last", "ret"])
+
+# Split an instruction line of the disassembly into its address and instruction
+#   name, returning None for any other line (headers, source code, blank lines)
+def parse_dasm_line(line):
+    fields = line.split("\t")
+    if len(fields) < 3 or not fields[0].endswith(":"):
+        return None
+    try:
+        address = int(fields[0][:-1], 16)
+    except ValueError:
+        return None
+    return address, fields[2].strip()
+
+# Read every symbol of the disassembly, in the order they appear
+def read_symbols(dasm_path):
+    symbols = []
+    name = None
+    with open(dasm_path, 'r') as dasm:
+        for line in dasm:
+            line = line.rstrip("\n")
+            # Symbol header e.g. "80001048 <main>:"
+            if line.endswith(">:") and " <" in line:
+                if name is not None:
+                    symbols.append(Symbol(name, start, last, ret))
+                address, name = line[:-2].split(" <", 1)
+                start = last = int(address, 16)
+                ret = None
+                continue
+            if name is None:
+                continue
+            insn = parse_dasm_line(line)
+            if insn is None:
+                continue
+            last = insn[0]
+            if ret is None and insn[1] == "ret":
+                ret = insn[0]
+    if name is not None:
+        symbols.append(Symbol(name, start, last, ret))
+    return symbols
+
+# Find a symbol by name, raising a KeyError when it isn't in the disassembly
+def find_symbol(symbols, name):
+    for symbol in symbols:
+        if symbol.name == name:
+            return symbol
+    raise KeyError("Symbol "+name+" not found in the disassembly")
+
+# Name given to the PCs that don't fall within any symbol
+UNKNOWN = "unknown"
+
+# Interval index over the symbols. Symbol i covers the addresses from starts[i]
+#   up to its last instruction lasts[i], symbols being sorted by address.
+class SymbolIndex:
+    def __init__(self, symbols):
+        symbols = sorted(symbols, key=lambda symbol: symbol.start)
+        self.names = [symbol.name for symbol in symbols]
+        self.starts = np.array([symbol.start for symbol in symbols], dtype=np.uint64)
+        self.lasts = np.array([symbol.last for symbol in symbols], dtype=np.uint64)
+
+    # Index of the symbol holding each PC, -1 for the PCs outside every symbol
+    def lookup(self, pcs):
+        pcs = np.asarray(pcs, dtype=np.uint64)
+        functions = np.searchsorted(self.starts, pcs, side='right').astype(np.int64) - 1
+        inside = functions >= 0
+        inside[inside] = pcs[inside] <= self.lasts[functions[inside]]
+        return np.where(inside, functions, -1)
+
+    def name(self, function):
+        return UNKNOWN if function < 0 else self.names[function]
+
+# Build the interval index of the disassembly
+def symbol_index(dasm_path):
+    return SymbolIndex(read_symbols(dasm_path))
+
+# Integer values of the PC strings of the records, the same as the pc column of
+#   a trace cache
+def record_pcs(pcs):
+    return np.array([int(pc, 16) for pc in pcs], dtype=np.uint64)
+
+# Group the values by the function each one is attributed to, keeping their
+#   order in the trace. Returns a dictionary of function index -> values, in
+#   address order (the PCs outside every symbol first, under -1).
+def split_functions(values, functions):
+    order = np.argsort(functions, kind='stable')
+    grouped = np.asarray(values)[order]
+    ids, starts = np.unique(functions[order], return_index=True)
+    return dict(zip(ids.tolist(), np.split(grouped, starts[1:])))
+
+# File path used for the results of a single function e.g. pairs.JSON -> pairs-main.JSON
+def function_path(path, name):
+    root, ext = os.path.splitext(path)
+    return root + "-" + name + ext
@@ -0,0 +1,197 @@
+# Convert an instruction trace into a columnar binary cache of NumPy arrays
+# The text trace is parsed once and every column is saved as its own .npy file
+#   so that the analysis scripts can memory-map them with np.load(mmap_mode='r')
+#   instead of re-tokenising the trace on every run. Memory-mapped columns are
+#   shared between processes through the page cache without any copies.
+
+# Input : Instruction trace (e.g. testcase.trc or main.trc)
+# Output : Cache directory containing
+#   - hart.npy, pc.npy, encoding.npy : Raw values taken from each trace line
+#   - opcode.npy : Interned opcode id, index into tables.json["opcodes"]
+#   - rs1.npy, rs2.npy, rd.npy : Register number decoded from the encoding,
+#   index into tables.json["regs"], -1 where the instruction doesn't use that
+#   register
+#   - text.npy : Interned id of the instruction and operand text, index into
+#   tables.json["texts"]
+#   - meta.json : Information about the source trace, written last so that it
+#   marks the cache as complete
+
+# Example to guide use:
+# Run the command : python3 scripts/common/trace_cache.py --isa=rv32ic \
+#       -t=scripts/example-printf.trc -o=build/example-printf.cache
+#   while in the base directory
+
+import sys
+import os
+import json
+import argparse
+from array import array
+
+import numpy as np
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.isa_management import check_isa
+from common.trace_reader import read_trace, TraceRecord
+from common.reg_functions import REG_NAMES, decode_encodings
+
+# Column names along with the NumPy dtype and the array.array typecode used
+#   while building them
+COLUMNS = {
+    "hart"     : (np.uint16, 'H'),
+    "pc"       : (np.uint64, 'Q'),
+    "encoding" : (np.uint32, 'I'),
+    "opcode"   : (np.uint16, 'H'),
+    "rs1"      : (np.int16,  'h'),
+    "rs2"      : (np.int16,  'h'),
+    "rd"       : (np.int16,  'h'),
+    "text"     : (np.uint32, 'I'),
+}
+
+# Number of records buffered in memory before being flushed to disk
+BLOCK_SIZE = 1 << 20
+
+# Look up the id of a string in an intern table, adding it if it's new
+def intern(table, ids, string):
+    if string in ids:
+        return ids[string]
+    ids[string] = len(table)
+    table.append(string)
+    return ids[string]
+
+# Check whether the cache directory holds a complete cache built from the
+#   current version of the trace file
+def is_fresh(cache_dir, trace_path):
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r') as meta_file:
+        meta = json.load(meta_file)
+    stat = os.stat(trace_path)
+    return meta["mtime"] == stat.st_mtime and meta["size"] == stat.st_size
+
+# Parse the trace once and write every column into the cache directory.
+#   Columns are written out in blocks so that memory use stays constant
+#   regardless of the trace length.
+def build_cache(trace_path, cache_dir, isa):
+    os.makedirs(cache_dir, exist_ok=True)
+    # Remove any old meta file first, the cache is incomplete until rewritten
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    all_instrs = check_isa(isa, ["Type", "Format"])
+    tables = {"opcodes" : [], "regs" : list(REG_NAMES), "texts" : []}
+    ids = {name : {} for name in tables}
+    raw_files = {c : open(os.path.join(cache_dir, c+".raw"), 'wb') for c in COLUMNS}
+    buffers = {c : array(COLUMNS[c][1]) for c in COLUMNS}
+    length = 0
+    pc_width = 0
+
+    # Write out the buffered records, the registers of the whole block being
+    #   decoded from the encodings in one go
+    def flush():
+        regs = decode_encodings(np.frombuffer(buffers["encoding"], dtype=np.uint32),
+            np.frombuffer(buffers["opcode"], dtype=np.uint16), tables["opcodes"], all_instrs)
+        for c, column in zip(["rs1", "rs2", "rd"], regs):
+            buffers[c] = column.astype(COLUMNS[c][0])
+        for c in COLUMNS:
+            buffers[c].tofile(raw_files[c])
+            buffers[c] = array(COLUMNS[c][1])
+
+    with open(trace_path, 'r') as trace:
+        for record in read_trace(trace):
+            buffers["hart"].append(record.hart)
+            buffers["pc"].append(int(record.pc, 16))
+            buffers["encoding"].append(int(record.encoding, 16))
+            buffers["opcode"].append(intern(tables["opcodes"], ids["opcodes"], record.insn))
+            buffers["text"].append(intern(tables["texts"], ids["texts"], record.text))
+            pc_width = max(pc_width, len(record.pc) - 2)
+            length += 1
+
+            if len(buffers["hart"]) == BLOCK_SIZE:
+                flush()
+
+    # Flush the remaining records and convert each raw column into a .npy file
+    flush()
+    for c, (dtype, _) in COLUMNS.items():
+        raw_files[c].close()
+        raw_path = os.path.join(cache_dir, c+".raw")
+        column = np.lib.format.open_memmap(os.path.join(cache_dir, c+".npy"),
+            mode='w+', dtype=dtype, shape=(length,))
+        if length:
+            column[:] = np.memmap(raw_path, dtype=dtype, mode='r', shape=(length,))
+        column.flush()
+        del column
+        os.remove(raw_path)
+
+    with open(os.path.join(cache_dir, "tables.json"), 'w') as tables_file:
+        tables_file.write(json.dumps(tables))
+
+    stat = os.stat(trace_path)
+    meta = {"source" : os.path.abspath(trace_path), "mtime" : stat.st_mtime,
+        "size" : stat.st_size, "isa" : isa, "length" : length, "pc_width" : pc_width}
+    with open(meta_path, 'w') as meta_file:
+        meta_file.write(json.dumps(meta))
+
+# Open a cache directory. Returns a dictionary with every column memory-mapped
+#   read only, along with the intern tables and the meta information.
+def load_cache(cache_dir):
+    with open(os.path.join(cache_dir, "meta.json"), 'r') as meta_file:
+        meta = json.load(meta_file)
+    with open(os.path.join(cache_dir, "tables.json"), 'r') as tables_file:
+        tables = json.load(tables_file)
+
+    cache = {"meta" : meta, "tables" : tables}
+    for c in COLUMNS:
+        cache[c] = np.load(os.path.join(cache_dir, c+".npy"), mmap_mode='r')
+    return cache
+
+# Generator yielding the cached trace as TraceRecords, in the same format as
+#   read_trace(), so that any tracker can be run on a cache. Optionally only
+#   yields the records between the start and stop indices, or only the records
+#   executed by a single hart.
+def cache_records(cache, start=0, stop=None, hart=None):
+    opcodes = cache["tables"]["opcodes"]
+    regs = cache["tables"]["regs"] + [None] # Index -1 gives None
+    texts = cache["tables"]["texts"]
+    pc_format = "0x{:0" + str(cache["meta"]["pc_width"]) + "x}"
+    stop = cache["meta"]["length"] if stop is None else stop
+
+    # Convert a block of each column into Python lists at a time
+    for block_start in range(start, stop, BLOCK_SIZE):
+        block = slice(block_start, min(block_start + BLOCK_SIZE, stop))
+        if hart is None:
+            columns = [cache[c][block].tolist() for c in COLUMNS]
+        else:
+            mask = cache["hart"][block] == hart
+            columns = [cache[c][block][mask].tolist() for c in COLUMNS]
+        for hart_id, pc, encoding, opcode, rs1, rs2, rd, text in zip(*columns):
+            text = texts[text]
+            yield TraceRecord(hart_id, pc_format.format(pc), "0x{:08x}".format(encoding),
+                opcodes[opcode], text.split(), text, regs[rs1], regs[rs2], regs[rd])
+
+# Generator yielding the values of a single column as Python integers, e.g.
+#   the interned opcode ids, without building the full TraceRecords
+def column_values(cache, column, start=0, stop=None):
+    stop = cache["meta"]["length"] if stop is None else stop
+    for block_start in range(start, stop, BLOCK_SIZE):
+        yield from cache[column][block_start:min(block_start + BLOCK_SIZE, stop)].tolist()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-t", "--trace", help="Input instruction trace")
+    parser.add_argument("-o", "--output", help="Output cache directory")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="Rebuild the cache even if it's already up to date")
+    args = parser.parse_args()
+
+    if args.force or not is_fresh(args.output, args.trace):
+        build_cache(args.trace, args.output, args.isa)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Index an instruction trace by program counter and slice sections out of it
+# main.trc used to be cut out of testcase.trc with sed, which scans the whole
+#   trace with a regex and also matches the start and end addresses wherever
+#   they appear as text (e.g. in the operands of a branch). Here the trace is
+#   indexed once in chunks of lines, recording for each chunk its byte offset,
+#   the range of PCs in it and the distinct PCs it holds. Slicing then only reads
+#   the chunks holding the start and end PCs, matching them against the PC
+#   field of each line, and copies the bytes in between. The index is saved next
+#   to the trace and rebuilt only when the trace changes, so slicing the same
+#   trace again costs little more than the size of the slice.
+
+# Input : Instruction trace (e.g. testcase.trc), along with either the start and
+#   end PCs of the section or a symbol of its disassembly (testcase.dasm)
+# Output : Every section of the trace from a line executing the start PC up to
+#   the next line executing the end PC (both included), the same as
+#   sed -n '/start/,/end/p' but only matching the PC of each line
+# For a symbol, the section runs from its first instruction to its first ret
+#   (or its last instruction when it doesn't have one), the same section of the
+#   disassembly as main.dasm.
+
+# Example to guide use:
+# Run the command : python3 scripts/common/trace_index.py \
+#       -d=build/rv32gc-ilp32-gcc/printf/testcase.dasm -s=main \
+#       -o=build/rv32gc-ilp32-gcc/printf/nproc-1/main.trc \
+#       build/rv32gc-ilp32-gcc/printf/nproc-1/testcase.trc
+#   or : python3 scripts/common/trace_index.py --start=0x80001048 \
+#       --end=0x8000106e build/rv32gc-ilp32-gcc/printf/nproc-1/testcase.trc
+#   while in the base directory
+
+import sys
+import os
+import re
+import argparse
+
+import numpy as np
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.symbols import read_symbols, find_symbol
+
+# Default number of bytes of the trace in each chunk of the index
+CHUNK_BYTES = 1 << 20
+# Number of bytes copied at a time when writing out a slice
+COPY_BYTES = 1 << 20
+
+# PC field of every instruction line e.g. "core   0: 0x8000104e (0xfca42e23) ..."
+PC_PATTERN = re.compile(rb"^core\s+\d+: 0x([0-9a-f]+) \(0x", re.M)
+
+# Path of the index saved next to the trace
+def index_path(trace_path):
+    return trace_path + ".index.npz"
+
+# Generator yielding the byte offset and bytes of each chunk of the trace, every
+#   chunk ending on a line boundary
+def trace_chunks(trace, chunk_bytes):
+    offset = 0
+    rest = b""
+    while True:
+        data = trace.read(chunk_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            rest = data
+            continue
+        yield offset, data[:end]
+        offset += end
+        rest = data[end:]
+    if rest:
+        yield offset, rest
+
+# Read the trace once, indexing it in chunks of roughly chunk_bytes. Returns a
+#   dictionary of arrays, with one entry per chunk (and a last entry for the end
+#   of the trace) in offsets and pc_starts:
+#   - offsets : Byte offset of the start of each chunk
+#   - lengths : Number of instructions in each chunk
+#   - pc_min, pc_max : Range of the PCs executed in each chunk
+#   - pcs : Sorted distinct PCs of each chunk one after the other, those of
+#   chunk i being pcs[pc_starts[i]:pc_starts[i+1]]
+#   - pc_width : Number of hex digits each PC is printed with
+def build_index(trace_path, chunk_bytes=CHUNK_BYTES):
+    offsets, lengths, pc_min, pc_max, pcs, pc_starts = [], [], [], [], [], [0]
+    pc_width = 8
+    with open(trace_path, 'rb') as trace:
+        for offset, data in trace_chunks(trace, chunk_bytes):
+            found = PC_PATTERN.findall(data)
+            if found and not pcs:
+                pc_width = len(found[0])
+            distinct = sorted(int(pc, 16) for pc in set(found))
+            offsets.append(offset)
+            lengths.append(len(found))
+            pc_min.append(distinct[0] if distinct else 0)
+            pc_max.append(distinct[-1] if distinct else 0)
+            pcs.extend(distinct)
+            pc_starts.append(len(pcs))
+
+    stat = os.stat(trace_path)
+    offsets.append(stat.st_size)
+    return {
+        "offsets"   : np.array(offsets, dtype=np.uint64),
+        "lengths"   : np.array(lengths, dtype=np.uint64),
+        "pc_min"    : np.array(pc_min, dtype=np.uint64),
+        "pc_max"    : np.array(pc_max, dtype=np.uint64),
+        "pcs"       : np.array(pcs, dtype=np.uint64),
+        "pc_starts" : np.array(pc_starts, dtype=np.uint64),
+        "pc_width"  : np.array(pc_width),
+        "mtime"     : np.array(stat.st_mtime),
+        "size"      : np.array(stat.st_size, dtype=np.uint64),
+    }
+
+def save_index(index, path):
+    with open(path, 'wb') as index_file:
+        np.savez(index_file, **index)
+
+# Check whether the index was built from the current version of the trace file
+def is_fresh(index, trace_path):
+    stat = os.stat(trace_path)
+    return index["mtime"] == stat.st_mtime and index["size"] == stat.st_size
+
+# Load the index of the trace, building and saving it first when it's missing
+#   or out of date
+def load_index(trace_path, path=None, chunk_bytes=CHUNK_BYTES, force=False):
+    path = index_path(trace_path) if path is None else path
+    if not force and os.path.exists(path):
+        with np.load(path) as saved:
+            index = {name : saved[name] for name in saved.files}
+        if is_fresh(index, trace_path):
+            return index
+    index = build_index(trace_path, chunk_bytes)
+    save_index(index, path)
+    return index
+
+# Boolean mask of the chunks executing the PC
+def pc_chunks(index, pc):
+    chunks = np.zeros(len(index["lengths"]), dtype=bool)
+    in_range = (index["pc_min"] <= pc) & (index["pc_max"] >= pc)
+    for chunk in np.flatnonzero(in_range).tolist():
+        start, stop = index["pc_starts"][chunk:chunk + 2].tolist()
+        pcs = index["pcs"][start:stop]
+        position = np.searchsorted(pcs, pc)
+        chunks[chunk] = position < len(pcs) and pcs[position] == pc
+    return chunks
+
+# Byte offsets of the start and end of the first line of the data executing the
+#   PC at or after position, None when there is none. The PC field is looked for
+#   as plain bytes first and only then checked to be the PC of an instruction
+#   line, rather than matching every line against a regex.
+def find_pc(data, pc, field, position):
+    while True:
+        found = data.find(field, position)
+        if found == -1:
+            return None
+        start = data.rfind(b"\n", 0, found) + 1
+        end = data.find(b"\n", found)
+        end = len(data) if end == -1 else end + 1
+        match = PC_PATTERN.match(data, start)
+        if match and match.end(1) == found + len(field) - 2 \
+                and int(match.group(1), 16) == pc:
+            return start, end
+        position = found + 1
+
+# Byte ranges of every section of the trace from a line executing the start PC
+#   up to the next line executing the end PC, both included. The last section
+#   runs to the end of the trace when the end PC isn't executed again. Only the
+#   chunks executing the PC looked for at the time are read.
+def slice_ranges(trace, index, start_pc, end_pc):
+    start_chunks = pc_chunks(index, start_pc)
+    end_chunks = pc_chunks(index, end_pc)
+    pc_format = "{:0" + str(int(index["pc_width"])) + "x}"
+    start_field = (" 0x" + pc_format.format(start_pc) + " (").encode()
+    end_field = (" 0x" + pc_format.format(end_pc) + " (").encode()
+    offsets = index["offsets"].tolist()
+
+    ranges = []
+    begin = None
+    for chunk in np.flatnonzero(start_chunks | end_chunks).tolist():
+        if not (end_chunks[chunk] if begin is not None else start_chunks[chunk]):
+            continue
+        trace.seek(offsets[chunk])
+        data = trace.read(offsets[chunk + 1] - offsets[chunk])
+        position = 0
+        while True:
+            if begin is None:
+                line = find_pc(data, start_pc, start_field, position)
+                if line is None:
+                    break
+                begin = offsets[chunk] + line[0]
+            else:
+                line = find_pc(data, end_pc, end_field, position)
+                if line is None:
+                    break
+                ranges.append((begin, offsets[chunk] + line[1]))
+                begin = None
+            position = line[1]
+    if begin is not None:
+        ranges.append((begin, offsets[-1]))
+    return ranges
+
+# Write the sections of the trace between the start and end PCs to the output
+def write_slice(trace_path, output, start_pc, end_pc, index=None):
+    index = load_index(trace_path) if index is None else index
+    with open(trace_path, 'rb') as trace:
+        for start, stop in slice_ranges(trace, index, start_pc, end_pc):
+            trace.seek(start)
+            while start < stop:
+                data = trace.read(min(COPY_BYTES, stop - start))
+                output.write(data)
+                start += len(data)
+
+# Start and end PCs of the section of a symbol, from its first instruction to
+#   its first ret
+def symbol_range(dasm_path, name):
+    symbol = find_symbol(read_symbols(dasm_path), name)
+    return symbol.start, symbol.last if symbol.ret is None else symbol.ret
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace", help="Input instruction trace")
+    parser.add_argument("-d", "--dasm", help="Disassembly of the executable \
+        (testcase.dasm), the symbols are taken from")
+    parser.add_argument("-s", "--symbol", help="Symbol of the disassembly whose \
+        section of the trace is sliced out e.g. main")
+    parser.add_argument("--start", help="PC starting each section, instead of \
+        taking it from a symbol")
+    parser.add_argument("--end", help="PC ending each section, instead of taking \
+        it from a symbol")
+    parser.add_argument("-o", "--output", help="Output trace, defaults to stdout")
+    parser.add_argument("-i", "--index", help="Index file, defaults to the trace \
+        file name followed by .index.npz")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_BYTES, help="Number \
+        of bytes of the trace in each chunk of the index")
+    parser.add_argument("-f", "--force", action="store_true",
+        help="Rebuild the index even if it's already up to date")
+    args = parser.parse_args()
+
+    if args.symbol:
+        if not args.dasm:
+            parser.error("A symbol needs the disassembly (--dasm)")
+        try:
+            start_pc, end_pc = symbol_range(args.dasm, args.symbol)
+        except KeyError as error:
+            parser.error(error.args[0])
+    elif args.start and args.end:
+        start_pc, end_pc = int(args.start, 16), int(args.end, 16)
+    else:
+        parser.error("Either a symbol or both the start and end PCs are needed")
+
+    index = load_index(args.trace, args.index, args.chunk_size, args.force)
+    if args.output:
+        with open(args.output, 'wb') as output:
+            write_slice(args.trace, output, start_pc, end_pc, index)
+    else:
+        write_slice(args.trace, sys.stdout.buffer, start_pc, end_pc, index)
+        sys.stdout.buffer.flush()
+
+if __name__ == "__main__":
+    main()
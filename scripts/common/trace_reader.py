@@ -0,0 +1,77 @@
+# Shared streaming reader for Spike instruction traces
+# Lines are parsed lazily, one at a time, so that the analysis scripts never
+#   hold the whole trace in memory. Every tracker consumes the generator
+#   returned by read_trace() instead of the list from sys.stdin.readlines().
+
+# Example trace line (as produced by spike -l):
+#   core   0: 0x8000104e (0xfca42e23) sw      a0, -36(s0)
+#   |         |           |            |
+#   hart      pc          encoding     text (instruction + operands)
+
+import sys
+from collections import namedtuple
+
+from common.reg_functions import parse_instruction
+from common.decode_cache import DecodeCache
+
+# Single parsed trace line
+#   - hart      : Integer id of the core that executed the instruction
+#   - pc        : Program counter string e.g. "0x8000104e"
+#   - encoding  : Raw instruction encoding string e.g. "0xfca42e23"
+#   - insn      : Instruction name e.g. "sw"
+#   - words     : Instruction name followed by its operands, split on whitespace
+#   in the same format parse_instruction() expects e.g. ["sw", "a0,", "-36(s0)"]
+#   - text      : Instruction and operand text as printed by Spike
+#   - rs1, rs2, rd : Registers used by the instruction, only filled in when
+#   read_trace() is given the ISA dictionary, None otherwise
+TraceRecord = namedtuple("TraceRecord",
+    ["hart", "pc", "encoding", "insn", "words", "text", "rs1", "rs2", "rd"])
+
+# Parse a single line of the instruction trace into a TraceRecord. Returns None
+#   for lines that aren't instructions (e.g. exceptions or empty lines).
+#   Registers are looked up in the decode cache when given, or decoded from the
+#   encoding with the per-opcode decoders from build_decoders(), otherwise from
+#   the operand text.
+def parse_trace_line(line, all_instrs=None, decoders=None, decode_cache=None):
+    words = line.split()
+    if len(words) < 5 or not words[3].startswith("(0x"):
+        return None
+
+    # The disassembly is everything after the encoding in brackets
+    text = line.split(") ", 1)[1].rstrip("\n")
+    encoding = words[3][1:-1]
+
+    rs1 = rs2 = rd = None
+    if decode_cache is not None:
+        _, _, rs1, rs2, rd = decode_cache.decode(words[2], encoding, words[4])
+    elif decoders is not None:
+        decoder = decoders.get(words[4])
+        # Instructions that aren't in the ISA dictionary e.g. ret
+        rs1, rs2, rd = decoder(int(encoding, 16)) if decoder else ("", "", "")
+    elif all_instrs is not None:
+        rs1, rs2, rd = parse_instruction(words[4:], all_instrs)
+
+    return TraceRecord(int(words[1][:-1]), words[2], encoding, words[4],
+        words[4:], text, rs1, rs2, rd)
+
+# Generator yielding a TraceRecord for every instruction in the input stream.
+#   Register operands are decoded as well when the ISA dictionary is passed in
+#   (with at least the "Type" and "Format" keys), through a decode cache so that
+#   each static instruction is only decoded once. Pass in a DecodeCache to
+#   choose its size or look at its statistics afterwards.
+def read_trace(stream, all_instrs=None, decode_cache=None):
+    if decode_cache is None and all_instrs is not None:
+        decode_cache = DecodeCache(all_instrs)
+    for line in stream:
+        record = parse_trace_line(line, decode_cache=decode_cache)
+        if record is not None:
+            yield record
+
+# Open the instruction trace given to an analysis script. Reads from the binary
+#   trace cache built by trace_cache.py when a cache directory is given,
+#   otherwise streams the text trace from the input stream (stdin by default).
+def open_trace(cache=None, all_instrs=None, stream=None, decode_cache=None):
+    if cache:
+        from common.trace_cache import load_cache, cache_records
+        return cache_records(load_cache(cache))
+    return read_trace(sys.stdin if stream is None else stream, all_instrs, decode_cache)
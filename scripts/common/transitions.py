@@ -0,0 +1,115 @@
+# Vectorised opcode-to-opcode transition matrix using NumPy
+# The instruction stream is mapped to an array of integer ids, and every pair
+#   of consecutive instructions is encoded as lead*K + follow (K being the number
+#   of distinct ids). A single np.bincount over these codes then gives the full
+#   K x K transition matrix, where matrix[lead][follow] counts how often the
+#   follow instruction came right after the lead instruction.
+# The matrix, saved with its labels in a .npz file, is the interchange format
+#   read by display/heatmap.py
+
+from itertools import islice
+
+import numpy as np
+
+# Map a stream of tokens (e.g. instruction names) to an array of integer ids.
+#   Returns the id array and the list of labels, id -> token
+def intern_ids(tokens):
+    ids = {}
+    labels = []
+    id_list = []
+    for token in tokens:
+        token_id = ids.get(token)
+        if token_id is None:
+            token_id = ids[token] = len(labels)
+            labels.append(token)
+        id_list.append(token_id)
+    return np.array(id_list, dtype=np.int64), labels
+
+# Default number of tokens in each batch of intern_batches()
+BATCH_SIZE = 1 << 16
+
+# Generator yielding the ids of a stream of tokens one batch (an id array) at a
+#   time, so that memory doesn't grow with the length of the stream. New tokens
+#   are added to labels (id -> token) as they're seen, with the same ids as
+#   intern_ids().
+def intern_batches(tokens, labels, batch_size=BATCH_SIZE):
+    ids = {token : i for i, token in enumerate(labels)}
+    tokens = iter(tokens)
+    while True:
+        batch = []
+        for token in islice(tokens, batch_size):
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(labels)
+                labels.append(token)
+            batch.append(token_id)
+        if not batch:
+            return
+        yield np.array(batch, dtype=np.int64)
+
+# Count every transition between consecutive ids, size being the number of labels
+def transition_matrix(ids, size):
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) < 2:
+        return np.zeros((size, size), dtype=np.int64)
+    codes = ids[:-1] * size + ids[1:]
+    return np.bincount(codes, minlength=size*size).reshape(size, size)
+
+# Convert the matrix into the dictionary of "lead, follow" strings -> counter
+#   used by the rest of the scripts. When the id array is given, the pairs are
+#   ordered by their first occurrence in the stream (the same order as counting
+#   them one at a time into a dictionary), otherwise in row-major order.
+def matrix_to_pairs(matrix, labels, ids=None):
+    size = len(labels)
+    if ids is not None and len(ids) >= 2:
+        ids = np.asarray(ids, dtype=np.int64)
+        codes, first = np.unique(ids[:-1] * size + ids[1:], return_index=True)
+        codes = codes[np.argsort(first, kind='stable')]
+    else:
+        codes = np.flatnonzero(matrix)
+    leads, follows = np.divmod(codes, size)
+    counts = matrix[leads, follows]
+    return {labels[lead]+", "+labels[follow] : count for lead, follow, count
+        in zip(leads.tolist(), follows.tolist(), counts.tolist())}
+
+# Build the matrix back from a dictionary of "lead, follow" strings -> counter,
+#   labels in the order they're first seen
+def pairs_to_matrix(pairs_dict):
+    labels = []
+    ids = {}
+    for pair in pairs_dict:
+        for label in pair.split(", "):
+            if label not in ids:
+                ids[label] = len(labels)
+                labels.append(label)
+
+    matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    for pair, count in pairs_dict.items():
+        lead, follow = pair.split(", ")
+        matrix[ids[lead], ids[follow]] = count
+    return matrix, labels
+
+# Sum the matrices of several streams, each with its own labels, into a single
+#   matrix over the union of the labels (in first-seen order)
+def merge_matrices(results):
+    labels = []
+    ids = {}
+    for _, result_labels in results:
+        for label in result_labels:
+            if label not in ids:
+                ids[label] = len(labels)
+                labels.append(label)
+
+    merged = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    for matrix, result_labels in results:
+        index = np.array([ids[label] for label in result_labels], dtype=np.int64)
+        merged[np.ix_(index, index)] += matrix
+    return merged, labels
+
+def save_matrix(path, matrix, labels):
+    with open(path, 'wb') as dump:
+        np.savez(dump, counts=matrix, labels=np.array(labels, dtype=str))
+
+def load_matrix(path):
+    with np.load(path) as data:
+        return data["counts"], data["labels"].tolist()
@@ -19,15 +19,17 @@ import json
 import argparse
 
 # Input argument parsing
-parser = argparse.ArgumentParser()
-parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
-parser.add_argument("-p", "--profile", help="Display profile, choose from: \
-    insn_pairs, insn_patterns or leave empty for default title/axis names. Add your \
-    own options by setting up a profile in the column.py script")
-parser.add_argument("-i", "--img", help="Filepath/name for the output figure")
-args = parser.parse_args()
-
-def plot_bar(data_pairs):
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
+    parser.add_argument("-p", "--profile", help="Display profile, choose from: \
+        insn_pairs, insn_patterns or leave empty for default title/axis names. Add your \
+        own options by setting up a profile in the column.py script")
+    parser.add_argument("-i", "--img", help="Filepath/name for the output figure")
+    return parser.parse_args(argv)
+
+# Column graph of the (name, counter) pairs, saved to img
+def plot_bar(data_pairs, img, profile=None):
     pairs = [x[0] for x in data_pairs]
     counters = [x[1] for x in data_pairs]
     plt.figure(figsize=(10, 10))
@@ -37,11 +39,11 @@ def plot_bar(data_pairs):
     # plt.xticks(rotation=45)
 
     # Profiles
-    if args.profile == "insn_pairs":
+    if profile == "insn_pairs":
         plt.title("Most common instruction pairs")
         plt.xlabel("Instruction pairs")
         plt.ylabel("Frequency")
-    elif args.profile == "insn_patterns":
+    elif profile == "insn_patterns":
         plt.title("Most common instruction patterns")
         plt.xlabel("Instruction patterns")
         plt.ylabel("Frequency")
@@ -50,13 +52,14 @@ def plot_bar(data_pairs):
         plt.xlabel("Independent Variable")
         plt.ylabel("Magnitude")
 
-    plt.savefig(args.img)
+    plt.savefig(img)
 
 def main():
+    args = parse_args()
     with open(args.jsondump, 'r') as dump:
         data = json.load(dump)
 
-    plot_bar(data)
+    plot_bar(data, args.img, args.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
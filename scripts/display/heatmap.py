@@ -4,28 +4,41 @@
 #   we have a string of the comma separated pairs to be plotted on the axes of the 
 #   heatmap and at index 1, we have the counter associated with that pair.
 #   e.g. [["auipc, addi", 489], ["sw, lw", 79], ...]
+#   or a transition matrix (.npz) as produced by insn_pairs.py --matrix
 # Output : Heatmap figure saved in the filepath provided by the --img flag
 
 # Example to guide use:
 # Run the command : python3 scripts/display/heatmap.py \
-#                   -j=<input json file> \
+#                   -j=<input json file> or -m=<input matrix file> \
 #                   -p=<profile for plot axis names> \
 #                   -i=<output figure filename>
 #   while in the base directory
 
+import sys
+import os
 import numpy as np
 import matplotlib.pyplot as plt
 import json
 import argparse
 
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+if parent not in sys.path:
+    sys.path.append(parent)
+
+from common.transitions import load_matrix
+
 # Input argument parsing
-parser = argparse.ArgumentParser()
-parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
-parser.add_argument("-i", "--img", help="Filepath/name for output figure")
-parser.add_argument("-p", "--profile", help="Display profile, choose from: \
-    insn_pairs or leave empty for default title/axis names. Add your own options \
-    by setting up a profile in the heatmap.py script")
-args = parser.parse_args()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
+    parser.add_argument("-m", "--matrix", help="Filepath/name for input transition \
+        matrix (.npz), used instead of the JSON file")
+    parser.add_argument("-i", "--img", help="Filepath/name for output figure")
+    parser.add_argument("-p", "--profile", help="Display profile, choose from: \
+        insn_pairs or leave empty for default title/axis names. Add your own options \
+        by setting up a profile in the heatmap.py script")
+    return parser.parse_args(argv)
 
 # Function to parse the instruction pairs and their counters
 def parse_pairs_heatmap(pairs_counter_list, size):
@@ -64,8 +77,24 @@ def parse_pairs_heatmap(pairs_counter_list, size):
 
     return arr, leading_labels, following_labels
 
+# Function to pick the rows and columns of the transition matrix to show. The
+#   labels are ordered by their largest counter, which gives the same labels as
+#   going through the pairs from most to least common.
+def parse_matrix_heatmap(matrix, labels, size):
+    row_max = matrix.max(axis=1) if matrix.size else np.zeros(0, int)
+    col_max = matrix.max(axis=0) if matrix.size else np.zeros(0, int)
+    rows = np.argsort(-row_max, kind='stable')[:size]
+    rows = rows[row_max[rows] > 0]
+    cols = np.argsort(-col_max, kind='stable')[:size]
+    cols = cols[col_max[cols] > 0]
+
+    arr = np.zeros((size, size), int)
+    arr[:len(rows), :len(cols)] = matrix[np.ix_(rows, cols)]
+
+    return arr, [labels[i] for i in rows], [labels[i] for i in cols]
+
 # https://matplotlib.org/stable/gallery/images_contours_and_fields/image_annotated_heatmap.html
-def plot_heatmap(arr, y_labels, x_labels):
+def plot_heatmap(arr, y_labels, x_labels, img, profile=None):
     fig, ax = plt.subplots()
 
     fig.set_size_inches(10,10)
@@ -82,7 +111,7 @@ def plot_heatmap(arr, y_labels, x_labels):
             text = ax.text(j, i, arr[i, j],
                         ha="center", va="center", color="w")
 
-    if args.profile == "insn_pairs":
+    if profile == "insn_pairs":
         ax.set_title("Frequency of instruction pairs")
         plt.ylabel('Leading instructions')
         plt.xlabel('Following instructions')
@@ -91,14 +120,19 @@ def plot_heatmap(arr, y_labels, x_labels):
         plt.ylabel("First value of the pair")
         plt.xlabel("Second value of the pair")
 
-    plt.savefig(args.img)
+    plt.savefig(img)
 
 def main():
-    with open(args.jsondump, 'r') as dump:
-        data = json.load(dump)
-    
-    arr, x_labels, y_labels = parse_pairs_heatmap(data, 16)
-    plot_heatmap(arr, x_labels, y_labels)
+    args = parse_args()
+    if args.matrix:
+        matrix, labels = load_matrix(args.matrix)
+        arr, x_labels, y_labels = parse_matrix_heatmap(matrix, labels, 16)
+    else:
+        with open(args.jsondump, 'r') as dump:
+            data = json.load(dump)
+        arr, x_labels, y_labels = parse_pairs_heatmap(data, 16)
+
+    plot_heatmap(arr, x_labels, y_labels, args.img, args.profile)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
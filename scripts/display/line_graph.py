@@ -13,43 +13,101 @@
 #       -n=4 \
 #       < scripts/bandwidth/load_bw/example-load-bytes-avg.txt
 #   while in the base directory
+# Streams longer than the width of the figure in pixels are decimated before
+#   being plotted so that rendering takes the same time no matter how long the
+#   trace is, while keeping the peaks:
+#   - minmax (default) : The minimum and maximum of each pixel column
+#   - lttb : Largest-Triangle-Three-Buckets, one point per pixel column
+#   - none : Plot every value
 
 import sys
 import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 
 # Script arguments
-parser = argparse.ArgumentParser()
-parser.add_argument("-i", "--img", help="Save path for the pdf figure") # File path stored in args.img
-parser.add_argument("-f", "--ignore_first", help="Set to True to ignore the first line") # args.ignore_first
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--img", help="Save path for the pdf figure") # File path stored in args.img
+    parser.add_argument("-f", "--ignore_first", help="Set to True to ignore the first line") # args.ignore_first
 
-parser.add_argument("-p", "--profile", help="Display profile, choose from: \
-    mov_avg or leave empty for default title/axis names") # args.profile
-parser.add_argument("-n", "--window", help="Moving Average window size") # args.window
-args = parser.parse_args()
+    parser.add_argument("-p", "--profile", help="Display profile, choose from: \
+        mov_avg or leave empty for default title/axis names") # args.profile
+    parser.add_argument("-n", "--window", help="Moving Average window size") # args.window
+    parser.add_argument("-d", "--decimate", choices=["minmax", "lttb", "none"], default="minmax",
+        help="Decimation of long streams, defaults to minmax") # args.decimate
+    parser.add_argument("--points", type=int, help="Number of pixel columns the stream is \
+        reduced to, defaults to the width of the figure") # args.points
+    return parser.parse_args(argv)
 
-# Function to display the line graph
-def display_graph(avg_stream):
-    time_axis = list(range(len(avg_stream)))
+# Keep the minimum and maximum of each of the buckets, in the order they appear.
+#   Returns the indices of the points kept.
+def decimate_minmax(values, buckets):
+    size = -(-len(values) // buckets) # Values per bucket, rounded up
+    padded = np.full(buckets * size, np.nan)
+    padded[:len(values)] = values
+    padded = padded.reshape(buckets, size)
+    valid = ~np.all(np.isnan(padded), axis=1) # The last buckets may be empty
+    padded = padded[valid]
+    starts = np.flatnonzero(valid) * size
+    pairs = np.sort(np.stack([starts + np.nanargmin(padded, axis=1),
+        starts + np.nanargmax(padded, axis=1)], axis=1), axis=1)
+    return np.unique(pairs.ravel())
 
-    plt.plot(time_axis, avg_stream)
+# Largest-Triangle-Three-Buckets: keep the first and last points, and from each
+#   bucket in between the point forming the largest triangle with the point kept
+#   in the previous bucket and the average of the next bucket.
+#   Returns the indices of the points kept.
+def decimate_lttb(values, points):
+    n = len(values)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    kept = [0]
+    for b in range(points - 2):
+        start, end = edges[b], edges[b + 1]
+        next_end = edges[b + 2] if b + 2 < len(edges) else n
+        next_x = (end + next_end - 1) / 2
+        next_y = values[end:next_end].mean() if next_end > end else values[-1]
+        x = np.arange(start, end)
+        prev = kept[-1]
+        areas = np.abs((prev - next_x) * (values[start:end] - values[prev])
+            - (prev - x) * (next_y - values[prev]))
+        kept.append(start + int(np.argmax(areas)))
+    kept.append(n - 1)
+    return np.array(kept)
+
+# Function to display the line graph, saved to img
+def display_graph(avg_stream, img, profile=None, window=None, decimate="minmax",
+        points=None):
+    time_axis = np.arange(len(avg_stream))
+
+    figure = plt.gcf()
+    points = points or int(figure.get_figwidth() * figure.dpi)
+    if decimate == "minmax" and len(avg_stream) > 2 * points:
+        time_axis = decimate_minmax(avg_stream, points)
+    elif decimate == "lttb" and len(avg_stream) > points > 2:
+        time_axis = decimate_lttb(avg_stream, points)
+
+    plt.plot(time_axis, avg_stream[time_axis])
 
     # Determine axis names based on the input profile
     # Add future profiles here
-    if args.profile == "mov_avg":
+    if profile == "mov_avg":
         # Note that this requires a value for the --window argument
-        plt.title("Moving Average output for n="+args.window)
+        plt.title("Moving Average output for n="+str(window))
         plt.ylabel("Bytes transferred")
     else:
         plt.title("Line graph")
         plt.ylabel("Magnitude")
 
     plt.xlabel('Line Number')
-    plt.savefig(args.img)
+    plt.savefig(img)
 
 def main():
-    input = sys.stdin.readlines()[1:] if args.ignore_first else sys.stdin.readlines()
-    display_graph(input)
+    args = parse_args()
+    if args.ignore_first:
+        sys.stdin.readline()
+    display_graph(np.array([float(line) for line in sys.stdin if line.strip()]), args.img,
+        args.profile, args.window, args.decimate, args.points)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,11 +2,17 @@
 # Identify the most common instruction pairs
 
 # Input : Trimmed down instruction trace
-# Output :  -  JSON file giving the list of tuples where each instruction
+# Output :  -  Transition matrix (.npz) holding the counter of every pair of
+#   instructions along with the instruction names, read by display/heatmap.py
+#   (Optional)
+#           -  JSON file giving the list of tuples where each instruction
 #   pair is stored with a counter giving how often that pair has
 #   occured. To then be passed into display files. (Optional)
 #           -  Formatted list giving the instruction pairs and a counter 
 #   detailing how often they've appeared.
+#           -  With the disassembly (--dasm), the filtered pairs of every function
+#   as well, in a JSON file per function (e.g. pairs-main.JSON). A pair is only
+#   attributed to a function when both of its instructions are in it.
 
 # Example to guide use:
 # Run the command : python3 scripts/insn_patterns/insn_pairs.py \
@@ -19,54 +25,190 @@ import json
 import os
 import argparse
 
+import numpy as np
+
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.pattern_detection import local_maxima, print_pairs
+from common.trace_reader import open_trace
+from common.transitions import intern_batches, transition_matrix, \
+    matrix_to_pairs, pairs_to_matrix, merge_matrices, save_matrix, BATCH_SIZE
+from common.chunking import analyse_chunks
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
+from common.symbols import symbol_index, record_pcs, split_functions, function_path
 
 # Input argument parsing
-parser = argparse.ArgumentParser()
-parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
-parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
-    for the formatted unfiltered output patterns (prior to identifying the local \
-    maxima). Two files are produced from this : a readable .txt file and a .JSON file")
-args = parser.parse_args()
-
-#   Iterate through the instruction stream and calculate the most frequent instruction pairs
-def track_pairs(instr_trace):
-    pairs_dict = {}
-    previous_instr = instr_trace[0].split()[4] # Set the first instruction first 
-
-    for line in instr_trace[1:]:
-        insn_name = line.split()[4]
-
-        key_string = f'{previous_instr}, {insn_name}'
-
-        if (key_string in pairs_dict):
-            pairs_dict[key_string] += 1
-        else:
-            pairs_dict[key_string] = 1
-        
-        previous_instr = insn_name
-    
-    # Returns a list of tuples where each instruction is associated with their counter
-    return pairs_dict
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
+    parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
+        for the formatted unfiltered output patterns (prior to identifying the local \
+        maxima). Two files are produced from this : a readable .txt file and a .JSON file")
+    parser.add_argument("-m", "--matrix", help="Filepath/name for the output \
+        transition matrix (.npz) of every instruction pair")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("-d", "--dasm", help="Disassembly of the executable \
+        (testcase.dasm), adds the most common pairs within each function")
+    args = parser.parse_args(argv)
+    if args.dasm and (args.per_hart or args.trace):
+        parser.error("--dasm can only be used on stdin or a trace cache")
+    return args
 
-def main():
+#   Count the instruction pairs from the array of instruction ids in one go with
+#       the transition matrix. Returns the dictionary of pairs and their counters
+#       along with the matrix and its labels.
+def count_pairs(ids, labels):
+    matrix = transition_matrix(ids, len(labels))
+    return matrix_to_pairs(matrix, labels, ids), matrix, labels
+
+#   Add the pair codes (lead * size + follow) of a batch to pair_counts
+#       ((lead, follow) -> counter), in the order they first appear
+def add_codes(pair_counts, codes, size):
+    unique, first, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    leads, follows = np.divmod(unique[order], size)
+    for pair in zip(leads.tolist(), follows.tolist(), counts[order].tolist()):
+        pair_counts[pair[:2]] = pair_counts.get(pair[:2], 0) + pair[2]
+
+#   Add the pairs of a batch of ids to pair_counts (see add_codes()), size being
+#       the number of labels. last is the last id of the previous batch (empty
+#       for the first one), for the pair crossing between them. Returns the last
+#       id of this batch.
+def add_pairs(pair_counts, ids, last, size):
+    ids = np.concatenate((last, ids))
+    if len(ids) < 2:
+        return ids
+    add_codes(pair_counts, ids[:-1] * size + ids[1:], size)
+    return ids[-1:]
+
+#   Dictionary of pairs, matrix and labels from the counters of add_pairs()
+def pairs_result(pair_counts, labels):
+    matrix = np.zeros((len(labels), len(labels)), dtype=np.int64)
+    for (lead, follow), count in pair_counts.items():
+        matrix[lead, follow] = count
+    return {labels[lead]+", "+labels[follow] : count
+        for (lead, follow), count in pair_counts.items()}, matrix, labels
+
+#   Iterate through the instruction stream and calculate the most frequent instruction pairs.
+#       The stream is counted one batch of ids at a time, carrying the last id of
+#       each batch over to the next for the pair crossing between them, so memory
+#       only depends on the number of distinct pairs. The pairs are kept in the
+#       order they first appear, the same as count_pairs().
+def track_pairs(instr_trace, batch_size=BATCH_SIZE):
+    labels = []
+    pair_counts = {}
+    last = np.zeros(0, dtype=np.int64)
+    for ids in intern_batches((record.insn for record in instr_trace), labels, batch_size):
+        last = add_pairs(pair_counts, ids, last, len(labels))
+    return pairs_result(pair_counts, labels)
+
+#   Only the dictionary of pairs, to be merged between the chunks of a trace file
+def count_pairs_dict(instr_trace):
+    return track_pairs(instr_trace)[0]
+
+#   Same as track_pairs() but using the opcode id column of a trace cache directly
+def track_cached_pairs(cache_dir):
+    from common.trace_cache import load_cache
+    cache = load_cache(cache_dir)
+    return count_pairs(cache["opcode"], cache["tables"]["opcodes"])
+
+#   Add the pairs of a batch within each function to function_pairs (function
+#       -> pair counters of add_codes()), functions being the index of the
+#       function of every id (see SymbolIndex). last holds the last id and
+#       function of the previous batch. Pairs crossing a call or a return are
+#       only part of the overall count. Returns the last id and function of this
+#       batch.
+def add_function_pairs(function_pairs, ids, functions, last, size):
+    ids = np.concatenate((last[0], ids))
+    functions = np.concatenate((last[1], functions))
+    same = functions[:-1] == functions[1:]
+    codes = ids[:-1][same] * size + ids[1:][same]
+    for function, function_codes in split_functions(codes, functions[:-1][same]).items():
+        add_codes(function_pairs.setdefault(function, {}), function_codes, size)
+    return ids[-1:], functions[-1:]
+
+#   Dictionary of function name -> pairs dictionary from the counters of
+#       add_function_pairs(), functions in address order and pairs in the order
+#       they first appear
+def function_pairs_result(function_pairs, labels, index):
+    return {index.name(function) : {labels[lead]+", "+labels[follow] : count
+        for (lead, follow), count in function_pairs[function].items()}
+        for function in sorted(function_pairs)}
+
+#   Same as track_pairs(), also counting the pairs within each function. The
+#       functions are looked up one batch of PCs at a time.
+def track_function_pairs(instr_trace, index, batch_size=BATCH_SIZE):
+    pcs = []
+    def insns():
+        for record in instr_trace:
+            pcs.append(record.pc)
+            yield record.insn
+    labels = []
+    pair_counts = {}
+    function_pairs = {}
+    last = np.zeros(0, dtype=np.int64)
+    last_function = (last, last)
+    # The PCs gathered by the time a batch is yielded are the ones of that batch
+    for ids in intern_batches(insns(), labels, batch_size):
+        functions = index.lookup(record_pcs(pcs))
+        pcs.clear()
+        last = add_pairs(pair_counts, ids, last, len(labels))
+        last_function = add_function_pairs(function_pairs, ids, functions,
+            last_function, len(labels))
+    return pairs_result(pair_counts, labels), \
+        function_pairs_result(function_pairs, labels, index)
+
+#   Same as track_function_pairs() but using the opcode and pc columns of a
+#       trace cache
+def track_cached_function_pairs(cache_dir, index, batch_size=BATCH_SIZE):
+    from common.trace_cache import load_cache
+    cache = load_cache(cache_dir)
+    labels = cache["tables"]["opcodes"]
+    pair_counts = {}
+    function_pairs = {}
+    last = np.zeros(0, dtype=np.int64)
+    last_function = (last, last)
+    for start in range(0, cache["meta"]["length"], batch_size):
+        ids = cache["opcode"][start:start + batch_size].astype(np.int64)
+        functions = index.lookup(cache["pc"][start:start + batch_size])
+        last = add_pairs(pair_counts, ids, last, len(labels))
+        last_function = add_function_pairs(function_pairs, ids, functions,
+            last_function, len(labels))
+    return pairs_result(pair_counts, labels), \
+        function_pairs_result(function_pairs, labels, index)
+
+# Filter the pairs dictionary and write the results : the transition matrix
+#   (matrix_path), the unfiltered pairs (rawdump), the filtered pairs (jsondump)
+#   and their formatted version to out, followed by those of every hart and
+#   function when given
+def write_pairs(raw_result, matrix, labels, out=sys.stdout, jsondump=None,
+        rawdump=None, matrix_path=None, hart_results=None, function_results=None):
     minimum_count = 0
     diff_threshold = 3
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
 
-    raw_result = track_pairs(instr_trace)
+    if matrix_path:
+        save_matrix(matrix_path, matrix, labels)
+
     # Optional raw information prior to the local maxima calculations can
     #   be saved and stored in their own files
-    if args.rawdump:
+    if rawdump:
         sorted_raw = sorted(raw_result.items(), key=lambda x: x[1], reverse=True)
-        with open(args.rawdump+".JSON", 'w') as dump:
+        with open(rawdump+".JSON", 'w') as dump:
             dump.write(json.dumps(sorted_raw))
-        with open(args.rawdump+".txt", 'w') as dump:
+        with open(rawdump+".txt", 'w') as dump:
             dump.write("Raw most common instruction pairs")
             dump.write(json.dumps(print_pairs(sorted_raw, dump)))
 
@@ -74,14 +216,64 @@ def main():
     
     # Dump the list of most common patterns in a .json file to access
     #   it easily in the display scripts
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
+    if jsondump:
+        with open(jsondump, 'w') as dump:
             dump.write(json.dumps(result))
 
-    print("Filtered most common instruction pairs")
-    # Print the formatted version to stdout for user readability
-    print_pairs(result)
+    print("Filtered most common instruction pairs", file=out)
+    # Print the formatted version for user readability
+    print_pairs(result, out)
+
+    if hart_results is not None:
+        for hart, (hart_raw, hart_matrix, hart_labels) in hart_results.items():
+            if matrix_path:
+                save_matrix(hart_path(matrix_path, hart), hart_matrix, hart_labels)
+            hart_result = local_maxima(hart_raw, minimum_count, diff_threshold, False)
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps(hart_result))
+            print("Filtered most common instruction pairs for hart "+str(hart), file=out)
+            print_pairs(hart_result, out)
+
+    if function_results is not None:
+        for name, function_raw in function_results.items():
+            function_result = local_maxima(function_raw, minimum_count, diff_threshold, False)
+            if jsondump:
+                with open(function_path(jsondump, name), 'w') as dump:
+                    dump.write(json.dumps(function_result))
+            print("Filtered most common instruction pairs for function "+name, file=out)
+            print_pairs(function_result, out)
+
+def main():
+    args = parse_args()
+    hart_results = None
+    function_results = None
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        hart_results = analyse_trace_per_hart(track_pairs, sys.stdin, args.cache,
+            processes=args.processes)
+        raw_result = merge_counts(r[0] for r in hart_results.values())
+        matrix, labels = merge_matrices([r[1:] for r in hart_results.values()])
+    elif args.cache and args.dasm:
+        (raw_result, matrix, labels), function_results = track_cached_function_pairs(
+            args.cache, symbol_index(args.dasm))
+    elif args.cache:
+        raw_result, matrix, labels = track_cached_pairs(args.cache)
+    elif args.trace:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instruction before it to count the pair crossing the seam
+        raw_result = analyse_chunks(count_pairs_dict, args.trace, args.workers, overlap=1)
+        matrix, labels = pairs_to_matrix(raw_result)
+    elif args.dasm:
+        (raw_result, matrix, labels), function_results = track_function_pairs(
+            open_trace(), symbol_index(args.dasm))
+    else:
+        # Stream the instruction trace from stdin
+        raw_result, matrix, labels = track_pairs(open_trace())
 
+    write_pairs(raw_result, matrix, labels, jsondump=args.jsondump,
+        rawdump=args.rawdump, matrix_path=args.matrix, hart_results=hart_results,
+        function_results=function_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,6 +7,10 @@
 #   occured. To then be passed into display files. (Optional)
 #           -  Formatted list giving the instruction patterns and a counter 
 #   detailing how often they've appeared.
+#           -  With the disassembly (--dasm), the filtered patterns of every
+#   function as well, in a JSON file per function (e.g. patterns-main.JSON). A
+#   pattern is only attributed to a function when all of its instructions are in
+#   it.
 
 # Example to guide use:
 # Run the command : python3 scripts/insn_patterns/insn_patterns.py \
@@ -19,61 +23,205 @@ import time
 import json
 import os
 import argparse
+from functools import partial
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 # Function to calculate the local maxima among groups of values
 from common.pattern_detection import local_maxima, print_pairs
-from common.helper_functions import append_to_counter_dict
+from common.ngram import NgramCounter
+from common.sketches import report_error_bounds
+from common.trace_reader import open_trace
+from common.chunking import analyse_chunks, join_sizes
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
+
+# Smallest and largest (excluded) pattern sizes counted
+MIN_PATTERN_SIZE = 3
+MAX_PATTERN_SIZE = 8
+# Number of instructions whose functions are looked up at a time with --dasm,
+#   the same as transitions.py (not imported here to keep NumPy out of start-up)
+BATCH_SIZE = 1 << 16
 
 # Input argument parsing
-parser = argparse.ArgumentParser()
-parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
-parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
-    for the formatted unfiltered output patterns (prior to identifying the local \
-    maxima). Two files are produced from this : a readable .txt file and a .JSON file")
-args = parser.parse_args()
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
+    parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
+        for the formatted unfiltered output patterns (prior to identifying the local \
+        maxima). Two files are produced from this : a readable .txt file and a .JSON file")
+    parser.add_argument("-b", "--budget", type=int, help="Maximum number of pattern \
+        counters held in memory. Switches to approximate top-k counting with \
+        Space-Saving sketches, the error bounds are reported on stderr")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("-d", "--dasm", help="Disassembly of the executable \
+        (testcase.dasm), adds the most common patterns within each function")
+    parser.add_argument("--blocks", action="store_true", help="Count the patterns \
+        on the basic blocks of the trace, once per block rather than once per \
+        execution. Same results, much faster on loops")
+    args = parser.parse_args(argv)
+    if args.dasm and (args.per_hart or args.trace):
+        parser.error("--dasm can only be used on stdin or a trace cache")
+    if args.blocks and (args.budget or args.trace or args.dasm):
+        parser.error("--blocks can't be used along with --budget, --trace or --dasm")
+    return args
 
 #   Iterate through the instruction stream and calculate the most frequent
-#       instruction patterns of size n
-def track_patterns(instr_trace, n):
-    patterns_dict = {}
+#       instruction patterns for every size n in window_sizes. The trace is only
+#       read once, the instructions are interned into integer ids and every
+#       pattern size is counted on packed integer keys by the n-gram engine.
+#       Counts are approximate when given a memory budget.
+def track_patterns(instr_trace, window_sizes, budget=None):
+    counter = NgramCounter(window_sizes, budget=budget)
+    for record in instr_trace:
+        counter.push(record.insn)
+    if budget is not None:
+        report_error_bounds(counter.counts, "instruction patterns")
 
-    # Initialise window
-    window = [x.split()[4] for x in instr_trace[:n]]
-    patterns_dict[', '.join(window)] = 1
+    # Returns a dictionary where each instruction pattern is associated with 
+    #   their counter, the patterns only being joined into strings here
+    return counter.render()
 
-    # Iterate through the rest of the instructions
-    for line in instr_trace[n:]:
-        insn_name = line.split()[4]
+#   Count the patterns of every size exactly, returning a tuple of dictionaries
+#       (one per size) that can be merged between the chunks of a trace file
+def count_patterns(instr_trace, window_sizes):
+    counter = NgramCounter(window_sizes)
+    for record in instr_trace:
+        counter.push(record.insn)
+    return counter.render_sizes()
 
-        # Push new instruction into the window and pop the element at the 0th index
-        window.append(insn_name)
-        window = window[1:]
+#   Same as track_patterns() but reading the interned opcode ids straight from
+#       the opcode column of a trace cache
+def track_cached_patterns(cache_dir, window_sizes, budget=None):
+    from common.trace_cache import load_cache, column_values
+    cache = load_cache(cache_dir)
+    counter = NgramCounter(window_sizes, budget=budget)
+    counter.use_table(cache["tables"]["opcodes"])
+    for opcode in column_values(cache, "opcode"):
+        counter.push_id(opcode)
+    if budget is not None:
+        report_error_bounds(counter.counts, "instruction patterns")
+    return counter.render()
 
-        # Concatenate the elements of the window list to form a string which
-        #   then acts as a key for the dictionary. Done so that the format matches
-        #   that of the pair detection algorithm and because dictionaries can only
-        #   take immutable types as keys
-        append_to_counter_dict(patterns_dict, ', '.join(window))
+#   Same as track_patterns() but counting the patterns on the basic blocks of
+#       the trace (see basic_blocks.py) one chunk at a time, only exact counts
+def track_block_patterns(instr_trace, window_sizes):
+    from common.basic_blocks import ChunkedBlockNgrams, block_chunks
+    counter = NgramCounter(window_sizes)
+    block_counts = ChunkedBlockNgrams(window_sizes)
+    ids = []
+    def push(record):
+        ids.append(counter.token_id(record.insn))
+    for blocks in block_chunks(instr_trace, push):
+        block_counts.push(ids, blocks)
+        ids.clear()
+    counter.counts = block_counts.result()
+    return counter.render()
 
-    # Returns a dictionary where each instruction pattern is associated with 
-    #   their counter
-    return patterns_dict
+#   Same as track_block_patterns() but using the opcode, pc and encoding columns
+#       of a trace cache
+def track_cached_block_patterns(cache_dir, window_sizes):
+    from common.trace_cache import load_cache
+    from common.basic_blocks import block_counter
+    cache = load_cache(cache_dir)
+    return block_counter(cache["opcode"], cache["tables"]["opcodes"], cache["pc"],
+        cache["encoding"], window_sizes).render()
 
-# Main function with timing in case I want to come back and optimise again
-def timed_main():    
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
-    all_patterns_dict = {}
+#   Count the patterns within each function, from a batch of interned ids of
+#       the instructions and the index of the function of each one (see
+#       SymbolIndex). Each function has its own counter in counters, reset
+#       whenever the trace enters the function so that patterns crossing a call
+#       or a return are only part of the overall count. previous is the function
+#       of the last instruction of the previous batch, whose counter carries on
+#       with the n-1 instructions before this batch. Returns the function of the
+#       last instruction of this batch.
+def add_function_patterns(counters, ids, functions, window_sizes, previous=None,
+        budget=None):
+    if previous is not None:
+        push_id = counters[previous].push_id
+    for token_id, function in zip(ids, functions.tolist()):
+        if function != previous:
+            counter = counters.get(function)
+            if counter is None:
+                counter = counters[function] = NgramCounter(window_sizes, budget=budget)
+            counter.reset()
+            push_id = counter.push_id
+            previous = function
+        push_id(token_id)
+    return previous
+
+#   Dictionary of function name -> patterns dictionary from the counters of
+#       add_function_patterns(), functions in address order
+def function_patterns_result(counters, tokens, index):
+    function_patterns = {}
+    for function in sorted(counters):
+        counters[function].use_table(tokens)
+        function_patterns[index.name(function)] = counters[function].render()
+    return function_patterns
 
+#   Same as track_patterns(), also counting the patterns within each function.
+#       The functions are looked up one batch of PCs at a time.
+def track_function_patterns(instr_trace, window_sizes, index, budget=None,
+        batch_size=BATCH_SIZE):
+    from common.symbols import record_pcs
+    counter = NgramCounter(window_sizes, budget=budget)
+    counters = {}
+    previous = None
+    ids = []
+    pcs = []
+    for record in instr_trace:
+        token_id = counter.token_id(record.insn)
+        counter.push_id(token_id)
+        ids.append(token_id)
+        pcs.append(record.pc)
+        if len(ids) == batch_size:
+            previous = add_function_patterns(counters, ids, index.lookup(record_pcs(pcs)),
+                window_sizes, previous, budget)
+            ids.clear()
+            pcs.clear()
+    add_function_patterns(counters, ids, index.lookup(record_pcs(pcs)), window_sizes,
+        previous, budget)
+    if budget is not None:
+        report_error_bounds(counter.counts, "instruction patterns")
+    return counter.render(), function_patterns_result(counters, counter.tokens, index)
+
+#   Same as track_function_patterns() but using the opcode and pc columns of a
+#       trace cache
+def track_cached_function_patterns(cache_dir, window_sizes, index, budget=None,
+        batch_size=BATCH_SIZE):
+    from common.trace_cache import load_cache
+    cache = load_cache(cache_dir)
+    counters = {}
+    previous = None
+    for start in range(0, cache["meta"]["length"], batch_size):
+        previous = add_function_patterns(counters,
+            cache["opcode"][start:start + batch_size].tolist(),
+            index.lookup(cache["pc"][start:start + batch_size]), window_sizes,
+            previous, budget)
+    return track_cached_patterns(cache_dir, window_sizes, budget), \
+        function_patterns_result(counters, cache["tables"]["opcodes"], index)
+
+# Main function with timing in case I want to come back and optimise again
+def timed_main(args):
     start_time = time.time()
-    for i in range(3, 8):
-        all_patterns_dict.update(track_patterns(instr_trace, i))
+    if args.cache:
+        all_patterns_dict = track_cached_patterns(args.cache, range(3, 8))
+    else:
+        all_patterns_dict = track_patterns(open_trace(), range(3, 8))
     end_time = time.time()
     print("Time taken = "+str(end_time-start_time))
 
@@ -87,42 +235,101 @@ def timed_main():
     end_time = time.time()
     print("Time taken to print = "+str(end_time-start_time))
 
-# Default main
-def main():
+# Filter the patterns dictionary and write the results : the unfiltered
+#   patterns (rawdump), the filtered patterns (jsondump) and their formatted
+#   version to out, followed by those of every hart and function when given
+def write_patterns(all_patterns_dict, out=sys.stdout, jsondump=None, rawdump=None,
+        hart_results=None, function_results=None):
     minimum_count = 0
     diff_threshold = 5
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
-    all_patterns_dict = {}
-
-    min_pattern_size = 3
-    max_pattern_size = 8
-    for i in range(min_pattern_size, max_pattern_size):
-        all_patterns_dict.update(track_patterns(instr_trace, i))
 
     # Optional raw information prior to the local maxima calculations can
     #   be saved and stored in their own files
-    if args.rawdump:
+    if rawdump:
         raw_result = sorted(all_patterns_dict.items(), key=lambda x: x[1], reverse=True)
-        with open(args.rawdump+".JSON", 'w') as dump:
+        with open(rawdump+".JSON", 'w') as dump:
             dump.write(json.dumps(raw_result))
-        with open(args.rawdump+".txt", 'w') as dump:
+        with open(rawdump+".txt", 'w') as dump:
             dump.write("Raw most common instruction patterns for sizes \
-                between "+str(min_pattern_size)+" and "+str(max_pattern_size))
+                between "+str(MIN_PATTERN_SIZE)+" and "+str(MAX_PATTERN_SIZE))
             dump.write(json.dumps(print_pairs(raw_result, dump)))
 
     result = local_maxima(all_patterns_dict, minimum_count, diff_threshold, False)
 
     # Dump the list of most common patterns in a .json file to access
     #   it easily in the display scripts
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
+    if jsondump:
+        with open(jsondump, 'w') as dump:
             dump.write(json.dumps(result))
 
-    # Print the formatted version to stdout for user readability
+    # Print the formatted version for user readability
     print("Filtered most common instruction patterns for sizes between \
-        "+str(min_pattern_size)+" and "+str(max_pattern_size))
-    print_pairs(result)
+        "+str(MIN_PATTERN_SIZE)+" and "+str(MAX_PATTERN_SIZE), file=out)
+    print_pairs(result, out)
+
+    if hart_results is not None:
+        for hart, hart_patterns in hart_results.items():
+            hart_result = local_maxima(hart_patterns, minimum_count, diff_threshold, False)
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps(hart_result))
+            print("Filtered most common instruction patterns for hart "+str(hart),
+                file=out)
+            print_pairs(hart_result, out)
+
+    if function_results is not None:
+        from common.symbols import function_path
+        for name, function_patterns in function_results.items():
+            function_result = local_maxima(function_patterns, minimum_count,
+                diff_threshold, False)
+            if jsondump:
+                with open(function_path(jsondump, name), 'w') as dump:
+                    dump.write(json.dumps(function_result))
+            print("Filtered most common instruction patterns for function "+name,
+                file=out)
+            print_pairs(function_result, out)
+
+# Default main
+def main():
+    args = parse_args()
+    window_sizes = range(MIN_PATTERN_SIZE, MAX_PATTERN_SIZE)
+    hart_results = None
+    function_results = None
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        if args.blocks:
+            track = partial(track_block_patterns, window_sizes=window_sizes)
+        else:
+            track = partial(track_patterns, window_sizes=window_sizes, budget=args.budget)
+        hart_results = analyse_trace_per_hart(track, sys.stdin, args.cache,
+            processes=args.processes)
+        all_patterns_dict = merge_counts(hart_results.values())
+    elif args.cache and args.dasm:
+        from common.symbols import symbol_index
+        all_patterns_dict, function_results = track_cached_function_patterns(
+            args.cache, window_sizes, symbol_index(args.dasm), args.budget)
+    elif args.cache and args.blocks:
+        all_patterns_dict = track_cached_block_patterns(args.cache, window_sizes)
+    elif args.cache:
+        all_patterns_dict = track_cached_patterns(args.cache, window_sizes, args.budget)
+    elif args.trace:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instructions before it to count the patterns crossing the seam
+        all_patterns_dict = join_sizes(analyse_chunks(
+            partial(count_patterns, window_sizes=window_sizes), args.trace,
+            args.workers, overlap=MAX_PATTERN_SIZE-2))
+    elif args.dasm:
+        from common.symbols import symbol_index
+        all_patterns_dict, function_results = track_function_patterns(open_trace(),
+            window_sizes, symbol_index(args.dasm), args.budget)
+    elif args.blocks:
+        all_patterns_dict = track_block_patterns(open_trace(), window_sizes)
+    else:
+        # Stream the instruction trace from stdin
+        all_patterns_dict = track_patterns(open_trace(), window_sizes, args.budget)
+
+    write_patterns(all_patterns_dict, jsondump=args.jsondump, rawdump=args.rawdump,
+        hart_results=hart_results, function_results=function_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,6 +4,8 @@
 # Input : Trimmed down instruction trace
 # Output : - JSON file containing the dictionaries storing counters regarding
 #   how often each register is used as what. Used to make the display graphs.
+#   With the disassembly (--dasm), a JSON file for every function as well
+#   (e.g. regs-main.JSON) counting the accesses of its instructions.
 
 # Example to guide use:
 # Run the command : python3 scripts/reg_accesses/reg_accesses.py \
@@ -12,70 +14,229 @@
 
 import sys
 import argparse
-import logging
 import json
 import os
+from functools import partial
 
-# Print debugging information
-# logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
-# Dont print debugging information
-logging.basicConfig(stream=sys.stderr, level=logging.INFO)
-# Example debug printing line
-# logging.debug("Test debugging")
+import numpy as np
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.isa_management import check_isa
-from common.reg_functions import parse_instruction
+from common.trace_reader import open_trace
+from common.transitions import intern_batches, BATCH_SIZE
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.harts import analyse_trace_per_hart, hart_path
+from common.symbols import symbol_index, record_pcs, split_functions, function_path
 
 # Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("--isa", help="RISC-V ISA string")
-parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
-args = parser.parse_args() # ISA argument stored in args.isa
-
-# Iterate through the instruction trace and measure the frequency at which
-#   registers are accessed
-def track_regs(instr_trace, all_instrs, all_regs):
-    counter = 0
-    # Parse lines on stdin
-    for line in instr_trace:
-        counter += 1
-        line_list = line.split()
-        insn_name = line_list[4]
-
-        # Check for instruction in overall dictionary
-        if insn_name in all_instrs:
-            logging.debug("")
-            logging.debug(str(counter) + ": " + str(line_list[4:]))
-
-            # Check what the register operand format is and assign variables accordingly
-            rs1, rs2, rd = parse_instruction(line_list[4:], all_instrs)
-            if rs1:
-                logging.debug("rs1: "+str(rs1))
-                all_regs[rs1]["rs"] += 1
-            if rs2:
-                logging.debug("rs2: "+str(rs2))
-                all_regs[rs2]["rs"] += 1
-            if rd:
-                logging.debug("rd: "+str(rd))
-                all_regs[rd]["rd"] += 1
-    
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
-            dump.write(json.dumps(all_regs))
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("--decode_cache_size", type=int, help="Maximum number of static \
+        instructions held in the decode cache, defaults to 65536")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the hit/miss \
+        statistics of the decode cache to stderr")
+    parser.add_argument("-d", "--dasm", help="Disassembly of the executable \
+        (testcase.dasm), adds the register accesses of each function")
+    args = parser.parse_args(argv)
+    if args.dasm and args.per_hart:
+        parser.error("--dasm can only be used on stdin or a trace cache")
+    return args
+
+# Names of the decoded registers that the .reg files know under another name
+REG_ALIASES = {"zero" : "x0"}
+
+# Add the rs and rd histograms to a copy of all_regs, so the same register
+#   dictionary can be used for every hart. names gives the register name of each
+#   bin, mapped onto the names of the .reg files (e.g. zero is counted as x0).
+#   Registers missing from the .reg files are added at the end.
+def fill_regs(all_regs, names, rs_counts, rd_counts):
+    all_regs = {reg : dict(counters) for reg, counters in all_regs.items()}
+    for name, rs, rd in zip(names, rs_counts.tolist(), rd_counts.tolist()):
+        if name not in all_regs:
+            name = REG_ALIASES.get(name, name)
+        if rs or rd:
+            counters = all_regs.setdefault(name, {"rs" : 0, "rd" : 0})
+            counters["rs"] += rs
+            counters["rd"] += rd
+    return all_regs
+
+# Add up the counters of each (rs1, rs2, rd) combination per register
+def combination_regs(combinations, counts, all_regs):
+    names = list(all_regs)
+    index = {name : i for i, name in enumerate(names)}
+    rs_counts = [0] * len(names)
+    rd_counts = [0] * len(names)
+    # Unknown instructions don't have any registers associated with them
+    for (rs1, rs2, rd), count in zip(combinations, counts):
+        for reg, reg_counts in ((rs1, rs_counts), (rs2, rs_counts), (rd, rd_counts)):
+            if reg:
+                if reg not in index:
+                    index[reg] = len(names)
+                    names.append(reg)
+                    rs_counts.append(0)
+                    rd_counts.append(0)
+                reg_counts[index[reg]] += count
+
+    return fill_regs(all_regs, names, np.array(rs_counts), np.array(rd_counts))
+
+# Add the histogram of the ids to the counters, which may have fewer bins as
+#   new combinations are found
+def add_counts(counts, ids, size):
+    total = np.bincount(ids, minlength=size)
+    total[:len(counts)] += counts
+    return total
+
+# Measure the frequency at which registers are accessed. The records are
+#   expected to have their register operands already decoded when read in.
+#   Each record is reduced to the id of its (rs1, rs2, rd) combination, which
+#   are counted with np.bincount one batch at a time (so memory doesn't grow
+#   with the trace) and then added up per register.
+def track_regs(instr_trace, all_regs, batch_size=BATCH_SIZE):
+    combinations = []
+    counts = np.zeros(0, dtype=np.int64)
+    for ids in intern_batches(((record.rs1, record.rs2, record.rd)
+            for record in instr_trace), combinations, batch_size):
+        counts = add_counts(counts, ids, len(combinations))
+    return combination_regs(combinations, counts.tolist(), all_regs)
+
+# Same as track_regs(), also measuring the accesses of each function's
+#   instructions. Returns the overall result along with a dictionary of function
+#   name -> result, functions in address order.
+def track_function_regs(instr_trace, all_regs, index, batch_size=BATCH_SIZE):
+    pcs = []
+    def combinations():
+        for record in instr_trace:
+            pcs.append(record.pc)
+            yield (record.rs1, record.rs2, record.rd)
+    combination_list = []
+    empty = np.zeros(0, dtype=np.int64)
+    all_counts = empty
+    function_counts = {}
+    # The PCs gathered by the time a batch is yielded are the ones of that batch
+    for ids in intern_batches(combinations(), combination_list, batch_size):
+        functions = index.lookup(record_pcs(pcs))
+        pcs.clear()
+        size = len(combination_list)
+        all_counts = add_counts(all_counts, ids, size)
+        for function, function_ids in split_functions(ids, functions).items():
+            function_counts[function] = add_counts(function_counts.get(function, empty),
+                function_ids, size)
+
+    size = len(combination_list)
+    function_regs = {index.name(function) : combination_regs(combination_list,
+        add_counts(function_counts[function], empty, size).tolist(), all_regs)
+        for function in sorted(function_counts)}
+    return combination_regs(combination_list, all_counts.tolist(), all_regs), function_regs
+
+# Same as track_regs() but straight from the register columns of a trace cache,
+#   which already hold the register numbers (-1 where unused)
+def track_cached_regs(cache_dir, all_regs):
+    from common.trace_cache import load_cache, BLOCK_SIZE
+    cache = load_cache(cache_dir)
+    names = cache["tables"]["regs"]
+    size = len(names) + 1 # Shift by one so that bin 0 counts the unused registers
+    rs_counts = np.zeros(size, dtype=np.int64)
+    rd_counts = np.zeros(size, dtype=np.int64)
+    for start in range(0, cache["meta"]["length"], BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        rs_counts += np.bincount(cache["rs1"][block] + 1, minlength=size)
+        rs_counts += np.bincount(cache["rs2"][block] + 1, minlength=size)
+        rd_counts += np.bincount(cache["rd"][block] + 1, minlength=size)
+    return fill_regs(all_regs, names, rs_counts[1:], rd_counts[1:])
+
+# Same as track_function_regs() but straight from the register and pc columns of
+#   a trace cache. The registers of every function are counted in a single
+#   np.bincount per column, on the function index and register number combined.
+def track_cached_function_regs(cache_dir, all_regs, index):
+    from common.trace_cache import load_cache, BLOCK_SIZE
+    cache = load_cache(cache_dir)
+    names = cache["tables"]["regs"]
+    size = len(names) + 1 # Shift by one so that bin 0 counts the unused registers
+    functions = len(index.names) + 1 # Row 0 counts the PCs outside every symbol
+    lengths = np.zeros(functions, dtype=np.int64)
+    rs_counts = np.zeros(functions * size, dtype=np.int64)
+    rd_counts = np.zeros(functions * size, dtype=np.int64)
+    for start in range(0, cache["meta"]["length"], BLOCK_SIZE):
+        block = slice(start, start + BLOCK_SIZE)
+        rows = index.lookup(cache["pc"][block]) + 1
+        lengths += np.bincount(rows, minlength=functions)
+        rows = rows * size + 1
+        rs_counts += np.bincount(rows + cache["rs1"][block], minlength=functions * size)
+        rs_counts += np.bincount(rows + cache["rs2"][block], minlength=functions * size)
+        rd_counts += np.bincount(rows + cache["rd"][block], minlength=functions * size)
+    rs_counts = rs_counts.reshape(functions, size)
+    rd_counts = rd_counts.reshape(functions, size)
+
+    function_regs = {index.name(row - 1) : fill_regs(all_regs, names,
+        rs_counts[row][1:], rd_counts[row][1:]) for row in np.flatnonzero(lengths).tolist()}
+    return fill_regs(all_regs, names, rs_counts.sum(axis=0)[1:],
+        rd_counts.sum(axis=0)[1:]), function_regs
+
+# Sum the register counters of each hart
+def merge_regs(results):
+    merged = {}
+    for all_regs in results:
+        for reg, counters in all_regs.items():
+            merged_counters = merged.setdefault(reg, {"rs" : 0, "rd" : 0})
+            merged_counters["rs"] += counters["rs"]
+            merged_counters["rd"] += counters["rd"]
+    return merged
     
 def main():
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
+    args = parse_args()
     # Keys we want to access from the .isa files
     key_list = ["Type", "Format"]
     all_instrs, regs = check_isa(args.isa, key_list, reg=True)
-    track_regs(instr_trace, all_instrs, regs)
+    function_results = None
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        hart_results = analyse_trace_per_hart(partial(track_regs, all_regs=regs),
+            sys.stdin, args.cache, all_instrs, args.processes)
+        all_regs = merge_regs(hart_results.values())
+    elif args.cache and args.dasm:
+        all_regs, function_results = track_cached_function_regs(args.cache, regs,
+            symbol_index(args.dasm))
+    elif args.cache:
+        all_regs = track_cached_regs(args.cache, regs)
+    else:
+        # Stream the instruction trace from stdin, decoding the registers as we go
+        decode_cache = DecodeCache(all_instrs,
+            args.decode_cache_size or DECODE_CACHE_SIZE)
+        instr_trace = open_trace(all_instrs=all_instrs, decode_cache=decode_cache)
+        if args.dasm:
+            all_regs, function_results = track_function_regs(instr_trace, regs,
+                symbol_index(args.dasm))
+        else:
+            all_regs = track_regs(instr_trace, regs)
+        if args.decode_stats:
+            decode_cache.report()
+
+    if args.jsondump:
+        with open(args.jsondump, 'w') as dump:
+            dump.write(json.dumps(all_regs))
+        if args.per_hart:
+            for hart, hart_regs in hart_results.items():
+                with open(hart_path(args.jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps(hart_regs))
+        if function_results is not None:
+            for name, function_regs in function_results.items():
+                with open(function_path(args.jsondump, name), 'w') as dump:
+                    dump.write(json.dumps(function_regs))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -18,13 +18,15 @@ import json
 import matplotlib.pyplot as plt
 
 # Input argument parsing (to detect the input filepath)
-parser = argparse.ArgumentParser()
-parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
-parser.add_argument("-i", "--img", help="Filepath/name prefix for the output figure")
-args = parser.parse_args()
-
-# Function used to take a general counter list in and plot bar columns
-def display_general_barchart(name, counter_list):
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for input JSON files")
+    parser.add_argument("-i", "--img", help="Filepath/name prefix for the output figure")
+    return parser.parse_args(argv)
+
+# Function used to take a general counter list in and plot bar columns, saved
+#   to <img>_<name>
+def display_general_barchart(name, counter_list, img):
     if not isinstance(counter_list, list):
         return
 
@@ -49,10 +51,10 @@ def display_general_barchart(name, counter_list):
         plt.xlabel("Registers")
         plt.ylabel("Number of times read to")
     
-    plt.savefig(args.img+"_"+name)
+    plt.savefig(img+"_"+name)
 
 # Function used to see how much each register available in the system was used as a source or destination register
-def reg_distribution_plot(all_regs):
+def reg_distribution_plot(all_regs, img):
     reg_names = [x[0] for x in all_regs]
     rs_list = [x[1]["rs"] for x in all_regs]
     rd_list = [x[1]["rd"] for x in all_regs]
@@ -66,9 +68,10 @@ def reg_distribution_plot(all_regs):
     plt.ylabel("Frequency")
     plt.legend()
 
-    plt.savefig(args.img+"_dist")
+    plt.savefig(img+"_dist")
 
 def main():
+    args = parse_args()
     # Read in the associated lists and store in the data dictionary
     with open(args.jsondump, 'r') as dump:
         data = json.load(dump)
@@ -78,17 +81,17 @@ def main():
 
     all_regs = list(data.items())
     # Visualise the distribution of the registers with what they are used as (rs and rd)
-    reg_distribution_plot(all_regs)
+    reg_distribution_plot(all_regs, args.img)
 
     rs_list = [[x[0], x[1]["rs"]] for x in all_regs if x[1]["rs"] > 0]
     sorted_rs_list = sorted(rs_list, key=lambda x: x[1], reverse=True)
     # Plot the general bar chart giving the most popular regs used as source regs
-    display_general_barchart("rs", sorted_rs_list)
+    display_general_barchart("rs", sorted_rs_list, args.img)
 
     rd_list = [[x[0], x[1]["rd"]] for x in all_regs if x[1]["rd"] > 0]
     sorted_rd_list = sorted(rd_list, key=lambda x: x[1], reverse=True)
     # Plot the general bar chart giving the most popular regs used as dest regs
-    display_general_barchart("rd", sorted_rd_list)
+    display_general_barchart("rd", sorted_rd_list, args.img)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -18,44 +18,62 @@ import os
 import json
 
 # Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("--isa", help="RISC-V ISA string")
-parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
-args = parser.parse_args() # ISA argument stored in args.isa
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("--decode_cache_size", type=int, help="Maximum number of static \
+        instructions held in the decode cache, defaults to 65536")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the hit/miss \
+        statistics of the decode cache to stderr")
+    return parser.parse_args(argv)
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.isa_management import check_isa
 from common.helper_functions import append_to_counter_dict
-from common.reg_functions import parse_instruction
 from common.pattern_detection import print_pairs
+from common.trace_reader import open_trace
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.chunking import analyse_chunks
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
 
 # Measure the most frequent instruction pairs where there is an rs
-def track_insn_rs_pairs(instr_trace, all_instrs):
+def track_insn_rs_pairs(instr_trace):
     pairs_dict = {}
     key_string = ""
 
-    counter = 0
-    while not key_string:
-        line = instr_trace[counter].split()
-        insn = line[4]
-        rs1, rs2, _ = parse_instruction(line[4:], all_instrs)
+    instr_trace = iter(instr_trace)
+    for record in instr_trace:
+        insn = record.insn
+        rs1, rs2 = record.rs1, record.rs2
 
         if rs1:
             key_string = insn + " rs1[" + rs1 + "]"
             if rs2:
                 key_string += " rs2[" + rs2 + "]"
             key_string += ", "
-        counter += 1
+            break
 
-    for line in instr_trace[counter:]:
-        line_list = line.split()
-        insn = line_list[4]
-        rs1, rs2, _ = parse_instruction(line_list[4:], all_instrs)
+    for record in instr_trace:
+        insn = record.insn
+        rs1, rs2 = record.rs1, record.rs2
 
         # ---- If we want instructions without an rs to NOT BREAK patterns ---- #
         # if rs1:
@@ -86,25 +104,22 @@ def track_insn_rs_pairs(instr_trace, all_instrs):
     return sorted(pairs_dict.items(), key=lambda x: x[1], reverse=True)
 
 # Measure the most frequent instruction pairs where there is an rd
-def track_insn_rd_pairs(instr_trace, all_instrs):
+def track_insn_rd_pairs(instr_trace):
     pairs_dict = {}
     key_string = ""
 
-    counter = 0
-    while not key_string:
-        line = instr_trace[counter].split()
-        insn = line[4]
-        _, _, rd = parse_instruction(line[4:], all_instrs)
+    instr_trace = iter(instr_trace)
+    for record in instr_trace:
+        insn = record.insn
+        rd = record.rd
 
         if rd:
             key_string = insn + " rd[" + rd + "], "
-        
-        counter += 1
+            break
 
-    for line in instr_trace[counter:]:
-        line_list = line.split()
-        insn = line_list[4]
-        _, _, rd = parse_instruction(line_list[4:], all_instrs)
+    for record in instr_trace:
+        insn = record.insn
+        rd = record.rd
 
         # ---- If we want instructions without an rd to NOT BREAK patterns ---- #
         # if rd:
@@ -126,15 +141,14 @@ def track_insn_rd_pairs(instr_trace, all_instrs):
     return sorted(pairs_dict.items(), key=lambda x: x[1], reverse=True)
 
 # Measure the most frequent instruction pairs where there is either an rs or rd
-def track_insn_rs_rd_pairs(instr_trace, all_instrs):
+def track_insn_rs_rd_pairs(instr_trace):
     pairs_dict = {}
     key_string = ""
 
-    counter = 0
-    while not key_string:
-        line = instr_trace[counter].split()
-        insn = line[4]
-        rs1, rs2, rd = parse_instruction(line[4:], all_instrs)
+    instr_trace = iter(instr_trace)
+    for record in instr_trace:
+        insn = record.insn
+        rs1, rs2, rd = record.rs1, record.rs2, record.rd
 
         if rs1:
             key_string = insn + " rs1[" + rs1 + "]"
@@ -149,13 +163,11 @@ def track_insn_rs_rd_pairs(instr_trace, all_instrs):
         
         if key_string:
             key_string += ", "
+            break
 
-        counter += 1
-
-    for line in instr_trace[counter:]:
-        line_list = line.split()
-        insn = line_list[4]
-        rs1, rs2, rd = parse_instruction(line_list[4:], all_instrs)
+    for record in instr_trace:
+        insn = record.insn
+        rs1, rs2, rd = record.rs1, record.rs2, record.rd
 
         # ---- If we want instructions without an rs/rd to NOT BREAK patterns ---- #
         # s_append = ""
@@ -206,58 +218,87 @@ def track_insn_rs_rd_pairs(instr_trace, all_instrs):
 
 # Function used to track the most frequent instruction + (registers) patterns regardless
 #   on whether or not there are registers associated with that instruction
-def track_all_insn_pairs(instr_trace, all_instrs):
-    pairs_dict = {}
-    key_string = ""
+def track_all_insn_pairs(instr_trace):
+    pairs_dict = count_all_insn_pairs(instr_trace)
+    return sorted(pairs_dict.items(), key=lambda x: x[1], reverse=True)
 
-    # Initialise with the first instruction only
-    line = instr_trace[0].split()
-    insn = line[4]
-    rs1, rs2, rd = parse_instruction(line[4:], all_instrs)
+# Instruction name followed by its registers e.g. "c.sw rs1[a0] rs2[s0]"
+def insn_reg_string(record):
+    insn_string = record.insn
+    if record.rs1:
+        insn_string += " rs1[" + record.rs1 + "]"
+        if record.rs2:
+            insn_string += " rs2[" + record.rs2 + "]"
+    if record.rd:
+        insn_string += " rd[" + record.rd + "]"
+    return insn_string
+
+# Incremental counter of the pairs of track_all_insn_pairs(), pushed one record
+#   at a time
+class InsnRegPairCounter:
+    def __init__(self):
+        self.pairs_dict = {}
+        self.key_string = None # Previous instruction, None before the first one
+
+    def push(self, record):
+        s_append = insn_reg_string(record)
+        if self.key_string is not None:
+            append_to_counter_dict(self.pairs_dict, self.key_string+s_append)
+        self.key_string = s_append + ", "
+
+# Count the pairs of track_all_insn_pairs() without sorting them, so that the
+#   counters can be merged between the chunks of a trace file
+def count_all_insn_pairs(instr_trace):
+    counter = InsnRegPairCounter()
+    push = counter.push
+    for record in instr_trace:
+        push(record)
+    return counter.pairs_dict
+
+# Write the instruction+reg pairs (jsondump) and their formatted version to out,
+#   followed by those of every hart when given
+def write_insn_reg_pairs(result, out=sys.stdout, jsondump=None, hart_results=None):
+    if jsondump:
+        with open(jsondump, 'w') as dump:
+            dump.write(json.dumps(result))
 
-    key_string = insn
-    if rs1:
-        key_string += " rs1[" + rs1 + "]"
-        if rs2:
-            key_string += " rs2[" + rs2 + "]"
-        
-    if rd:
-        key_string += " rd[" + rd + "]"
-    
-    key_string += ", "
-
-    # Iterate through the rest of the instructions
-    for line in instr_trace[1:]:
-        line_list = line.split()
-        insn = line_list[4]
-        rs1, rs2, rd = parse_instruction(line_list[4:], all_instrs)
-
-        s_append = insn
-        if rs1:
-            s_append += " rs1[" + rs1 + "]"
-            if rs2:
-                s_append += " rs2[" + rs2 + "]"
+    print_pairs(result, out)
 
-        if rd:
-            s_append += " rd[" + rd + "]"
-        
-        append_to_counter_dict(pairs_dict, key_string+s_append)
-        key_string = s_append + ", "
-    
-    return sorted(pairs_dict.items(), key=lambda x: x[1], reverse=True)
+    if hart_results is not None:
+        for hart, hart_result in hart_results.items():
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps(hart_result))
+            print("Most common instruction+reg pairs for hart "+str(hart), file=out)
+            print_pairs(hart_result, out)
 
 def main():
+    args = parse_args()
     all_instrs = check_isa(args.isa)
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
-
-    result = track_all_insn_pairs(instr_trace, all_instrs)
-
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
-            dump.write(json.dumps(result))
-
-    print_pairs(result)
+    hart_results = None
+
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        hart_results = analyse_trace_per_hart(track_all_insn_pairs, sys.stdin,
+            args.cache, all_instrs, args.processes)
+        result = sorted(merge_counts(hart_results.values()).items(),
+            key=lambda x: x[1], reverse=True)
+    elif args.trace and not args.cache:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instruction before it to count the pair crossing the seam
+        result = sorted(analyse_chunks(count_all_insn_pairs, args.trace, args.workers,
+            overlap=1, all_instrs=all_instrs).items(), key=lambda x: x[1], reverse=True)
+    else:
+        # Stream the instruction trace from the cache or stdin, decoding the
+        #   registers as we go
+        decode_cache = DecodeCache(all_instrs,
+            args.decode_cache_size or DECODE_CACHE_SIZE)
+        instr_trace = open_trace(args.cache, all_instrs, decode_cache=decode_cache)
+        result = track_all_insn_pairs(instr_trace)
+        if args.decode_stats:
+            decode_cache.report()
+
+    write_insn_reg_pairs(result, jsondump=args.jsondump, hart_results=hart_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
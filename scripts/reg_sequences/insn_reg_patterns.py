@@ -24,58 +24,72 @@ import sys
 import argparse
 import os
 import json
+from functools import partial
 
 # Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("--isa", help="RISC-V ISA string")
-parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
-parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
-    for the formatted unfiltered output patterns (prior to identifying the local \
-    maxima). Two files are produced from this : a readable .txt file and a .JSON file")
-args = parser.parse_args() # ISA argument stored in args.isa
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--isa", help="RISC-V ISA string")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
+    parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
+        for the formatted unfiltered output patterns (prior to identifying the local \
+        maxima). Two files are produced from this : a readable .txt file and a .JSON file")
+    parser.add_argument("-b", "--budget", type=int, help="Maximum number of pattern \
+        counters held in memory. Switches to approximate top-k counting with \
+        Space-Saving sketches, the error bounds are reported on stderr")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("--decode_cache_size", type=int, help="Maximum number of static \
+        instructions held in the decode cache, defaults to 65536")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the hit/miss \
+        statistics of the decode cache to stderr")
+    parser.add_argument("--blocks", action="store_true", help="Count the patterns \
+        on the basic blocks of the trace, once per block rather than once per \
+        execution. Same results, much faster on loops")
+    args = parser.parse_args(argv)
+    if args.blocks and (args.budget or args.trace):
+        parser.error("--blocks can't be used along with --budget or --trace")
+    return args
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.isa_management import check_isa
-from common.helper_functions import append_to_counter_dict
-from common.reg_functions import parse_instruction
 from common.pattern_detection import local_maxima, print_pairs
+from common.sketches import report_error_bounds
+from common.ngram import NgramCounter
+from common.trace_reader import open_trace
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.chunking import analyse_chunks, join_sizes
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
+
+# Number of bits per instruction string id in the packed pattern keys of
+#   NgramCounter, allowing for up to 2**20 distinct instruction strings (each
+#   static instruction along with its operands)
+INSN_BITS = 20
 
 # Function that parses register information in case we want to expand upon this
 #   and look at further information when looking at patterns e.g. specific combinations of
-#   instructions and registers
-def track_all_insn_patterns(instr_trace, window_size, all_instrs):
-    pattern_dict = {}
-    window = []
-
-    # Initialise the first window
-    for i in range(window_size):
-        line = instr_trace[i].split()
-        insn = line[4]
-        insn_string = insn
-        rs1, rs2, rd = parse_instruction(line[4:], all_instrs)
+#   instructions and registers. Counts every size in window_sizes in a single pass.
+def track_all_insn_patterns(instr_trace, window_sizes, budget=None):
+    counter = NgramCounter(window_sizes, INSN_BITS, budget)
 
-        if rs1:
-            insn_string += " rs1[" + rs1 + "]"
-            if rs2:
-                insn_string += " rs2[" + rs2 + "]"
-        if rd:
-            insn_string += " rd[" + rd + "]"
-        window.append(insn_string)
-
-    key_string = ', '.join(window)
-    append_to_counter_dict(pattern_dict, key_string)
-
-    # Iterate through the rest of the window
-    for line in instr_trace[window_size:]:
-        line_list = line.split()
-        insn = line_list[4]
-        insn_string = insn
-        rs1, rs2, rd = parse_instruction(line_list[4:], all_instrs)
+    for record in instr_trace:
+        insn_string = record.insn
+        rs1, rs2, rd = record.rs1, record.rs2, record.rd
 
         if rs1:
             insn_string += " rs1[" + rs1 + "]"
@@ -84,61 +98,140 @@ def track_all_insn_patterns(instr_trace, window_size, all_instrs):
         if rd:
             insn_string += " rd[" + rd + "]"
 
-        window.append(insn_string)
-        window = window[1:]
-        key_string = ', '.join(window)
-        append_to_counter_dict(pattern_dict, key_string)
+        counter.push(insn_string)
     
-    return pattern_dict
+    if budget is not None:
+        report_error_bounds(counter.counts, "instruction+reg patterns")
+    return counter.render()
 
 # Function that just ignores parsing any register information and does it in
 #   simplest way possible
-def track_all_insn_patterns_simple(instr_trace, window_size):
-    patterns_dict = {}
-    window = []
-
-    window = [x[34:-1] for x in instr_trace[:window_size]]
-    patterns_dict[', '.join(window)] = 1
+def track_all_insn_patterns_simple(instr_trace, window_sizes, budget=None):
+    counter = NgramCounter(window_sizes, INSN_BITS, budget)
+    push = counter.push
 
-    for line in instr_trace[window_size:]:
-        window.append(line[34:-1])
-        window = window[1:]
-        append_to_counter_dict(patterns_dict, ', '.join(window))
+    for record in instr_trace:
+        push(record.text)
     
-    return patterns_dict
-
-def main():
-    all_instrs = check_isa(args.isa)
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
-
-    all_patterns_dict = {}
-
-    min_pattern_size = 3
-    max_pattern_size = 8
-    for i in range(min_pattern_size, max_pattern_size):
-        all_patterns_dict.update(track_all_insn_patterns_simple(instr_trace, i))
+    if budget is not None:
+        report_error_bounds(counter.counts, "instruction+reg patterns")
+    return counter.render()
+
+# Count the patterns of track_all_insn_patterns_simple() exactly, returning a
+#   tuple of dictionaries (one per size) that can be merged between the chunks
+#   of a trace file
+def count_all_insn_patterns_simple(instr_trace, window_sizes):
+    counter = NgramCounter(window_sizes, INSN_BITS)
+    push = counter.push
+
+    for record in instr_trace:
+        push(record.text)
+
+    return counter.render_sizes()
+
+# Same as track_all_insn_patterns_simple() but counting the patterns on the
+#   basic blocks of the trace (see basic_blocks.py) one chunk at a time, only
+#   exact counts
+def track_block_insn_patterns(instr_trace, window_sizes):
+    from common.basic_blocks import ChunkedBlockNgrams, block_chunks
+    counter = NgramCounter(window_sizes, INSN_BITS)
+    block_counts = ChunkedBlockNgrams(window_sizes, INSN_BITS)
+    ids = []
+    def push(record):
+        ids.append(counter.token_id(record.text))
+    for blocks in block_chunks(instr_trace, push):
+        block_counts.push(ids, blocks)
+        ids.clear()
+    counter.counts = block_counts.result()
+    return counter.render()
+
+# Same as track_block_insn_patterns() but using the interned text, pc and
+#   encoding columns of a trace cache
+def track_cached_block_insn_patterns(cache_dir, window_sizes):
+    from common.trace_cache import load_cache
+    from common.basic_blocks import block_counter
+    cache = load_cache(cache_dir)
+    return block_counter(cache["text"], cache["tables"]["texts"], cache["pc"],
+        cache["encoding"], window_sizes, INSN_BITS).render()
+
+# Filter the patterns dictionary and write the results : the unfiltered
+#   patterns (rawdump), the filtered patterns (jsondump) and their formatted
+#   version to out, followed by those of every hart when given
+def write_insn_reg_patterns(all_patterns_dict, out=sys.stdout, jsondump=None,
+        rawdump=None, hart_results=None):
+    minimum_count = 1
+    diff_threshold = 5
 
     # Optional raw information prior to the local maxima calculations can
     #   be saved and stored in their own files
-    if args.rawdump:
+    if rawdump:
         raw_result = sorted(all_patterns_dict.items(), key=lambda x: x[1], reverse=True)
-        with open(args.rawdump+".JSON", 'w') as dump:
+        with open(rawdump+".JSON", 'w') as dump:
             dump.write(json.dumps(raw_result))
-        with open(args.rawdump+".txt", 'w') as dump:
+        with open(rawdump+".txt", 'w') as dump:
             dump.write("Raw instruction + reg patterns counters\n")
             dump.write(json.dumps(print_pairs(raw_result, dump)))
 
-    minimum_count = 1
-    diff_threshold = 5
     result = local_maxima(all_patterns_dict, minimum_count, diff_threshold, False)
 
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
+    if jsondump:
+        with open(jsondump, 'w') as dump:
             dump.write(json.dumps(result))
 
-    print("Filtered most common instruction+reg patterns")
-    print_pairs(result)
+    print("Filtered most common instruction+reg patterns", file=out)
+    print_pairs(result, out)
+
+    if hart_results is not None:
+        for hart, hart_patterns in hart_results.items():
+            hart_result = local_maxima(hart_patterns, minimum_count, diff_threshold, False)
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps(hart_result))
+            print("Filtered most common instruction+reg patterns for hart "+str(hart),
+                file=out)
+            print_pairs(hart_result, out)
+
+def main():
+    args = parse_args()
+    all_instrs = check_isa(args.isa)
+
+    min_pattern_size = 3
+    max_pattern_size = 8
+    window_sizes = range(min_pattern_size, max_pattern_size)
+    hart_results = None
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        if args.blocks:
+            track = partial(track_block_insn_patterns, window_sizes=window_sizes)
+        else:
+            track = partial(track_all_insn_patterns_simple, window_sizes=window_sizes,
+                budget=args.budget)
+        hart_results = analyse_trace_per_hart(track, sys.stdin, args.cache, all_instrs,
+            args.processes)
+        all_patterns_dict = merge_counts(hart_results.values())
+    elif args.trace and not args.cache:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instructions before it to count the patterns crossing the seam
+        all_patterns_dict = join_sizes(analyse_chunks(
+            partial(count_all_insn_patterns_simple, window_sizes=window_sizes),
+            args.trace, args.workers, overlap=max_pattern_size-2, all_instrs=all_instrs))
+    elif args.cache and args.blocks:
+        all_patterns_dict = track_cached_block_insn_patterns(args.cache, window_sizes)
+    elif args.blocks:
+        all_patterns_dict = track_block_insn_patterns(open_trace(), window_sizes)
+    else:
+        # Stream the instruction trace from the cache or stdin, decoding the
+        #   registers as we go
+        decode_cache = DecodeCache(all_instrs,
+            args.decode_cache_size or DECODE_CACHE_SIZE)
+        instr_trace = open_trace(args.cache, all_instrs, decode_cache=decode_cache)
+        all_patterns_dict = track_all_insn_patterns_simple(instr_trace, window_sizes,
+            args.budget)
+        if args.decode_stats:
+            decode_cache.report()
+
+    write_insn_reg_patterns(all_patterns_dict, jsondump=args.jsondump,
+        rawdump=args.rawdump, hart_results=hart_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
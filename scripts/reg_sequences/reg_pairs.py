@@ -20,33 +20,53 @@ import os
 import json
 
 # Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("-i", "--isa", help="RISC-V ISA string")
-parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
-args = parser.parse_args() # ISA argument stored in args.isa
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--isa", help="RISC-V ISA string")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for the JSON files")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("--decode_cache_size", type=int, help="Maximum number of static \
+        instructions held in the decode cache, defaults to 65536")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the hit/miss \
+        statistics of the decode cache to stderr")
+    return parser.parse_args(argv)
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.isa_management import check_isa
-from common.reg_functions import parse_instruction
 from common.helper_functions import append_to_counter_dict
 from common.pattern_detection import print_pairs
+from common.trace_reader import open_trace
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.chunking import analyse_chunks, reg_tokens
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
 
 # Iterate through instruction trace and count the most frequent register access pairs (rs)
-def track_rs_pairs(instr_trace, all_instrs):
+def track_rs_pairs(instr_trace):
     pairs_dict = {}
     # String variable forming the base which we'll make the keys from
     key_string = ""
 
-    counter = 0
-    # Initialise key_string
-    while not key_string:
-        line = instr_trace[counter]
-        rs1, rs2, _ = parse_instruction(line.split()[4:], all_instrs)
+    # Initialise key_string, the rest of the trace is then read from the same
+    #   iterator below
+    instr_trace = iter(instr_trace)
+    for record in instr_trace:
+        rs1, rs2 = record.rs1, record.rs2
 
         if rs1:
             key_string = rs1 + ", "
@@ -54,12 +74,11 @@ def track_rs_pairs(instr_trace, all_instrs):
                 key_string += rs2
                 append_to_counter_dict(pairs_dict, key_string)
                 key_string = rs2 + ", "
-
-        counter += 1
+            break
 
     # key_string is guaranteed to have a reg already in it now
-    for line in instr_trace[counter:]:
-        rs1, rs2, _ = parse_instruction(line.split()[4:], all_instrs)
+    for record in instr_trace:
+        rs1, rs2 = record.rs1, record.rs2
         # print("rs1 :"+rs1+", rs2:"+rs2)
 
         if rs1: # Variable present in rs1, append to pairing
@@ -82,23 +101,22 @@ def track_rs_pairs(instr_trace, all_instrs):
     return sorted_pairs
 
 # Iterate through instruction trace and count the most frequent register access pairs (rd)
-def track_rd_pairs(instr_trace, all_instrs):
+def track_rd_pairs(instr_trace):
     pairs_dict = {}
     # String variable forming the base which we'll make the keys from
     key_string = ""
 
-    counter = 0
     # Initialise key_string
-    while not key_string:
-        line = instr_trace[counter]
-        _, _, rd = parse_instruction(line.split()[4:], all_instrs)
+    instr_trace = iter(instr_trace)
+    for record in instr_trace:
+        rd = record.rd
         if rd:
             key_string += rd + ", "
-        counter += 1
+            break
 
     # key_string is guaranteed to have a reg already in it now
-    for line in instr_trace[counter:]:
-        _, _, rd = parse_instruction(line.split()[4:], all_instrs)
+    for record in instr_trace:
+        rd = record.rd
         if rd:
             # print(rd)
             key_string += rd
@@ -110,86 +128,120 @@ def track_rd_pairs(instr_trace, all_instrs):
     return sorted_pairs
 
 # Function that tracks both rs and rd patterns in a single iteration
-def track_rs_rd_pairs(instr_trace, all_instrs):
-    rs_dict = {}
-    rd_dict = {}
-    # String variable forming the base which we'll make the keys from
-    rs_string = ""
-    rd_string = ""
-
-    counter = 0
-    # Initialise strings
-    while not rs_string and not rd_string:
-        line = instr_trace[counter]
-        rs1, rs2, rd = parse_instruction(line.split()[4:], all_instrs)
-
-        if rs1:
-            if rs_string: # Already has a reg in it
-                rs_string += rs1
-                append_to_counter_dict(rs_dict, rs_string)
-            rs_string = rs1 + ", "
-
-            if rs2: # Guaranteed to already have a reg in rs_string beforehand
-                rs_string += rs2
-                append_to_counter_dict(rs_dict, rs_string)
-                rs_string = rs2 + ", "
-
-        if rd:
-            if rd_string: # Already has a reg
-                rd_string += rd
-                append_to_counter_dict(rd_dict, rd_string)
-            rd_string = rd + ", "
-        counter += 1
-
-    for line in instr_trace[counter:]:
-        rs1, rs2, rd = parse_instruction(line.split()[4:], all_instrs)
-        # print("rs1 :"+rs1+", rs2:"+rs2+", rd:"+rd)
-
-        if rs1:
-            # print("rs1: "+rs1)
-            rs_string += rs1
-            append_to_counter_dict(rs_dict, rs_string)
-            rs_string = rs1 + ", "
-            if rs2:
-                # print("rs2: "+rs2)
-                rs_string += rs2
-                append_to_counter_dict(rs_dict, rs_string)
-                rs_string = rs2 + ", "
-
-        if rd:
-            # print("rd: "+rd)
-            rd_string += rd
-            append_to_counter_dict(rd_dict, rd_string)
-            rd_string = rd + ", "
-
+def track_rs_rd_pairs(instr_trace):
+    rs_dict, rd_dict = count_rs_rd_pairs(instr_trace)
     sorted_rs = sorted(rs_dict.items(), key=lambda x: x[1], reverse=True)
     sorted_rd = sorted(rd_dict.items(), key=lambda x: x[1], reverse=True)
 
     return sorted_rs, sorted_rd
 
-def main():
-    all_instrs = check_isa(args.isa)
+# Incremental counter of the rs and rd pairs, pushed one record at a time so
+#   that it can also be fed by a driver reading the trace in batches. Records
+#   before the first register are handled in the same way as the first phase of
+#   count_rs_rd_pairs() used to: a lone register is only counted once a register
+#   has been seen in either stream.
+class RsRdPairCounter:
+    def __init__(self):
+        self.rs_dict = {}
+        self.rd_dict = {}
+        # String variable forming the base which we'll make the keys from
+        self.rs_string = ""
+        self.rd_string = ""
+        self.started = False
+
+    def push(self, record):
+        rs1, rs2, rd = record.rs1, record.rs2, record.rd
 
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
+        if rs1:
+            if self.rs_string or self.started: # Already has a reg in it
+                self.rs_string += rs1
+                append_to_counter_dict(self.rs_dict, self.rs_string)
+            self.rs_string = rs1 + ", "
 
-    # # Individual pair tracking
-    # print("Most common RS pairs")
-    # print_pairs(track_rs_pairs(instr_trace, all_instrs))
-    # print("Most common RD pairs")
-    # print_pairs(track_rd_pairs(instr_trace, all_instrs))
+            if rs2: # Guaranteed to already have a reg in rs_string beforehand
+                self.rs_string += rs2
+                append_to_counter_dict(self.rs_dict, self.rs_string)
+                self.rs_string = rs2 + ", "
 
-    rs_list, rd_list = track_rs_rd_pairs(instr_trace, all_instrs)
+        if rd:
+            if self.rd_string or self.started: # Already has a reg
+                self.rd_string += rd
+                append_to_counter_dict(self.rd_dict, self.rd_string)
+            self.rd_string = rd + ", "
+
+        if self.rs_string or self.rd_string:
+            self.started = True
+
+# Count the rs and rd pairs without sorting them, so that the counters can be
+#   merged between the chunks of a trace file
+def count_rs_rd_pairs(instr_trace):
+    counter = RsRdPairCounter()
+    push = counter.push
+    for record in instr_trace:
+        push(record)
+    return counter.rs_dict, counter.rd_dict
+
+# Write the RS and RD pairs (jsondump) and their formatted version to out,
+#   followed by those of every hart when given
+def write_reg_pairs(rs_list, rd_list, out=sys.stdout, jsondump=None, hart_results=None):
     result = {"rs_list" : rs_list, "rd_list" : rd_list}
 
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
+    if jsondump:
+        with open(jsondump, 'w') as dump:
             dump.write(json.dumps(result))
 
-    print("Most common RS pairs")
-    print_pairs(rs_list)
-    print("Most common RD pairs")
-    print_pairs(rd_list)
+    print("Most common RS pairs", file=out)
+    print_pairs(rs_list, out)
+    print("Most common RD pairs", file=out)
+    print_pairs(rd_list, out)
+
+    if hart_results is not None:
+        for hart, (hart_rs, hart_rd) in hart_results.items():
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps({"rs_list" : hart_rs, "rd_list" : hart_rd}))
+            print("Most common RS pairs for hart "+str(hart), file=out)
+            print_pairs(hart_rs, out)
+            print("Most common RD pairs for hart "+str(hart), file=out)
+            print_pairs(hart_rd, out)
+
+def main():
+    args = parse_args()
+    all_instrs = check_isa(args.isa)
+    hart_results = None
+
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        hart_results = analyse_trace_per_hart(track_rs_rd_pairs, sys.stdin,
+            args.cache, all_instrs, args.processes)
+        rs_list = sorted(merge_counts(r[0] for r in hart_results.values()).items(),
+            key=lambda x: x[1], reverse=True)
+        rd_list = sorted(merge_counts(r[1] for r in hart_results.values()).items(),
+            key=lambda x: x[1], reverse=True)
+    elif args.trace and not args.cache:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instructions before it to count the pairs crossing the seam
+        rs_dict, rd_dict = analyse_chunks(count_rs_rd_pairs, args.trace, args.workers,
+            overlap=1, tokens=reg_tokens, all_instrs=all_instrs)
+        rs_list = sorted(rs_dict.items(), key=lambda x: x[1], reverse=True)
+        rd_list = sorted(rd_dict.items(), key=lambda x: x[1], reverse=True)
+    else:
+        # Stream the instruction trace from the cache or stdin, decoding the
+        #   registers as we go
+        decode_cache = DecodeCache(all_instrs,
+            args.decode_cache_size or DECODE_CACHE_SIZE)
+        instr_trace = open_trace(args.cache, all_instrs, decode_cache=decode_cache)
+
+        # # Individual pair tracking
+        # print("Most common RS pairs")
+        # print_pairs(track_rs_pairs(instr_trace))
+        # print("Most common RD pairs")
+        # print_pairs(track_rd_pairs(instr_trace))
+
+        rs_list, rd_list = track_rs_rd_pairs(instr_trace)
+        if args.decode_stats:
+            decode_cache.report()
+    write_reg_pairs(rs_list, rd_list, jsondump=args.jsondump, hart_results=hart_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -20,104 +20,114 @@ import sys
 import argparse
 import os
 import json
+from functools import partial
 
 # Input argument parsing (to detect the ISA)
-parser = argparse.ArgumentParser()
-parser.add_argument("-i", "--isa", help="RISC-V ISA string")
-parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
-parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
-    for the formatted unfiltered output patterns (prior to identifying the local \
-    maxima). Two files are produced from this : a readable .txt file and a .JSON file")
-args = parser.parse_args() # ISA argument stored in args.isa
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-i", "--isa", help="RISC-V ISA string")
+    parser.add_argument("-j", "--jsondump", help="Filepath/name for output JSON files")
+    parser.add_argument("-r", "--rawdump", help="Filepath/name (without a file extension) \
+        for the formatted unfiltered output patterns (prior to identifying the local \
+        maxima). Two files are produced from this : a readable .txt file and a .JSON file")
+    parser.add_argument("-c", "--cache", help="Trace cache directory built by \
+        trace_cache.py, read instead of the instruction trace on stdin")
+    parser.add_argument("-t", "--trace", help="Instruction trace file, split into \
+        chunks counted in parallel instead of reading the trace from stdin")
+    parser.add_argument("-w", "--workers", type=int, help="Number of worker processes \
+        used with --trace, defaults to the number of CPUs")
+    parser.add_argument("-p", "--per_hart", action="store_true", help="Split the \
+        trace by hart and analyse each hart in parallel, producing a result per hart \
+        along with the merged result")
+    parser.add_argument("--processes", type=int, help="Number of worker processes used \
+        with --per_hart, defaults to the number of CPUs")
+    parser.add_argument("--decode_cache_size", type=int, help="Maximum number of static \
+        instructions held in the decode cache, defaults to 65536")
+    parser.add_argument("--decode_stats", action="store_true", help="Print the hit/miss \
+        statistics of the decode cache to stderr")
+    parser.add_argument("--blocks", action="store_true", help="Count the patterns \
+        on the basic blocks of the trace, once per block rather than once per \
+        execution. Same results, much faster on loops")
+    args = parser.parse_args(argv)
+    if args.blocks and args.trace and not args.cache:
+        parser.error("--blocks can't be used along with --trace")
+    return args
 
 # Adding the parent directory to the python file path to 
 #   allow absolute file path inclusions
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
-sys.path.append(parent)
+if parent not in sys.path:
+    sys.path.append(parent)
 
 from common.isa_management import check_isa
-from common.helper_functions import append_to_counter_dict
-from common.reg_functions import parse_instruction
 from common.pattern_detection import local_maxima, print_pairs
+from common.ngram import NgramCounter
+from common.trace_reader import open_trace
+from common.decode_cache import DecodeCache, DECODE_CACHE_SIZE
+from common.chunking import analyse_chunks, reg_tokens
+from common.harts import analyse_trace_per_hart, merge_counts, hart_path
+
+# Number of bits per register id in the packed pattern keys of NgramCounter,
+#   keeping the keys of every pattern size within a machine word
+REG_BITS = 8
+
+# Sort the patterns of each size and join them into a single list, keeping the
+#   pattern sizes in ascending order
+def sort_size_dicts(size_dicts):
+    sorted_patterns = []
+    for n in sorted(size_dicts):
+        sorted_patterns += sorted(size_dicts[n].items(), key=lambda x: x[1], reverse=True)
+    return sorted_patterns
+
+# Dictionary of pattern size -> counters, rendered from the packed keys
+def rendered_sizes(counter):
+    return dict(zip(counter.sizes, counter.render_sizes()))
+
+# Patterns of rs registers for every size in window_sizes, counted in a single
+#   pass through the instruction trace
+def track_rs_patterns(instr_trace, window_sizes):
+    rs_counter = NgramCounter(window_sizes, REG_BITS)
+    push = rs_counter.push
+
+    for record in instr_trace:
+        if record.rs1:
+            push(record.rs1)
+            if record.rs2:
+                push(record.rs2)
+
+    return sort_size_dicts(rendered_sizes(rs_counter))
+
+def track_rd_patterns(instr_trace, window_sizes):
+    rd_counter = NgramCounter(window_sizes, REG_BITS)
+    push = rd_counter.push
+
+    for record in instr_trace:
+        if record.rd:
+            push(record.rd)
+
+    return sort_size_dicts(rendered_sizes(rd_counter))
+
+def track_rs_rd_patterns(instr_trace, window_sizes):
+    rs_sizes, rd_sizes = count_rs_rd_patterns(instr_trace, window_sizes)
+    sorted_rs = sort_size_dicts(dict(zip(sorted(window_sizes), rs_sizes)))
+    sorted_rd = sort_size_dicts(dict(zip(sorted(window_sizes), rd_sizes)))
 
-def track_rs_patterns(instr_trace, window_size, all_instrs):
-    rs_pattern_dict = {}
-    window = []
-
-    counter = 0
-    # Initialise window
-    while len(window) != window_size:
-        line = instr_trace[counter]
-        rs1, rs2, _ = parse_instruction(line.split()[4:], all_instrs)
-
-        if rs1:
-            window.append(rs1)
-            if rs2:
-                if len(window) == window_size: # Full window
-                    append_to_counter_dict(rs_pattern_dict, ', '.join(window))
-                    window.append(rs2)
-                    window = window[1:]
-                    append_to_counter_dict(rs_pattern_dict, ', '.join(window))
-                else:
-                    window.append(rs2)
-                    if len(window) == window_size:
-                        append_to_counter_dict(rs_pattern_dict, ', '.join(window))
-
-        counter += 1
-
-    for line in instr_trace[counter:]:
-        rs1, rs2, _ = parse_instruction(line.split()[4:], all_instrs)
-
-        if rs1:
-            window.append(rs1)
-            window = window[1:]
-            append_to_counter_dict(rs_pattern_dict, ', '.join(window))
-            if rs2:
-                window.append(rs2)
-                window = window[1:]
-                append_to_counter_dict(rs_pattern_dict, ', '.join(window))
-
-    return sorted(rs_pattern_dict.items(), key=lambda x: x[1], reverse=True)
-
-def track_rd_patterns(instr_trace, window_size, all_instrs):
-    rd_pattern_dict = {}
-    window = []
-
-    counter = 0
-    # Initialise window
-    while len(window) != window_size:
-        line = instr_trace[counter]
-        _, _, rd = parse_instruction(line.split()[4:], all_instrs)
-
-        if rd:
-            window.append(rd)
-            if len(window) == window_size: # Full window
-                append_to_counter_dict(rd_pattern_dict, ', '.join(window))
-
-        counter += 1
-
-    for line in instr_trace[counter:]:
-        _, _, rd = parse_instruction(line.split()[4:], all_instrs)
-
-        if rd:
-            window.append(rd)
-            window = window[1:]
-            append_to_counter_dict(rd_pattern_dict, ', '.join(window))
-
-    return sorted(rd_pattern_dict.items(), key=lambda x: x[1], reverse=True)
-
-def track_rs_rd_patterns(instr_trace, window_size, all_instrs):
-    rs_pattern_dict, rd_pattern_dict = {}, {}
-    rs_window, rd_window = [], []
+    return sorted_rs, sorted_rd
 
-    counter = 0
-    # Fill initial windows
-    while len(rs_window) != window_size or len(rd_window) != window_size:
-        line = instr_trace[counter]
-        rs1, rs2, rd = parse_instruction(line.split()[4:], all_instrs)
+# Count the rs and rd patterns without sorting them, returning a tuple of
+#   dictionaries (one per size, ascending) for each so that the counters can be
+#   merged between the chunks of a trace file. Each pattern is counted on its
+#   packed register ids and only rendered into a string at the end.
+def count_rs_rd_patterns(instr_trace, window_sizes):
+    rs_counter = NgramCounter(window_sizes, REG_BITS)
+    rd_counter = NgramCounter(window_sizes, REG_BITS)
+    push_rs, push_rd = rs_counter.push, rd_counter.push
+
+    for record in instr_trace:
+        rs1, rs2, rd = record.rs1, record.rs2, record.rd
         # Debugging
-        # print(line)
+        # print(record.text)
         # if rs1: 
         #     print("rs1:"+rs1)
         # if rs2:
@@ -127,76 +137,98 @@ def track_rs_rd_patterns(instr_trace, window_size, all_instrs):
         # print()
 
         if rs1:
-            rs_window.append(rs1)
-            if len(rs_window) == window_size + 1:
-                rs_window = rs_window[1:]
-            if len(rs_window) == window_size:
-                append_to_counter_dict(rs_pattern_dict, ', '.join(rs_window))
-            
-            if rs2:
-                rs_window.append(rs2)
-                if len(rs_window) == window_size + 1:
-                    rs_window = rs_window[1:]
-                if len(rs_window) == window_size:
-                    append_to_counter_dict(rs_pattern_dict, ', '.join(rs_window))
-
-        if rd:
-            rd_window.append(rd)
-            if len(rd_window) == window_size + 1:
-                rd_window = rd_window[1:]
-            if len(rd_window) == window_size:
-                append_to_counter_dict(rd_pattern_dict, ', '.join(rd_window))
-
-        counter += 1
-
-    for line in instr_trace[counter:]:
-        rs1, rs2, rd = parse_instruction(line.split()[4:], all_instrs)
-
-        if rs1:
-            rs_window.append(rs1)
-            rs_window = rs_window[1:]
-            append_to_counter_dict(rs_pattern_dict, ', '.join(rs_window))
+            push_rs(rs1)
             if rs2:
-                rs_window.append(rs2)
-                rs_window = rs_window[1:]
-                append_to_counter_dict(rs_pattern_dict, ', '.join(rs_window))
+                push_rs(rs2)
         if rd:
-            rd_window.append(rd)
-            rd_window = rd_window[1:]
-            append_to_counter_dict(rd_pattern_dict, ', '.join(rd_window))
-
-    sorted_rs = sorted(rs_pattern_dict.items(), key=lambda x: x[1], reverse=True)
-    sorted_rd = sorted(rd_pattern_dict.items(), key=lambda x: x[1], reverse=True)
-
-    return sorted_rs, sorted_rd
-
-def main():
+            push_rd(rd)
+
+    return rs_counter.render_sizes(), rd_counter.render_sizes()
+
+# Same as count_rs_rd_patterns() but counting the patterns on the basic blocks of
+#   the trace (see basic_blocks.py). Each instruction pushes between zero and
+#   two rs registers and at most one rd register, the offsets giving where the
+#   registers of each instruction start in the rs and rd streams.
+def count_block_rs_rd_patterns(rs, rs_offsets, rd, rd_offsets, regs, pcs, encodings,
+        window_sizes):
+    from common.basic_blocks import compress_blocks, instruction_sizes, count_block_ngrams
+    blocks = compress_blocks(pcs, instruction_sizes(encodings))
+    return tuple(render_block_counts(count_block_ngrams(tokens, blocks, window_sizes,
+        REG_BITS, offsets), regs, window_sizes)
+        for tokens, offsets in ((rs, rs_offsets), (rd, rd_offsets)))
+
+# Render the block pattern counts (size -> {packed key : counter}) of a register
+#   stream into a tuple of dictionaries (one per size, ascending), regs giving
+#   the register of every id
+def render_block_counts(counts, regs, window_sizes):
+    counter = NgramCounter(window_sizes, REG_BITS)
+    counter.counts = counts
+    counter.use_table(regs)
+    return counter.render_sizes()
+
+# Same as count_block_rs_rd_patterns() but reading the trace one chunk at a
+#   time, the rs and rd streams sharing the blocks of each chunk
+def track_block_rs_rd_patterns(instr_trace, window_sizes):
+    from common.basic_blocks import ChunkedBlockNgrams, block_chunks
+    counter = NgramCounter(window_sizes, REG_BITS) # Only used to intern the registers
+    token_id = counter.token_id
+    rs_blocks = ChunkedBlockNgrams(window_sizes, REG_BITS)
+    rd_blocks = ChunkedBlockNgrams(window_sizes, REG_BITS)
+    rs, rs_offsets, rd, rd_offsets = [], [0], [], [0]
+    def push(record):
+        if record.rs1:
+            rs.append(token_id(record.rs1))
+            if record.rs2:
+                rs.append(token_id(record.rs2))
+        if record.rd:
+            rd.append(token_id(record.rd))
+        rs_offsets.append(len(rs))
+        rd_offsets.append(len(rd))
+    for blocks in block_chunks(instr_trace, push):
+        rs_blocks.push(rs, blocks, rs_offsets)
+        rd_blocks.push(rd, blocks, rd_offsets)
+        rs.clear()
+        rd.clear()
+        del rs_offsets[1:], rd_offsets[1:]
+    rs_sizes, rd_sizes = (render_block_counts(block_counts.result(), counter.tokens,
+        window_sizes) for block_counts in (rs_blocks, rd_blocks))
+    return sort_size_dicts(dict(zip(sorted(window_sizes), rs_sizes))), \
+        sort_size_dicts(dict(zip(sorted(window_sizes), rd_sizes)))
+
+# Same as track_block_rs_rd_patterns() but straight from the register columns
+#   of a trace cache (-1 where unused)
+def track_cached_block_rs_rd_patterns(cache_dir, window_sizes):
+    import numpy as np
+    from common.trace_cache import load_cache
+    cache = load_cache(cache_dir)
+    rs1, rs2, rd = (np.asarray(cache[c], dtype=np.int64) for c in ("rs1", "rs2", "rd"))
+    # rs2 is only pushed after rs1, in the same way as count_rs_rd_patterns()
+    rs_mask = np.stack((rs1 >= 0, (rs1 >= 0) & (rs2 >= 0)), axis=1)
+    rs = np.stack((rs1, rs2), axis=1)[rs_mask]
+    rs_offsets = np.concatenate(([0], np.cumsum(rs_mask.sum(axis=1))))
+    rd_offsets = np.concatenate(([0], np.cumsum(rd >= 0)))
+    rs_sizes, rd_sizes = count_block_rs_rd_patterns(rs, rs_offsets, rd[rd >= 0],
+        rd_offsets, cache["tables"]["regs"], cache["pc"], cache["encoding"], window_sizes)
+    return sort_size_dicts(dict(zip(sorted(window_sizes), rs_sizes))), \
+        sort_size_dicts(dict(zip(sorted(window_sizes), rd_sizes)))
+
+# Filter the rs and rd patterns dictionaries and write the results : the
+#   unfiltered patterns (rawdump), the filtered patterns (jsondump) and their
+#   formatted version to out, followed by those of every hart when given
+def write_reg_patterns(rs_patterns_dict, rd_patterns_dict, out=sys.stdout,
+        jsondump=None, rawdump=None, hart_results=None):
     minimum_count = 1
     diff_threshold = 5
 
-    all_instrs = check_isa(args.isa)
-    # Read in the stdin and store in the instr_trace variable
-    instr_trace = sys.stdin.readlines()
-    rs_patterns_dict = {}
-    rd_patterns_dict = {}
-
-    for i in range(3, 8):
-        rs, rd = track_rs_rd_patterns(instr_trace, i, all_instrs)
-        
-        rs_patterns_dict.update(rs)
-        rd_patterns_dict.update(rd)
-        # rs_patterns_dict.update(track_rs_patterns(instr_trace, i, all_instrs))
-        # rd_patterns_dict.update(track_rd_patterns(instr_trace, i, all_instrs))
-
-    if args.rawdump:
+    if rawdump:
         raw_result = {}
         raw_rs_patterns = sorted(rs_patterns_dict.items(), key=lambda x: x[1], reverse=True)
         raw_rd_patterns = sorted(rd_patterns_dict.items(), key=lambda x: x[1], reverse=True)
         raw_result["raw_rs"] = raw_rs_patterns
         raw_result["raw_rd"] = raw_rd_patterns
-        with open(args.rawdump+".JSON", 'w') as dump:
+        with open(rawdump+".JSON", 'w') as dump:
             dump.write(json.dumps(raw_result))
-        with open(args.rawdump+".txt", 'w') as dump:
+        with open(rawdump+".txt", 'w') as dump:
             dump.write("Raw most common patterns of 'rs' accesses")
             dump.write(json.dumps(print_pairs(raw_rs_patterns, dump)))
             dump.write("Raw most common patterns of 'rd' accesses")
@@ -208,14 +240,72 @@ def main():
     filtered_result["filtered_rs"] = filtered_rs_patterns
     filtered_result["filtered_rd"] = filtered_rd_patterns
 
-    if args.jsondump:
-        with open(args.jsondump, 'w') as dump:
+    if jsondump:
+        with open(jsondump, 'w') as dump:
             dump.write(json.dumps(filtered_result))
 
-    print("Most common rs access sequences")
-    print_pairs(filtered_rs_patterns)
-    print("Most common rd writing sequences")
-    print_pairs(filtered_rd_patterns)
+    print("Most common rs access sequences", file=out)
+    print_pairs(filtered_rs_patterns, out)
+    print("Most common rd writing sequences", file=out)
+    print_pairs(filtered_rd_patterns, out)
+
+    if hart_results is not None:
+        for hart, (hart_rs, hart_rd) in hart_results.items():
+            hart_filtered_rs = local_maxima(dict(hart_rs), minimum_count, diff_threshold, False)
+            hart_filtered_rd = local_maxima(dict(hart_rd), minimum_count, diff_threshold, False)
+            if jsondump:
+                with open(hart_path(jsondump, hart), 'w') as dump:
+                    dump.write(json.dumps({"filtered_rs" : hart_filtered_rs,
+                        "filtered_rd" : hart_filtered_rd}))
+            print("Most common rs access sequences for hart "+str(hart), file=out)
+            print_pairs(hart_filtered_rs, out)
+            print("Most common rd writing sequences for hart "+str(hart), file=out)
+            print_pairs(hart_filtered_rd, out)
+
+def main():
+    args = parse_args()
+    all_instrs = check_isa(args.isa)
+    hart_results = None
+
+    if args.per_hart:
+        # Analyse each hart separately in parallel and merge the results
+        track = track_block_rs_rd_patterns if args.blocks else track_rs_rd_patterns
+        hart_results = analyse_trace_per_hart(partial(track, window_sizes=range(3, 8)),
+            sys.stdin, args.cache, all_instrs, args.processes)
+        rs_patterns_dict = merge_counts(r[0] for r in hart_results.values())
+        rd_patterns_dict = merge_counts(r[1] for r in hart_results.values())
+    elif args.trace and not args.cache:
+        # Count chunks of the trace file in parallel, each chunk also reads the
+        #   instructions before it to count the patterns crossing the seam
+        window_sizes = range(3, 8)
+        rs_sizes, rd_sizes = analyse_chunks(
+            partial(count_rs_rd_patterns, window_sizes=window_sizes), args.trace,
+            args.workers, overlap=max(window_sizes)-1, tokens=reg_tokens,
+            all_instrs=all_instrs)
+        rs_patterns_dict = dict(sort_size_dicts(dict(zip(window_sizes, rs_sizes))))
+        rd_patterns_dict = dict(sort_size_dicts(dict(zip(window_sizes, rd_sizes))))
+    elif args.cache and args.blocks:
+        rs, rd = track_cached_block_rs_rd_patterns(args.cache, range(3, 8))
+        rs_patterns_dict = dict(rs)
+        rd_patterns_dict = dict(rd)
+    else:
+        # Stream the instruction trace from the cache or stdin, decoding the
+        #   registers as we go
+        decode_cache = DecodeCache(all_instrs,
+            args.decode_cache_size or DECODE_CACHE_SIZE)
+        instr_trace = open_trace(args.cache, all_instrs, decode_cache=decode_cache)
+
+        track = track_block_rs_rd_patterns if args.blocks else track_rs_rd_patterns
+        rs, rd = track(instr_trace, range(3, 8))
+        rs_patterns_dict = dict(rs)
+        rd_patterns_dict = dict(rd)
+        if args.decode_stats:
+            decode_cache.report()
+        # rs_patterns_dict = dict(track_rs_patterns(instr_trace, range(3, 8)))
+        # rd_patterns_dict = dict(track_rd_patterns(instr_trace, range(3, 8)))
+
+    write_reg_patterns(rs_patterns_dict, rd_patterns_dict, jsondump=args.jsondump,
+        rawdump=args.rawdump, hart_results=hart_results)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file